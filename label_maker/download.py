@@ -1,52 +1,338 @@
 # pylint: disable=unused-argument
 """Download QA Tiles for the selected country."""
-from os import path
-import tempfile
-import gzip
+import hashlib
+import json
+import os
+from os import path as op
+import re
+import threading
+import time
+import zlib
+
 import requests
 from tqdm import tqdm
 
-def download(url, path):
-    """Download url to target path"""
-    file_size = int(requests.head(url).headers["Content-Length"])
-    header = {"Range": "bytes=%s-%s" % (0, file_size)}
-    pbar = tqdm(
-        total=file_size,
-        unit='B',
-        unit_scale=True,
-        desc=url.split('/')[-1]
-    )
-    req = requests.get(url, headers=header, stream=True)
-    with(open(path, 'ab')) as f:
-        for chunk in req.iter_content(chunk_size=1024):
-            if chunk:
-                f.write(chunk)
-                pbar.update(1024)
-    pbar.close()
-    return file_size
-
-def download_mbtiles(dest_folder, country, **kwargs):
+from label_maker.download_cache import DownloadCache, link
+from label_maker.mbtiles import subset
+
+QA_TILES_URL = 'https://s3.amazonaws.com/mapbox/osm-qa-tiles-production/latest.country/{}.mbtiles.gz'
+
+# bytes read from a connection at a time, and read from the downloaded file at a time
+CHUNK_SIZE = 1024 * 1024
+BLOCK_SIZE = 8 * 1024 * 1024
+# files aren't split into segments smaller than this
+MIN_SEGMENT_SIZE = 16 * 1024 * 1024
+# the progress of the segments is saved whenever this many more bytes have been written
+SAVE_INTERVAL = 16 * 1024 * 1024
+# the number of times a segment is requested again after a connection error, and the timeout of requests
+RETRIES = 3
+TIMEOUT = 60
+
+class SegmentedDownload():
+    """Download a file in byte-range segments over several connections, resuming a partial download
+
+    The file is written to `path + '.part'` and the progress of each segment to
+    `path + '.part.json'`. If a download is interrupted, the next download of the same URL
+    continues each segment where it stopped, as long as the size and ETag of the file haven't
+    changed. Once every segment is complete, the size and (if the ETag is one) the MD5 checksum
+    are verified and the file is moved to `path`.
+
+    Files from servers which don't accept byte ranges are downloaded over a single connection.
+
+    Parameters
+    ------------
+    url: str
+        URL of the file
+    path: str
+        Path to save the file to
+    connections: int
+        The maximum number of segments downloaded at once
+    chunk_size: int
+        The number of bytes read from a connection at a time
+    """
+    def __init__(self, url, path, connections=4, chunk_size=CHUNK_SIZE):
+        self.url = url
+        self.path = path
+        self.part_path = path + '.part'
+        self.state_path = path + '.part.json'
+        self.connections = connections
+        self.chunk_size = chunk_size
+        self.size = None
+        self.etag = None
+        self.last_modified = None
+        self.ranges = False
+        # [start, end, position] of each segment, position being the end of the data written so far
+        self.segments = []
+        self._condition = threading.Condition()
+        self._error = None
+        self._stopped = False
+        self._unsaved = 0
+
+    def stream(self, block_size=BLOCK_SIZE):
+        """Download the file, yielding its contents in order as they arrive
+
+        The data of the first incomplete segment is read back from the file as it's written,
+        in blocks of up to `block_size` bytes, while the later segments are downloaded.
+        """
+        self._probe()
+        self._plan()
+        pbar = tqdm(total=self.size, initial=self._completed(), unit='B', unit_scale=True,
+                    desc=self.url.split('/')[-1])
+        threads = [threading.Thread(target=self._fetch, args=(segment, pbar), daemon=True)
+                   for segment in self.segments if segment[2] < segment[1]]
+        for thread in threads:
+            thread.start()
+        md5 = hashlib.md5()
+        position = 0
+        try:
+            # unbuffered, so data isn't read ahead of what's been written
+            with open(self.part_path, 'rb', buffering=0) as f:
+                while position < self.size:
+                    with self._condition:
+                        while self._error is None and self._contiguous() <= position:
+                            self._condition.wait()
+                        if self._error is not None:
+                            raise self._error
+                        available = self._contiguous()
+                    f.seek(position)
+                    data = f.read(min(available - position, block_size))
+                    md5.update(data)
+                    position += len(data)
+                    yield data
+        finally:
+            with self._condition:
+                self._stopped = True
+                self._condition.notify_all()
+            for thread in threads:
+                thread.join()
+            pbar.close()
+            if op.exists(self.part_path):
+                self._save_state()
+        self._verify(md5.hexdigest())
+
+    def _probe(self):
+        """Request the size and ETag of the file, and whether the server accepts byte ranges"""
+        r = requests.head(self.url, allow_redirects=True, timeout=TIMEOUT)
+        r.raise_for_status()
+        if 'Content-Length' not in r.headers:
+            raise IOError('The size of {} is unknown'.format(self.url))
+        self.size = int(r.headers['Content-Length'])
+        self.etag = r.headers.get('ETag')
+        self.last_modified = r.headers.get('Last-Modified')
+        self.ranges = r.headers.get('Accept-Ranges') == 'bytes'
+
+    def _plan(self):
+        """Resume the segments of a previous download of the same file, or split it into new segments"""
+        if op.exists(self.state_path) and op.exists(self.part_path) and op.getsize(self.part_path) == self.size:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if self.ranges and (state.get('url'), state.get('size'), state.get('etag')) == \
+                    (self.url, self.size, self.etag):
+                self.segments = state['segments']
+                return
+        n = max(1, min(self.connections, self.size // MIN_SEGMENT_SIZE)) if self.ranges else 1
+        bounds = [self.size * i // n for i in range(n + 1)]
+        self.segments = [[start, end, start] for start, end in zip(bounds[:-1], bounds[1:])]
+        with open(self.part_path, 'wb') as f:
+            f.truncate(self.size)
+        self._save_state()
+
+    def _fetch(self, segment, pbar):
+        """Download a segment, retrying from its position after connection errors"""
+        for attempt in range(RETRIES + 1):
+            try:
+                self._fetch_range(segment, pbar)
+                return
+            except requests.RequestException as e:
+                # without byte ranges, the data already read can't be requested again
+                if attempt == RETRIES or not self.ranges or self._stopped:
+                    self._fail(e)
+                    return
+                time.sleep(2 ** attempt)
+            except Exception as e:  # pylint: disable=broad-except
+                self._fail(e)
+                return
+
+    def _fetch_range(self, segment, pbar):
+        """Request the rest of a segment and write it to the file"""
+        end = segment[1]
+        headers = dict()
+        if self.ranges:
+            headers['Range'] = 'bytes={}-{}'.format(segment[2], end - 1)
+            if self.etag:
+                # the server sends the whole file instead if it has changed
+                headers['If-Range'] = self.etag
+        with requests.get(self.url, headers=headers, stream=True, timeout=TIMEOUT) as r:
+            r.raise_for_status()
+            if self.ranges and r.status_code != 206:
+                raise IOError('{} changed during the download'.format(self.url))
+            with open(self.part_path, 'r+b') as f:
+                f.seek(segment[2])
+                for chunk in r.iter_content(self.chunk_size):
+                    if self._stopped:
+                        return
+                    chunk = chunk[:end - segment[2]]
+                    f.write(chunk)
+                    # the data must be readable before the position is advanced
+                    f.flush()
+                    with self._condition:
+                        segment[2] += len(chunk)
+                        self._unsaved += len(chunk)
+                        if self._unsaved >= SAVE_INTERVAL:
+                            self._save_state()
+                        self._condition.notify_all()
+                    pbar.update(len(chunk))
+                    if segment[2] >= end:
+                        return
+        raise requests.ConnectionError('Connection closed {} bytes before the end of a segment'.format(
+            end - segment[2]))
+
+    def _fail(self, error):
+        """Stop the download with an error, raised by `stream`"""
+        with self._condition:
+            if self._error is None:
+                self._error = error
+            self._condition.notify_all()
+
+    def _contiguous(self):
+        """Return the number of bytes written from the start of the file without a gap"""
+        for _, end, position in self.segments:
+            if position < end:
+                return position
+        return self.size
+
+    def _completed(self):
+        """Return the number of bytes written"""
+        return sum(position - start for start, _, position in self.segments)
+
+    def _save_state(self):
+        """Write the progress of the segments, replacing the previous state at once"""
+        state = dict(url=self.url, size=self.size, etag=self.etag, segments=self.segments)
+        with open(self.state_path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+        self._unsaved = 0
+
+    def _verify(self, md5):
+        """Check the size and checksum of the downloaded file and move it to its path"""
+        size = op.getsize(self.part_path)
+        etag_md5 = _etag_md5(self.etag)
+        if size != self.size or (etag_md5 and md5 != etag_md5):
+            # a corrupt download can't be resumed
+            os.remove(self.part_path)
+            os.remove(self.state_path)
+            raise IOError('{} is corrupt: expected {} bytes with ETag {}, downloaded {} bytes with MD5 {}'.format(
+                self.url, self.size, self.etag, size, md5))
+        os.replace(self.part_path, self.path)
+        os.remove(self.state_path)
+
+def _etag_md5(etag):
+    """Return the MD5 checksum an ETag is, or None, e.g. for the ETag of an S3 multipart upload"""
+    if not etag:
+        return None
+    etag = etag[2:] if etag.startswith('W/') else etag
+    etag = etag.strip('"').lower()
+    return etag if re.fullmatch('[0-9a-f]{32}', etag) else None
+
+def download(url, path, connections=4):
+    """Download url to target path, resuming a partial download (see SegmentedDownload)"""
+    segmented = SegmentedDownload(url, path, connections)
+    for _ in segmented.stream():
+        pass
+    return segmented.size
+
+def download_mbtiles(dest_folder, country, bounding_box=None, aoi=None, full=False, connections=4, cache=True,
+                     cache_dir=None, cache_size=None, **kwargs):
     """Download QA Tiles for the selected country.
 
     Download a gzipped mbtiles file of all OSM data within a country from S3.
     More details at https://osmlab.github.io/osm-qa-tiles/
 
+    The file is downloaded in segments over several connections and decompressed as it
+    arrives. An interrupted download is resumed by running the command again. Downloads are
+    kept in a cache shared by every destination folder (see `label_maker.download_cache`):
+    if the cached file is still current, it's linked into the destination folder instead.
+
+    Unless `full` is set, only the tiles within the bounding box are saved to the destination
+    folder (see `label_maker.mbtiles.subset`), so the later steps read a small file rather than
+    the whole country. The whole country is kept in the cache.
+
     Parameters
     ------------
     dest_folder: str
         Folder to save download into
     country: str
         Country for which to download the OSM QA tiles
+    bounding_box: list
+        Bounding box to save the tiles of, in the form `[xmin, ymin, xmax, ymax]`
+    aoi: shapely.geometry.base.BaseGeometry
+        An area of interest. If given, only the tiles intersecting it are saved, and the bounding
+        box defaults to its bounds
+    full: bool
+        Whether to save the tiles of the whole country
+    connections: int
+        The maximum number of connections to download the file over
+    cache: bool
+        Whether to use the download cache
+    cache_dir: str
+        Folder of the download cache. Defaults to `download_cache.default_cache_dir()`
+    cache_size: int
+        The maximum size of the download cache in bytes. Defaults to 20 GB
     **kwargs: dict
         Other properties from CLI config passed as keywords to other utility functions
     """
-    download_file = path.join(dest_folder, '{}.mbtiles'.format(country))
+    download_file = op.join(dest_folder, '{}.mbtiles'.format(country))
     print('Saving QA tiles to {}'.format(download_file))
-    url = 'https://s3.amazonaws.com/mapbox/osm-qa-tiles-production/latest.country/{}.mbtiles.gz'.format(country)
-    gz = tempfile.TemporaryDirectory()
-    tmp_path = path.join(gz.name, '{}.mbtiles.gz'.format(country))
-    download(url=url, path=tmp_path)
-    with gzip.open(tmp_path, 'rb') as r:
-        with open(download_file, 'wb') as w:
-            for line in r:
-                w.write(line)
+    url = QA_TILES_URL.format(country)
+    if bounding_box is None and aoi is not None:
+        bounding_box = list(aoi.bounds)
+    if bounding_box is None:
+        full = True
+    if not cache:
+        _download_gzip(url, download_file + '.gz', download_file, connections)
+        if not full:
+            _subset(download_file, download_file, bounding_box, aoi)
+        return
+
+    download_cache = DownloadCache(cache_dir, cache_size)
+    cached = download_cache.lookup(url)
+    if cached is None:
+        partial = download_cache.partial_path(url)
+        segmented, digest = _download_gzip(url, partial + '.gz', partial, connections)
+        cached = download_cache.add(url, partial, digest, segmented.etag, segmented.last_modified)
+    else:
+        print('Using the cached copy of {}'.format(url))
+    if full:
+        link(cached, download_file)
+    else:
+        _subset(cached, download_file, bounding_box, aoi)
+
+def _subset(mbtiles_file, download_file, bounding_box, aoi):
+    """Save the tiles of an MBTiles file within a bounding box or area of interest"""
+    count = subset(mbtiles_file, download_file, bounding_box, aoi)
+    print('Extracted {} tiles within {}'.format(count, 'the area of interest' if aoi is not None else bounding_box))
+
+def _download_gzip(url, gz_file, path, connections):
+    """Download a gzipped file, decompressing it to a path as it arrives
+
+    Returns
+    ---------
+    result: tuple
+        The SegmentedDownload and the hex SHA-256 digest of the decompressed file
+    """
+    segmented = SegmentedDownload(url, gz_file, connections)
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    sha256 = hashlib.sha256()
+    with open(path + '.part', 'wb') as w:
+        for data in segmented.stream():
+            data = decompressor.decompress(data)
+            sha256.update(data)
+            w.write(data)
+        data = decompressor.flush()
+        sha256.update(data)
+        w.write(data)
+    if not decompressor.eof:
+        raise IOError('{} ended before the end of its gzip stream'.format(url))
+    os.replace(path + '.part', path)
+    os.remove(gz_file)
+    return segmented, sha256.hexdigest()
@@ -0,0 +1,208 @@
+"""A cache of downloaded QA tiles, shared by every destination folder
+
+Files are stored by the SHA-256 digest of their content in `blobs`, with an entry in `index`
+for each URL recording the digest and the ETag and Last-Modified headers of the download.
+Before a cached file is used it's revalidated with a conditional request. It's then hard
+linked into the destination folder (or reflinked or, failing both, copied), so several
+projects share one copy on disk. The least recently used files are evicted once the cache
+is larger than its maximum size.
+"""
+import hashlib
+import json
+import os
+from os import path as op
+import shutil
+import time
+
+import requests
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# the default maximum size of the cache, in bytes
+DEFAULT_MAX_SIZE = 20 * 1024 ** 3
+TIMEOUT = 60
+# the ioctl which clones a file on Linux, sharing its extents on filesystems like Btrfs and XFS
+_FICLONE = 0x40049409
+
+def default_cache_dir():
+    """Return `$LABEL_MAKER_CACHE`, or the label-maker folder of the user's cache directory"""
+    if os.environ.get('LABEL_MAKER_CACHE'):
+        return os.environ['LABEL_MAKER_CACHE']
+    return op.join(os.environ.get('XDG_CACHE_HOME') or op.expanduser(op.join('~', '.cache')), 'label-maker')
+
+class DownloadCache():
+    """A cache of downloaded files, keyed by URL and stored by content
+
+    Parameters
+    ------------
+    cache_dir: str
+        Folder of the cache. Defaults to `default_cache_dir()`
+    max_size: int
+        The maximum total size of the cached files in bytes. Defaults to 20 GB
+    """
+    def __init__(self, cache_dir=None, max_size=None):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_size = DEFAULT_MAX_SIZE if max_size is None else max_size
+        for folder in ['blobs', 'index', 'partial']:
+            os.makedirs(op.join(self.cache_dir, folder), exist_ok=True)
+
+    def lookup(self, url):
+        """Return the path of the cached file of a URL if it's still current, or None
+
+        The file is revalidated with a conditional HEAD request, using the ETag and
+        Last-Modified headers of its download. If the server can't be reached, the cached
+        file is used as is.
+        """
+        entry = self._entry(url)
+        if entry is None or not op.exists(self._blob(entry['digest'])):
+            return None
+        headers = dict()
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            r = requests.head(url, headers=headers, allow_redirects=True, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            print('Could not revalidate the cached copy of {} ({}), using it anyway'.format(url, e))
+            return self._use(url, entry)
+        # servers may ignore conditional requests, so compare the headers as well
+        current = r.status_code == 304 or (r.ok and (
+            (entry.get('etag') and r.headers.get('ETag') == entry['etag']) or
+            (not entry.get('etag') and entry.get('last_modified') and
+             r.headers.get('Last-Modified') == entry['last_modified'])))
+        return self._use(url, entry) if current else None
+
+    def partial_path(self, url):
+        """Return a path in the cache to download a URL to, so interrupted downloads can be resumed"""
+        return op.join(self.cache_dir, 'partial', _url_key(url))
+
+    def add(self, url, file_path, digest, etag=None, last_modified=None):
+        """Move a downloaded file into the cache, evicting the least recently used files if necessary
+
+        Parameters
+        ------------
+        url: str
+            The URL the file was downloaded from
+        file_path: str
+            Path of the file, which is moved into the cache
+        digest: str
+            The hex SHA-256 digest of the file
+        etag, last_modified: str
+            The ETag and Last-Modified headers of the download, to revalidate it
+
+        Returns
+        ---------
+        path: str
+            The path of the cached file
+        """
+        blob = self._blob(digest)
+        if op.exists(blob):
+            os.remove(file_path)
+        else:
+            os.replace(file_path, blob)
+        entry = dict(url=url, digest=digest, size=op.getsize(blob), etag=etag, last_modified=last_modified)
+        self._use(url, entry)
+        self.evict(keep=digest)
+        return blob
+
+    def evict(self, keep=None):
+        """Remove the least recently used files until the cache fits its maximum size
+
+        Parameters
+        ------------
+        keep: str
+            The digest of a file to keep, even if it's larger than the maximum size
+        """
+        entries = dict()
+        for name in os.listdir(op.join(self.cache_dir, 'index')):
+            if not name.endswith('.json'):
+                continue
+            with open(op.join(self.cache_dir, 'index', name)) as f:
+                entry = json.load(f)
+            entries.setdefault(entry['digest'], []).append((name, entry))
+        blobs = [(max(entry.get('last_used', 0) for _, entry in named), digest, named)
+                 for digest, named in entries.items() if op.exists(self._blob(digest))]
+        total = sum(op.getsize(self._blob(digest)) for _, digest, _ in blobs)
+        for _, digest, named in sorted(blobs, key=lambda blob: blob[0]):
+            if total <= self.max_size:
+                break
+            if digest == keep:
+                continue
+            total -= op.getsize(self._blob(digest))
+            # destination folders keep their hard links to the file
+            os.remove(self._blob(digest))
+            for name, _ in named:
+                os.remove(op.join(self.cache_dir, 'index', name))
+
+    def size(self):
+        """Return the total size of the cached files in bytes"""
+        folder = op.join(self.cache_dir, 'blobs')
+        return sum(op.getsize(op.join(folder, name)) for name in os.listdir(folder))
+
+    def _entry(self, url):
+        """Return the index entry of a URL, or None"""
+        index_file = op.join(self.cache_dir, 'index', _url_key(url) + '.json')
+        if not op.exists(index_file):
+            return None
+        with open(index_file) as f:
+            return json.load(f)
+
+    def _use(self, url, entry):
+        """Mark an entry as used now, returning the path of its file"""
+        entry['last_used'] = time.time()
+        index_file = op.join(self.cache_dir, 'index', _url_key(url) + '.json')
+        with open(index_file + '.tmp', 'w') as f:
+            json.dump(entry, f)
+        os.replace(index_file + '.tmp', index_file)
+        return self._blob(entry['digest'])
+
+    def _blob(self, digest):
+        """Return the path of the file with a digest"""
+        return op.join(self.cache_dir, 'blobs', digest)
+
+def link(source, dest):
+    """Link a file to a destination, replacing it
+
+    The file is hard linked if possible, otherwise reflinked, where the filesystem supports
+    it, or else copied.
+
+    Returns
+    ---------
+    method: str
+        How the file was linked: "hardlink", "reflink" or "copy"
+    """
+    if op.exists(dest) and op.samefile(source, dest):
+        return 'hardlink'
+    tmp = dest + '.tmp'
+    if op.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(source, tmp)
+        method = 'hardlink'
+    except OSError:
+        method = 'reflink' if _reflink(source, tmp) else 'copy'
+        if method == 'copy':
+            shutil.copyfile(source, tmp)
+    os.replace(tmp, dest)
+    return method
+
+def _reflink(source, dest):
+    """Clone a file where the filesystem supports it, returning whether it did"""
+    if fcntl is None:
+        return False
+    with open(source, 'rb') as src, open(dest, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            return True
+        except OSError:
+            pass
+    os.remove(dest)
+    return False
+
+def _url_key(url):
+    """Return a file name for a URL"""
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
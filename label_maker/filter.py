@@ -1,13 +1,29 @@
-# pylint: disable=eval-used,too-many-return-statements
+# pylint: disable=exec-used,too-many-return-statements
 """Create a feature filtering function from a Mapbox GL Filter."""
 # Python port of https://github.com/mapbox/mapbox-gl-js/blob/c9900db279db776f493ce8b6749966cedc2d6b8a/src/style-spec/feature_filter/index.js
+import json
+from functools import lru_cache
+
+# compiled filter functions, keyed by a canonical representation of the filter
+_compiled_filters = dict()
+
+# class matchers built in this process, keyed by a canonical representation of the classes
+_class_matchers = dict()
+
+_FUNCTION_TEMPLATE = """def func(f):
+    \"\"\"evaluates whether a given feature passes its filter\"\"\"
+    p = f['properties'] if f else {{}}
+    return {}
+"""
 
 def create_filter(filt):
     """Create a feature filtering function from a Mapbox GL Filter.
 
     Given a filter expressed as nested lists, return a new function
     that evaluates whether a given feature (with a .properties or .tags property)
-    passes its test. More information:
+    passes its test. The filter is compiled into Python bytecode once and the
+    resulting function is cached, so equivalent filters share a single function.
+    More information:
     - https://www.mapbox.com/mapbox-gl-js/style-spec/#other-filter
     - https://github.com/mapbox/mapbox-gl-js/tree/master/src/style-spec/feature_filter
 
@@ -21,12 +37,23 @@ def create_filter(filt):
     func: function
         A function which evaluates whether a GeoJSON feature meets the input filter criteria
     """
-    def func(f):
-        """evaluates whether a given feature passes its filter"""
-        p = f['properties'] if f else {} # pylint: disable=unused-variable
-        return eval(_compile(filt))
+    key = _filter_key(filt)
+    func = _compiled_filters.get(key)
+    if func is None:
+        func = _compiled_filters[key] = _compile_function(filt, key)
     return func
 
+def _filter_key(filt):
+    """Return a canonical string key for a filter"""
+    return json.dumps(filt, sort_keys=True, separators=(',', ':'))
+
+def _compile_function(filt, name='filter'):
+    """Compile a filter into a Python function"""
+    namespace = dict()
+    source = _FUNCTION_TEMPLATE.format(_compile(filt))
+    exec(compile(source, '<{}>'.format(name), 'exec'), namespace)
+    return namespace['func']
+
 def _compile(filt):
     """Return a string represented the compiled filter function"""
     if not filt:
@@ -67,8 +94,8 @@ def _compile_comparison_op(prop, value, op):
     return left + op + right
 
 def _compile_logical_op(expressions, op):
-    """Join multiple logical expressions"""
-    return op.join(map(_compile, expressions))
+    """Join multiple logical expressions, each in parentheses so they nest like the Mapbox GL filter"""
+    return op.join('({})'.format(_compile(e)) for e in expressions)
 
 def _compile_in_op(prop, values):
     """Test if a property is within a list of values"""
@@ -85,3 +112,256 @@ def _compile_negation(expression):
 def _stringify(s):
     """Convert input to string, wrap with quotes if already a string"""
     return '"{}"'.format(s) if isinstance(s, str) else str(s)
+
+class ClassMatcher():
+    """Evaluate features against the filters of every label class in a single pass
+
+    The filter for each class is compiled once when the matcher is created, so a
+    single matcher can be reused for every feature of every tile. The filters are
+    also analysed together to build an index on the property keys and values they
+    require (e.g. `building`, or `highway` in `primary`, `secondary`). Matching a
+    feature looks up its indexed properties to find the few candidate classes and
+    only evaluates those filters; classes whose filter is fully described by the
+    index (e.g. `['has', 'building']`) are matched without evaluating the filter.
+
+    Parameters
+    ------------
+    classes: list
+        A list of classes for machine learning training. Each class is defined as a dict
+        with a required `filter` property (a Mapbox GL Filter) and an optional `buffer`
+    """
+    __slots__ = ('filters', 'buffers', '_index', '_keys', '_unindexed', '_exact')
+
+    def __init__(self, classes):
+        self.filters = tuple(create_filter(cl.get('filter')) for cl in classes)
+        self.buffers = tuple(cl.get('buffer') for cl in classes)
+
+        index = dict()
+        unindexed, exact = [], set()
+        for i, cl in enumerate(classes):
+            terms, is_exact = _index_terms(cl.get('filter'))
+            if terms is None:
+                unindexed.append(i + 1)
+                continue
+            if is_exact:
+                exact.add(i + 1)
+            for key, values in terms:
+                any_value, by_value = index.setdefault(key, (set(), dict()))
+                if values is None:
+                    any_value.add(i + 1)
+                else:
+                    for v in values:
+                        by_value.setdefault(v, set()).add(i + 1)
+        # for each key, the candidate classes for any value of that key and for specific values
+        self._index = {key: (frozenset(any_value), {v: frozenset(any_value | c) for v, c in by_value.items()})
+                       for key, (any_value, by_value) in index.items()}
+        self._keys = frozenset(index)
+        self._unindexed = frozenset(unindexed)
+        self._exact = frozenset(exact)
+
+    def __len__(self):
+        return len(self.filters)
+
+    def match(self, feature):
+        """Return the index (starting at 1) of every class matching a feature, in ascending order"""
+        candidates, exact = self._candidates(feature)
+        if not candidates:
+            return []
+        filters = self.filters
+        return [i for i in sorted(candidates) if i in exact or filters[i - 1](feature)]
+
+    def match_any(self, features, found):
+        """Flag every class matched by at least one feature
+
+        Each matching class index of `found` (e.g. a one-hot label where index 0 is the
+        background) is set to 1 in place. Once a class has matched its filter isn't
+        evaluated again, and scanning stops as soon as every class has matched.
+        """
+        remaining = frozenset(i for i in range(1, len(self.filters) + 1) if not found[i])
+        if not remaining:
+            return found
+        filters = self.filters
+        for feature in features:
+            candidates, exact = self._candidates(feature)
+            if not candidates.isdisjoint(remaining):
+                matched = [i for i in candidates.intersection(remaining) if i in exact or filters[i - 1](feature)]
+                for i in matched:
+                    found[i] = 1
+                remaining = remaining.difference(matched)
+                if not remaining:
+                    break
+        return found
+
+    def _candidates(self, feature):
+        """Return the classes a feature could match according to the property index
+
+        Returns
+        --------
+        candidates: tuple
+            The candidate classes, and those of them which match without evaluating their filter
+        """
+        p = feature['properties'] if feature else {}
+        candidates, exact = self._unindexed, self._exact
+        for key in self._keys.intersection(p):
+            any_value, by_value = self._index[key]
+            try:
+                candidates = candidates.union(by_value.get(p[key], any_value))
+            except TypeError:
+                # unhashable property values can't use the index, so every filter is evaluated
+                candidates = candidates.union(any_value, *by_value.values())
+                exact = frozenset()
+        return candidates, exact
+
+def _index_terms(filt):
+    """Find the property terms a feature must satisfy to pass a filter
+
+    Returns a tuple of (terms, exact). `terms` is a list of (key, values) pairs and a
+    feature can only pass the filter if it satisfies at least one of them: it has the
+    property `key` and, unless `values` is None, the property value is in `values`. `terms`
+    is None when the filter can't be indexed (negations, `$type`, `$id`, etc.). `exact` is
+    True when satisfying a term is equivalent to passing the filter.
+    """
+    if not filt or len(filt) == 1:
+        return None, False
+    op = filt[0]
+    if op in ['has', '==', 'in'] and filt[1] in ['$type', '$id']:
+        return None, False
+    if op == 'has':
+        return [(filt[1], None)], True
+    elif op in ['==', 'in']:
+        values = tuple(filt[2:])
+        # a missing property compares equal to null, so null values can't be indexed
+        if not values or any(v is None or isinstance(v, (list, dict)) for v in values):
+            return None, False
+        return [(filt[1], values)], True
+    elif op == 'any':
+        children = [_index_terms(f) for f in filt[1:]]
+        if any(terms is None for terms, _ in children):
+            return None, False
+        return [t for terms, _ in children for t in terms], all(e for _, e in children)
+    elif op == 'all':
+        children = [_index_terms(f) for f in filt[1:]]
+        for terms, is_exact in children:
+            if terms is not None:
+                return terms, is_exact and len(children) == 1
+    return None, False
+
+class MemoizedClassMatcher():
+    """Cache the classes matched by features with identical filtered properties
+
+    Many features share the same tags (e.g. thousands of `{"building": "yes"}` in a
+    single tile). The signature of a feature is made of the values of every property
+    referenced by the class filters, plus its geometry type if a filter uses `$type`.
+    Features with the same signature match the same classes, so the result is stored in
+    a bounded least-recently-used cache and repeated signatures cost a single lookup.
+    Filters referencing `$id` can't be memoized and are always evaluated.
+
+    Parameters
+    ------------
+    classes: list
+        A list of classes for machine learning training, see ClassMatcher
+    maxsize: int
+        Maximum number of signatures to keep in the cache
+    """
+    __slots__ = ('filters', 'buffers', '_matcher', '_keys', '_geometry_type', '_match_signature',
+                 '_bypassed', '_reported')
+
+    def __init__(self, classes, maxsize):
+        self._matcher = ClassMatcher(classes)
+        self.filters = self._matcher.filters
+        self.buffers = self._matcher.buffers
+
+        keys = set()
+        for cl in classes:
+            keys.update(_filter_properties(cl.get('filter')))
+        self._geometry_type = '$type' in keys
+        self._keys = tuple(sorted(k for k in keys if k not in ['$type', '$id']))
+        self._match_signature = None if '$id' in keys else lru_cache(maxsize=maxsize)(self._match_uncached)
+        self._bypassed = 0
+        self._reported = (0, 0)
+
+    def __len__(self):
+        return len(self.filters)
+
+    def match(self, feature):
+        """Return the index (starting at 1) of every class matching a feature, in ascending order"""
+        if self._match_signature is None:
+            self._bypassed += 1
+            return self._matcher.match(feature)
+        p = feature['properties'] if feature else {}
+        geometry_type = feature['geometry']['type'] if self._geometry_type else None
+        signature = (geometry_type, tuple((k, p[k]) for k in self._keys if k in p))
+        try:
+            return list(self._match_signature(signature))
+        except TypeError:
+            # unhashable property values can't be part of a signature
+            self._bypassed += 1
+            return self._matcher.match(feature)
+
+    def match_any(self, features, found):
+        """Flag every class matched by at least one feature, see ClassMatcher.match_any"""
+        remaining = set(i for i in range(1, len(self.filters) + 1) if not found[i])
+        if not remaining:
+            return found
+        for feature in features:
+            for i in self.match(feature):
+                found[i] = 1
+                remaining.discard(i)
+            if not remaining:
+                break
+        return found
+
+    def _match_uncached(self, signature):
+        """Match a feature built from a signature; it carries every property the filters can see"""
+        geometry_type, properties = signature
+        return tuple(self._matcher.match(dict(geometry=dict(type=geometry_type), properties=dict(properties))))
+
+    def stats(self):
+        """Return the number of cache hits and misses (including uncacheable features)"""
+        info = self._match_signature.cache_info() if self._match_signature else None
+        hits = info.hits if info else 0
+        misses = (info.misses if info else 0) + self._bypassed
+        return hits, misses
+
+    def take_stats(self):
+        """Return the number of cache hits and misses since the last call to take_stats"""
+        hits, misses = self.stats()
+        reported_hits, reported_misses = self._reported
+        self._reported = (hits, misses)
+        return hits - reported_hits, misses - reported_misses
+
+def _filter_properties(filt):
+    """Return the set of property names (including `$type` and `$id`) referenced by a filter"""
+    if not filt or len(filt) == 1:
+        return set()
+    op = filt[0]
+    if op in ['any', 'all', 'none']:
+        return set().union(*[_filter_properties(f) for f in filt[1:]])
+    elif op in ['==', '!=', '<', '>', '<=', '>=', 'in', '!in', 'has', '!has']:
+        return {filt[1]}
+    return set()
+
+def class_matcher(classes, cache_size=0):
+    """Return a ClassMatcher for a list of classes, building it once per process
+
+    Parameters
+    ------------
+    classes: list
+        A list of classes for machine learning training, see ClassMatcher
+    cache_size: int
+        If non-zero, return a MemoizedClassMatcher caching up to `cache_size` feature signatures
+
+    Returns
+    --------
+    matcher: ClassMatcher or MemoizedClassMatcher
+        A matcher shared by every caller in the current process using the same classes
+    """
+    key = (_filter_key(classes), cache_size)
+    matcher = _class_matchers.get(key)
+    if matcher is None:
+        if cache_size:
+            matcher = MemoizedClassMatcher(classes, cache_size)
+        else:
+            matcher = ClassMatcher(classes)
+        _class_matchers[key] = matcher
+    return matcher
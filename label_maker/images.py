@@ -3,11 +3,13 @@
 
 import concurrent.futures
 from os import makedirs, path as op
-from random import shuffle
 
 import numpy as np
 
 from label_maker.utils import get_image_function
+from label_maker.label_store import open_labels
+from label_maker.selection import TileSelection
+from label_maker import tile_id
 
 def download_images(dest_folder, classes, imagery, ml_type, background_ratio, threadcount, imagery_offset=False, **kwargs):
     """Download satellite images specified by a URL and a label.npz file
@@ -38,37 +40,26 @@ def download_images(dest_folder, classes, imagery, ml_type, background_ratio, th
         Other properties from CLI config passed as keywords to other utility functions
     """
     # open labels file
-    labels_file = op.join(dest_folder, 'labels.npz')
-    tiles = np.load(labels_file)
+    tiles = open_labels(dest_folder, ml_type)
 
     # create tiles directory
     tiles_dir = op.join(dest_folder, 'tiles')
     if not op.isdir(tiles_dir):
         makedirs(tiles_dir)
 
-    # find tiles which have any matching class
-    def class_test(value):
-        """Determine if a label matches a given class index"""
-        if ml_type == 'object-detection':
-            return len(value)
-        elif ml_type == 'segmentation':
-            return np.sum(value) > 0
-        elif ml_type == 'classification':
-            return value[0] == 0
-        return None
-    class_tiles = [tile for tile in tiles.files if class_test(tiles[tile])]
+    # find tiles which have any matching class, using the class-presence bitmask of every tile
+    selection = TileSelection.from_store(tiles, ml_type, len(classes))
+    class_tiles = selection.positive()
 
     # for classification problems, we also get background
     # tiles up to len(class_tiles) * config.get('background_ratio')
-    background_tiles = []
+    background_tiles = np.empty(0, dtype=np.int64)
     if ml_type == 'classification':
-        limit = len(class_tiles) * background_ratio
-        background_tiles_full = [tile for tile in tiles.files if tile not in class_tiles]
-        shuffle(background_tiles_full)
-        background_tiles = background_tiles_full[:limit]
+        limit = int(len(class_tiles) * background_ratio)
+        background_tiles = selection.sample_background(min(limit, selection.n_background), kwargs.get('seed'))
 
     # download tiles
-    tiles = class_tiles + background_tiles
+    tiles = tile_id.to_names(np.concatenate((class_tiles, background_tiles)))
     print('Downloading {} tiles to {}'.format(len(tiles), tiles_dir))
 
     # get image acquisition function based on imagery string
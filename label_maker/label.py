@@ -2,28 +2,30 @@
 """Create label data from OSM QA tiles for specified classes"""
 
 import sys
-from os import makedirs, path as op
+from os import makedirs, remove, path as op
 from subprocess import run, Popen, PIPE
 import json
 from functools import partial
 
 import numpy as np
-import mapbox_vector_tile
-from shapely.geometry import shape, mapping, Polygon
+from shapely.geometry import box, shape, mapping, Polygon
 from shapely.errors import TopologicalError
 from rasterio.features import rasterize
-from geojson import Feature, FeatureCollection as fc
-from mercantile import tiles, feature, Tile
-from PIL import Image, ImageDraw
-from tilepie import tilereduce
 
 import label_maker
-from label_maker.utils import class_match
-from label_maker.filter import create_filter
-from label_maker.palette import class_color
-
-# declare a global accumulator so the workers will have access
-tile_results = dict()
+from label_maker.filter import class_matcher
+from label_maker.tilereduce import tilereduce
+from label_maker.label_store import LabelWriter, LabelStoreWriter, TileCoverage
+from label_maker.mbtiles import tile_range, max_zoom, subset_bounds
+from label_maker.selection import TileSelection, class_counts
+from label_maker.stats import LabelStats
+from label_maker.tile_features import TileFeatureWriter
+from label_maker.label_images import LabelImageWriter
+from label_maker.overzoom import split_tile
+from label_maker.retiled import RetiledManifest, intersection, range_bounds, range_box
+from label_maker.stream_filter import intersects
+from label_maker import rle, tile_id
+from label_maker.vector_tile import decode, geometry_bounds
 
 # clip all geometries to a tile
 clip_mask = Polygon(((0, 0), (0, 255), (255, 255), (255, 0), (0, 0)))
@@ -32,9 +34,12 @@ def make_labels(dest_folder, zoom, country, classes, ml_type, bounding_box, spar
     """Create label data from OSM QA tiles for specified classes
 
     Perform the following operations:
-    - If necessary, re-tile OSM QA Tiles to the specified zoom level
-    - Iterate over all tiles within the bounding box and produce a label for each
-    - Save the label file as labels.npz
+    - If necessary, re-tile OSM QA Tiles to the specified zoom level. At or above the zoom level
+      of the QA tiles, they're split into child tiles in process instead (see `label_maker.overzoom`)
+    - Iterate over all tiles within the bounding box with data and produce a label for each. The
+      other tiles have the empty label, which is stored implicitly
+    - Save the labels as labels.npz and as an indexed label store (the label_store folder)
+    - Save the number of tiles and features of each class to label_stats.json
     - Create an output for previewing the labels (GeoJSON or PNG depending upon ml_type)
 
     Parameters
@@ -61,103 +66,249 @@ def make_labels(dest_folder, zoom, country, classes, ml_type, bounding_box, spar
         Limit the total background tiles to write based on `background_ratio` kwarg.
     geojson: str
         Filepath to optional geojson label input
+    filter_cache: int
+        If non-zero, memoize class matches for up to this many distinct feature property signatures
+        per worker and report the cache hits and misses
+    workers: int
+        Number of worker processes used to label tiles, and to filter the QA tiles by the bounding
+        box before retiling them with tippecanoe. Defaults to the number of CPUs
+    chunk_size: int
+        Number of tiles sent to a worker process at a time. Defaults to 64
+    label_buffer: float
+        Megabytes of labels held in memory before they're written to disk. Defaults to 64
+    no_npz: bool
+        If True, only write the label store, not labels.npz, so empty tiles are never enumerated
+    geojson_positive_only: bool
+        If True, only write the classification GeoJSON features of tiles which match a class
+    no_visualization: bool
+        If True, skip the visual output (classification.geojson or the PNGs in the labels folder)
+    tippecanoe: bool
+        If True, retile the QA tiles to the zoom level with tippecanoe rather than in process
     **kwargs: dict
         Other properties from CLI config passed as keywords to other utility functions
     """
 
     mbtiles_file = op.join(dest_folder, '{}.mbtiles'.format(country))
     mbtiles_file_zoomed = op.join(dest_folder, '{}-z{!s}.mbtiles'.format(country, zoom))
-
-    if not op.exists(mbtiles_file_zoomed):
-        filtered_geo = kwargs.get('geojson') or op.join(dest_folder, '{}.geojson'.format(country))
-        fast_parse = []
-        if not op.exists(filtered_geo):
-            fast_parse = ['-P']
-            print('Retiling QA Tiles to zoom level {} (takes a bit)'.format(zoom))
-            ps = Popen(['tippecanoe-decode', '-c', '-f', mbtiles_file], stdout=PIPE)
-            stream_filter_fpath = op.join(op.dirname(label_maker.__file__), 'stream_filter.py')
-            run([sys.executable, stream_filter_fpath, json.dumps(bounding_box)],
-                stdin=ps.stdout, stdout=open(filtered_geo, 'w'))
-            ps.wait()
-        run(['tippecanoe', '--no-feature-limit', '--no-tile-size-limit'] + fast_parse +
-            ['-l', 'osm', '-f', '-z', str(zoom), '-Z', str(zoom), '-o',
-             mbtiles_file_zoomed, filtered_geo])
-
-    # Call tilereduce
+    geojson = kwargs.get('geojson')
+
+    target = tile_range(bounding_box, zoom)
+    # QA tiles downloaded for another bounding box would leave tiles without labels. Full downloads
+    # aren't checked: their `bounds` metadata is the extent of the data
+    source_bounds = subset_bounds(mbtiles_file) if not geojson and op.exists(mbtiles_file) else None
+    if source_bounds is not None and intersection(tile_range(source_bounds, zoom), target) != target:
+        raise ValueError('{} was downloaded for {}, which doesn\'t cover the bounding box {}. Re-run '
+                         '`label-maker download` with this configuration, or with --full'.format(
+                             mbtiles_file, source_bounds, bounding_box))
+
+    # find the retiled files covering the bounding box (see `label_maker.retiled`)
+    manifest = RetiledManifest(dest_folder)
+    if op.exists(mbtiles_file_zoomed) and not manifest.listed(mbtiles_file_zoomed):
+        # retiled by a previous version of Label Maker, which always labeled the bounding box from
+        # it: record it as covering the tiles of this bounding box only
+        manifest.add(geojson or mbtiles_file, zoom, mbtiles_file_zoomed, target)
+    parts, missing = manifest.plan(geojson or mbtiles_file, zoom, target)
+
+    # split the QA tiles into tiles at the zoom level in process, unless retiled files cover
+    # the bounding box, labels are created from a GeoJSON file or tippecanoe is requested
+    source_zoom = None
+    if missing and not geojson and not kwargs.get('tippecanoe') and op.exists(mbtiles_file):
+        source_zoom = max_zoom(mbtiles_file)
+        if source_zoom is not None and source_zoom > zoom:
+            source_zoom = None
+
+    if source_zoom is not None:
+        print('Splitting zoom {} QA Tiles into zoom {} tiles'.format(source_zoom, zoom))
+    elif missing and geojson:
+        # every feature of the GeoJSON file is retiled, so the output covers every tile
+        _retile(geojson, mbtiles_file_zoomed, zoom)
+        manifest.add(geojson, zoom, mbtiles_file_zoomed, (0, 0, (1 << zoom) - 1, (1 << zoom) - 1))
+        parts = [(mbtiles_file_zoomed, target)]
+    elif missing and not op.exists(mbtiles_file):
+        # the tiles would be labeled as background
+        raise ValueError('{} not found, and the retiled files don\'t cover the zoom {} tile ranges {}. Run '
+                         '`label-maker download` first'.format(mbtiles_file, zoom, missing))
+    elif missing:
+        # only retile the parts of the bounding box which aren't covered yet
+        print('Retiling QA Tiles to zoom level {} (takes a bit)'.format(zoom))
+        retiled_files = [op.join(dest_folder, '{}-z{}-{}-{}-{}-{}.mbtiles'.format(country, zoom, *rng))
+                         for rng in missing]
+        filtered_geos = [op.splitext(retiled_file)[0] + '.geojson' for retiled_file in retiled_files]
+        # decode the QA tiles once, keeping the features intersecting any of the missing ranges,
+        # then split them into the features of each range, so every tile in a range is complete
+        decoded_geo = op.join(dest_folder, '{}-z{}-missing.geojson'.format(country, zoom))
+        missing_bounds = [range_bounds(rng, zoom) for rng in missing]
+        _filter_qa_tiles(mbtiles_file, decoded_geo, missing_bounds, kwargs.get('workers'))
+        _split_features(decoded_geo, list(zip(missing_bounds, filtered_geos)))
+        remove(decoded_geo)
+        for rng, retiled_file, filtered_geo in zip(missing, retiled_files, filtered_geos):
+            _retile(filtered_geo, retiled_file, zoom, ['-P'])
+            remove(filtered_geo)
+            manifest.add(mbtiles_file, zoom, retiled_file, rng)
+            parts.append((retiled_file, rng))
+
+    # Build the class matcher up front, so invalid filters fail before labeling; each worker
+    # process builds its own once
+    filter_cache = kwargs.get('filter_cache') or 0
+    class_matcher(classes, filter_cache)
+
+    # Label each tile with a pool of workers, streaming the labels to disk as they're returned
     print('Determining labels for each tile')
-    mbtiles_to_reduce = mbtiles_file_zoomed
-    tilereduce(dict(zoom=zoom, source=mbtiles_to_reduce, bbox=bounding_box,
-                    args=dict(ml_type=ml_type, classes=classes)),
-               _mapper, _callback, _done)
-
-    # Add empty labels to any tiles which didn't have data
+    labels_file = op.join(dest_folder, 'labels.npz')
+    label_folder = op.join(dest_folder, 'labels')
+    # the visual output: GeoJSON features of classification tiles, or PNGs of positive examples
+    features, images = None, None
+    visualize = not kwargs.get('no_visualization')
+    if visualize and ml_type == 'classification':
+        features = TileFeatureWriter(op.join(dest_folder, 'classification.geojson'))
+    elif visualize:
+        if not op.isdir(label_folder):
+            makedirs(label_folder)
+        images = LabelImageWriter(label_folder, ml_type)
+    positive_only = kwargs.get('geojson_positive_only')
     empty_label = _create_empty_label(ml_type, classes)
-    for tile in tiles(*bounding_box, [zoom]):
-        index = '-'.join([str(i) for i in tile])
-        global tile_results
-        if tile_results.get(index) is None:
-            tile_results[index] = empty_label
+    writer = None
+    if not kwargs.get('no_npz'):
+        writer = LabelWriter(labels_file, int((kwargs.get('label_buffer') or 64) * 1024 * 1024))
+    store_folder = op.join(dest_folder, 'label_store')
+    if ml_type == 'segmentation':
+        # segmentation labels are run-length encoded until they're written to labels.npz
+        store_writer = LabelStoreWriter(store_folder, np.uint8, 'rle', (256, 256))
+    else:
+        store_writer = LabelStoreWriter(store_folder, empty_label.dtype)
+
+    def write_label(tile, label, store=True):
+        """Write the label of a tile ID and its visual output (a GeoJSON feature or a PNG for positive examples)"""
+        if writer:
+            writer.write(tile, rle.decode(label) if ml_type == 'segmentation' else label)
+        if store and ml_type == 'segmentation':
+            store_writer.write_encoded(tile, label)
+        elif store:
+            store_writer.write(tile, label)
+        _write_visual_label(ml_type, tile, label, features, images, positive_only)
+
+    # count the tiles (and bounding boxes or pixels) of each class incrementally. In sparse mode,
+    # the statistics saved with the labels only count the tiles written to the store
+    stats = LabelStats(ml_type, classes)
+    written = LabelStats(ml_type, classes) if sparse else stats
+    # tile IDs, only converted to x-y-z names for file names
+    labeled, presence = [], []
+    filter_cache_stats = [0, 0]
+
+    def add_label(tile, label):
+        """Count a label and write it, deferring negative examples in sparse mode"""
+        counts = class_counts(ml_type, label, len(classes))
+        stats.add(counts)
+        # if we match any class, this is a positive example; otherwise it equals the empty label
+        if np.any(counts[1:]) or not sparse:
+            write_label(tile, label)
+            if sparse:
+                written.add(counts)
+        if sparse:
+            presence.append(counts > 0)
+
+    def add_labels(tile_labels, cache_stats):
+        """Add the labels returned for a tile, or the child tiles of a QA tile"""
+        for tile, label in tile_labels:
+            labeled.append(tile)
+            add_label(tile, label)
+        if cache_stats:
+            filter_cache_stats[0] += cache_stats[0]
+            filter_cache_stats[1] += cache_stats[1]
+
+    args = dict(ml_type=ml_type, classes=classes, filter_cache=filter_cache)
+    reduce_kwargs = dict(workers=kwargs.get('workers'), chunk_size=kwargs.get('chunk_size') or 64)
+    if source_zoom is None:
+        for retiled_file, rng in parts:
+            for tile_label in tilereduce(retiled_file, zoom, range_box(rng, zoom),
+                                         _memoized_mapper if filter_cache else _mapper, args, **reduce_kwargs):
+                add_labels([tile_label[:2]], tile_label[2] if filter_cache else None)
+    else:
+        args.update(zoom=zoom, tile_range=target)
+        for tile_labels, cache_stats in tilereduce(mbtiles_file, source_zoom, bounding_box,
+                                                   _overzoom_mapper, args, **reduce_kwargs):
+            add_labels(tile_labels, cache_stats)
+
+    # Tiles which didn't have data have the empty label. They're located arithmetically in
+    # the range of tiles covering the bounding box, rather than enumerated.
+    coverage = TileCoverage(zoom, tile_range(bounding_box, zoom), np.array(labeled, dtype=np.int64))
+    if not sparse:
+        store_writer.set_coverage(zoom, tile_range(bounding_box, zoom), empty_label,
+                                  encoded=ml_type == 'segmentation')
+        # labels.npz and classification.geojson (unless it's positive only) still list every tile
+        if writer or (features is not None and not positive_only):
+            for start in range(0, coverage.n_implicit, 4096):
+                indices = np.arange(start, min(start + 4096, coverage.n_implicit))
+                for tile in coverage.implicit_ids(indices).tolist():
+                    write_label(tile, empty_label, store=False)
 
     # Print a summary of the labels
-    _tile_results_summary(ml_type, classes)
+    stats.add_label(empty_label, coverage.n_implicit)
+    stats.print_summary()
 
     # If the --sparse flag is provided, limit the total background tiles to write
     if sparse:
-        pos_examples, neg_examples = [], []
-        for k in tile_results.keys():
-            # if we don't match any class, this is a negative example
-            if not sum([class_match(ml_type, tile_results[k], i + 1) for i, c in enumerate(classes)]):
-                neg_examples.append(k)
-            else:
-                pos_examples.append(k)
-
-        # Choose random subset of negative examples
-        n_neg_ex = int(kwargs['background_ratio'] * len(pos_examples))
-        neg_examples = np.random.choice(neg_examples, n_neg_ex, replace=False).tolist()
-
-        tile_results = {k: tile_results.get(k) for k in pos_examples + neg_examples}
+        # Choose random subset of negative examples, from those with data and the empty tiles.
+        # Only the positive examples have been written so far
+        n_neg_ex = int(kwargs['background_ratio'] * store_writer.count)
+        # select them with the class-presence bitmask of every tile with data
+        presence = np.array(presence, dtype=bool).reshape(-1, len(classes) + 1)
+        selection = TileSelection(np.array(labeled, dtype=np.int64), presence, coverage,
+                                  class_counts(ml_type, empty_label, len(classes)) > 0)
+        background = selection.sample_background(n_neg_ex, kwargs.get('seed')).tolist()
+        for tile in background:
+            write_label(tile, empty_label)
+        written.add_label(empty_label, len(background))
         print('Using sparse mode; subselected {} background tiles'.format(n_neg_ex))
 
-    # write out labels as numpy arrays
-    labels_file = op.join(dest_folder, 'labels.npz')
-    print('Writing out labels to {}'.format(labels_file))
-    np.savez(labels_file, **tile_results)
-
-    # write out labels as GeoJSON or PNG
-    if ml_type == 'classification':
-        features = []
-        for tile, label in tile_results.items():
-            feat = feature(Tile(*[int(t) for t in tile.split('-')]))
-            features.append(Feature(geometry=feat['geometry'],
-                                    properties=dict(label=label.tolist())))
-        json.dump(fc(features), open(op.join(dest_folder, 'classification.geojson'), 'w'))
-    elif ml_type == 'object-detection':
-        label_folder = op.join(dest_folder, 'labels')
-        if not op.isdir(label_folder):
-            makedirs(label_folder)
-        for tile, label in tile_results.items():
-            # if we have at least one bounding box label
-            if bool(label.shape[0]):
-                label_file = '{}.png'.format(tile)
-                img = Image.new('RGB', (256, 256))
-                draw = ImageDraw.Draw(img)
-                for box in label:
-                    draw.rectangle(((box[0], box[1]), (box[2], box[3])), outline=class_color(box[4]))
-                print('Writing {}'.format(label_file))
-                img.save(op.join(label_folder, label_file))
-    elif ml_type == 'segmentation':
-        label_folder = op.join(dest_folder, 'labels')
-        if not op.isdir(label_folder):
-            makedirs(label_folder)
-        for tile, label in tile_results.items():
-            # if we have any class pixels
-            if np.sum(label):
-                label_file = '{}.png'.format(tile)
-                visible_label = np.array([class_color(l) for l in np.nditer(label)]).reshape(256, 256, 3)
-                img = Image.fromarray(visible_label.astype(np.uint8))
-                print('Writing {}'.format(label_file))
-                img.save(op.join(label_folder, label_file))
-
+    # finish writing out labels as numpy arrays
+    print('Writing out labels to {}'.format(labels_file if writer else store_folder))
+    if writer:
+        writer.close()
+    # close the label store last so it isn't older than labels.npz, then save the statistics
+    store_writer.close()
+    written.save(dest_folder)
+
+    # finish writing out the classification labels as GeoJSON, or the label images
+    if features is not None:
+        features.close()
+    if images is not None:
+        images.close()
+        print('Wrote {} label images to {}'.format(images.count, label_folder))
+
+    if filter_cache:
+        print('Filter cache: {} hits, {} misses'.format(*filter_cache_stats))
+
+
+def _filter_qa_tiles(mbtiles_file, geojson_file, bounding_boxes, workers=None):
+    """Decode the features of QA tiles intersecting any of a list of bounding boxes to line-delimited GeoJSON"""
+    ps = Popen(['tippecanoe-decode', '-c', '-f', mbtiles_file], stdout=PIPE)
+    stream_filter_fpath = op.join(op.dirname(label_maker.__file__), 'stream_filter.py')
+    workers = ['--workers', str(workers)] if workers else []
+    with open(geojson_file, 'w') as f:
+        run([sys.executable, stream_filter_fpath, json.dumps(bounding_boxes)] + workers, stdin=ps.stdout, stdout=f)
+    ps.wait()
+
+def _split_features(geojson_file, outputs):
+    """Write the features of a line-delimited GeoJSON file intersecting each (bounding box, file path) output"""
+    files = [(bounding_box, box(*bounding_box), open(path, 'w')) for bounding_box, path in outputs]
+    try:
+        with open(geojson_file) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                geometry = json.loads(line)['geometry']
+                for bounding_box, bbox_shape, out in files:
+                    if intersects(geometry, bounding_box, bbox_shape):
+                        out.write(line)
+    finally:
+        for _, _, out in files:
+            out.close()
+
+def _retile(geojson_file, mbtiles_file, zoom, options=()):
+    """Retile the features of a GeoJSON file to a zoom level with tippecanoe"""
+    run(['tippecanoe', '--no-feature-limit', '--no-tile-size-limit'] + list(options) +
+        ['-l', 'osm', '-f', '-z', str(zoom), '-Z', str(zoom), '-o', mbtiles_file, geojson_file])
 
 def _mapper(x, y, z, data, args):
     """Iterate over OSM QA Tiles and return a label for each tile
@@ -168,151 +319,194 @@ def _mapper(x, y, z, data, args):
       There is one list element for each feature matching the provided classes.
     - For 'classification' tasks, the entire list is a "one-hot" vector representing which class
       the tile matches
+    - For 'segmentation' tasks, the label is a 256 x 256 mask of class indices, run-length encoded
+      as (class index, run length) pairs (see `label_maker.rle`)
 
     Parameters
     ------------
     x, y, z: int
         tile indices
     data: str
-        Encoded vector tile data
+        Encoded vector tile data, or a tile already decoded by `label_maker.vector_tile.decode`
     args: dict
         Additional arguments passed to the tile worker
 
     Returns
     ---------
     label: tuple
-        The first element is a tile index of the form x-y-z. The second element is a list
+        The first element is the tile ID (see `label_maker.tile_id`). The second element is a list
         representing the label of the tile
 
     """
     ml_type = args.get('ml_type')
     classes = args.get('classes')
+    matcher = class_matcher(classes, args.get('filter_cache', 0))
+    tile_key = tile_id.encode(x, y, z)
 
     if data is None:
-        return ('{!s}-{!s}-{!s}'.format(x, y, z), _create_empty_label(ml_type, classes))
+        return (tile_key, _create_empty_label(ml_type, classes))
 
-    tile = mapbox_vector_tile.decode(data)
-    # for each class, determine if any features in the tile match
+    # decode feature properties now, and geometries only for features which match a class
+    tile = data if isinstance(data, dict) else decode(data)
 
     if tile['osm']['features']:
         if ml_type == 'classification':
             class_counts = np.zeros(len(classes) + 1, dtype=np.int)
-            for i, cl in enumerate(classes):
-                ff = create_filter(cl.get('filter'))
-                class_counts[i + 1] = int(bool([f for f in tile['osm']['features'] if ff(f)]))
+            matcher.match_any(tile['osm']['features'], class_counts)
             # if there are no classes, activate the background
             if np.sum(class_counts) == 0:
                 class_counts[0] = 1
-            return ('{!s}-{!s}-{!s}'.format(x, y, z), class_counts)
+            return (tile_key, class_counts)
         elif ml_type == 'object-detection':
-            bboxes = _create_empty_label(ml_type, classes)
-            for feat in tile['osm']['features']:
-                for i, cl in enumerate(classes):
-                    ff = create_filter(cl.get('filter'))
-                    if ff(feat):
-                        geo = shape(feat['geometry'])
-                        if cl.get('buffer'):
-                            geo = geo.buffer(cl.get('buffer'), 4)
-                        bb = _pixel_bbox(geo.bounds) + [i + 1]
-                        bboxes = np.append(bboxes, np.array([bb]), axis=0)
-            return ('{!s}-{!s}-{!s}'.format(x, y, z), bboxes)
+            return (tile_key, _object_bboxes(tile['osm']['features'], matcher))
         elif ml_type == 'segmentation':
-            geos = []
-            for feat in tile['osm']['features']:
-                for i, cl in enumerate(classes):
-                    ff = create_filter(cl.get('filter'))
-                    if ff(feat):
-                        feat['geometry']['coordinates'] = _convert_coordinates(feat['geometry']['coordinates'])
-                        geo = shape(feat['geometry'])
-                        try:
-                            geo = geo.intersection(clip_mask)
-                        except TopologicalError as e:
-                            print(e, 'skipping')
-                            break
-                        if cl.get('buffer'):
-                            geo = geo.buffer(cl.get('buffer'), 4)
-                        if not geo.is_empty:
-                            geos.append((mapping(geo), i + 1))
-            result = rasterize(geos, out_shape=(256, 256))
-            return ('{!s}-{!s}-{!s}'.format(x, y, z), result)
-    return ('{!s}-{!s}-{!s}'.format(x, y, z), np.array())
+            return (tile_key, rle.encode(_segmentation_mask(tile['osm']['features'], matcher)))
+    return (tile_key, np.array())
+
+def _memoized_mapper(x, y, z, data, args):
+    """Label a tile with _mapper and add the worker's filter cache hits and misses since its last tile"""
+    matcher = class_matcher(args.get('classes'), args.get('filter_cache'))
+    return _mapper(x, y, z, data, args) + (matcher.take_stats(),)
+
+def _overzoom_mapper(x, y, z, data, args):
+    """Split a QA tile into its child tiles at the zoom level `args['zoom']` and label each one
+
+    Only the features matching a class are split, so the geometries of the others are never
+    decoded. Child tiles without any are left out: like tiles without data, they have the
+    empty label.
+
+    Returns
+    ---------
+    labels: tuple
+        A list with the (tile ID, label) of each child tile, see `_mapper`, and the worker's
+        filter cache hits and misses since its last tile, or None if the cache is disabled
+    """
+    matcher = class_matcher(args.get('classes'), args.get('filter_cache', 0))
+    tile = decode(data)
+    for layer in tile.values():
+        layer['features'] = [feat for feat in layer['features'] if matcher.match(feat)]
+    zoom = args.get('zoom')
+    tile_labels = [_mapper(cx, cy, zoom, child, args)
+                   for cx, cy, child in split_tile(tile, x, y, z, zoom, args.get('tile_range'))]
+    return tile_labels, matcher.take_stats() if args.get('filter_cache') else None
+
+def _object_bboxes(features, matcher):
+    """Return the object detection label for the features of a tile
+
+    Collect the 0-4096 bounds of every (feature, class) match into a buffer which grows
+    in chunks, then convert all of them to buffered pixel bounding boxes at once. Shapely
+    geometries are only built for classes with a `buffer`.
+    """
+    bounds = np.empty((64, 4))
+    class_indices = np.empty(64, dtype=np.int)
+    n = 0
+    for feat in features:
+        for i in matcher.match(feat):
+            buffer = matcher.buffers[i - 1]
+            if buffer:
+                bb = shape(feat['geometry']).buffer(buffer, 4).bounds or None
+            else:
+                bb = geometry_bounds(feat['geometry'])
+            if bb is None:
+                continue
+            if n == len(bounds):
+                bounds = np.concatenate((bounds, np.empty_like(bounds)))
+                class_indices = np.concatenate((class_indices, np.empty_like(class_indices)))
+            bounds[n] = bb
+            class_indices[n] = i
+            n += 1
+    bboxes = np.empty((n, 5), dtype=np.int)
+    bboxes[:, :4] = _pixel_bboxes(bounds[:n])
+    bboxes[:, 4] = class_indices[:n]
+    return bboxes
+
+def _segmentation_mask(features, matcher):
+    """Return the segmentation label for the features of a tile
+
+    Each matching feature is converted to pixel coordinates once, clipped to the tile
+    only if it extends beyond it, buffered per class and rasterized with its class
+    index into a 256 x 256 uint8 mask.
+    """
+    geos = []
+    for feat in features:
+        matches = matcher.match(feat)
+        if not matches:
+            continue
+        geometry = feat['geometry']
+        geo = shape(dict(type=geometry['type'], coordinates=_convert_coordinates(geometry['coordinates'])))
+        if geo.is_empty:
+            continue
+        xmin, ymin, xmax, ymax = geo.bounds
+        if xmin < 0 or ymin < 0 or xmax > 255 or ymax > 255:
+            try:
+                geo = geo.intersection(clip_mask)
+            except TopologicalError as e:
+                print(e, 'skipping')
+                continue
+        for i in matches:
+            buffer = matcher.buffers[i - 1]
+            class_geo = geo.buffer(buffer, 4) if buffer else geo
+            if not class_geo.is_empty:
+                geos.append((mapping(class_geo), i))
+    if not geos:
+        return np.zeros((256, 256), dtype=np.uint8)
+    return rasterize(geos, out_shape=(256, 256), dtype=np.uint8)
 
 def _convert_coordinates(coords):
+    """Convert nested 0-4096 coordinates to pixel coordinates, with one NumPy operation per ring"""
+    if not coords:
+        return coords
     # for points, return the coordinates converted
-    if isinstance(coords[0], int):
-        return list(map(_pixel_bounds_convert, enumerate(coords)))
+    if isinstance(coords[0], (int, float)):
+        return _pixel_coordinates(np.array([coords]))[0].tolist()
+    # for lines and rings, convert all points at once
+    if isinstance(coords[0][0], (int, float)):
+        return _pixel_coordinates(np.array(coords)).tolist()
     # for other geometries, recurse
     return list(map(_convert_coordinates, coords))
 
+def _pixel_coordinates(points):
+    """Convert an (n, 2) array of 0-4096 coordinates to pixel coordinates, flipping the y axis"""
+    # input bounds are in the range 0-4096 by default: https://github.com/tilezen/mapbox-vector-tile
+    # we want them to match our fixed imagery size of 256
+    pixels = np.rint(points * 255. / 4096).astype(np.int)
+    pixels[:, 1] = 255 - pixels[:, 1]  # flip the y axis
+    return pixels
+
 def _pixel_bbox(bb):
     """Convert a bounding box in 0-4096 to pixel coordinates"""
+    return _pixel_bboxes(np.array([bb], dtype=np.float64))[0].tolist()
+
+def _pixel_bboxes(bounds, buffer=4):
+    """Convert an array of bounding boxes in 0-4096 to buffered pixel coordinates"""
     # this will have coordinates in xmin, ymin, xmax, ymax order
     # because we flip the yaxis, we also need to reorder
-    converted = list(map(_pixel_bounds_convert, enumerate([bb[0], bb[3], bb[2], bb[1]])))
-    return _buffer_bbox(converted)
-
-def _buffer_bbox(bb, buffer=4):
-    """Buffer a bounding box in pixel coordinates"""
-    return list(map(
-        _clamp,
-        [
-            bb[0] - buffer,
-            bb[1] - buffer,
-            bb[2] + buffer,
-            bb[3] + buffer
-        ]
-    ))
-
-def _clamp(coordinate):
-    """restrict a single coordinate to 0-255"""
-    return max(0, min(255, coordinate))
-
-def _pixel_bounds_convert(x):
-    """Convert a single 0-4096 coordinate to a pixel coordinate"""
-    (i, b) = x
-    # input bounds are in the range 0-4096 by default: https://github.com/tilezen/mapbox-vector-tile
-    # we want them to match our fixed imagery size of 256
-    pixel = round(b * 255. / 4096) # convert to tile pixels
-    return pixel if (i % 2 == 0) else 255 - pixel # flip the y axis
-
-def _callback(tile_label):
-    """Attach tile labels to a global tile_results dict"""
-    if not tile_label:
-        return
-    global tile_results
-    (tile, label) = tile_label
-    tile_results[tile] = label
-
-def _done():
-    pass
-
-def _bbox_class(class_index):
-    """Create a function to determine if a bounding box label matches a given class"""
-    def bc(x):
-        """Determine if a bounding box label matches a given class"""
-        return x[4] == class_index
-    return bc
-
-def _tile_results_summary(ml_type, classes):
-    print('---')
-    labels = list(tile_results.values())
-    all_tiles = list(tile_results.keys())
-    if ml_type == 'object-detection':
-        # for each class, show number of features and number of tiles
-        for i, cl in enumerate(classes):
-            cl_features = len([bb for l in labels for bb in l if bb[4] == i + 1])
-            cl_tiles = len([l for l in labels if len(list(filter(_bbox_class(i + 1), l)))]) # pylint: disable=cell-var-from-loop
-            print('{}: {} features in {} tiles'.format(cl.get('name'), cl_features, cl_tiles))
-    elif ml_type == 'classification':
-        class_tile_counts = list(np.sum(labels, axis=0))
-        for i, cl in enumerate(classes):
-            print('{}: {} tiles'.format(cl.get('name'), int(class_tile_counts[i + 1])))
-    elif ml_type == 'segmentation':
-        for i, cl in enumerate(classes):
-            count = len([l for l in labels if class_match(ml_type, l, i + 1)])
-            print('{}: {} tiles'.format(cl.get('name'), count))
-
-    print('Total tiles: {}'.format(len(all_tiles)))
+    pixels = np.rint(bounds[:, [0, 3, 2, 1]] * 255. / 4096)
+    pixels[:, [1, 3]] = 255 - pixels[:, [1, 3]]
+    # buffer the bounding boxes and restrict them to 0-255
+    pixels[:, :2] -= buffer
+    pixels[:, 2:] += buffer
+    return np.clip(pixels, 0, 255).astype(np.int)
+
+def _write_visual_label(ml_type, tile, label, features, images, positive_only=False):
+    """Create the visual output for the label of a tile ID
+
+    For classification, write a GeoJSON feature of the tile to `features`, a TileFeatureWriter,
+    unless `positive_only` is set and the label doesn't match any class. For object detection
+    and segmentation, save a PNG with `images`, a LabelImageWriter, if the label matches any
+    class. Either writer may be None to skip the visual output.
+    """
+    if ml_type == 'classification' and features is not None:
+        if not positive_only or np.any(label[1:]):
+            features.write(tile, dict(label=label.tolist()))
+    elif ml_type == 'object-detection' and images is not None:
+        # if we have at least one bounding box label
+        if bool(label.shape[0]):
+            images.write(tile, label)
+    elif ml_type == 'segmentation' and images is not None:
+        # if we have any class pixels
+        if np.any(label[:, 0]):
+            images.write(tile, label)
 
 def _create_empty_label(ml_type, classes):
     if ml_type == 'classification':
@@ -322,5 +516,5 @@ def _create_empty_label(ml_type, classes):
     elif ml_type == 'object-detection':
         return np.empty((0, 5), dtype=np.int)
     elif ml_type == 'segmentation':
-        return np.zeros((256, 256), dtype=np.int)
+        return rle.encode(np.zeros((256, 256), dtype=np.uint8))
     return None
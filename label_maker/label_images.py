@@ -0,0 +1,80 @@
+"""Write PNG images of object detection and segmentation labels"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os import path as op
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from label_maker import rle, tile_id
+from label_maker.palette import class_palette
+
+def label_image(ml_type, label, palette=None):
+    """Return a `P` mode image of a label, colored by class with `label_maker.palette`
+
+    Object detection labels are drawn as the outlines of their bounding boxes and run-length
+    encoded segmentation labels are decoded into an image of their class indices, so the
+    colors are applied by the palette rather than pixel by pixel.
+    """
+    if ml_type == 'object-detection':
+        img = Image.new('P', (256, 256))
+        draw = ImageDraw.Draw(img)
+        for box in label:
+            draw.rectangle(((box[0], box[1]), (box[2], box[3])), outline=int(box[4]))
+    elif ml_type == 'segmentation':
+        img = Image.fromarray(rle.decode(label).astype(np.uint8, copy=False), 'P')
+    else:
+        raise ValueError('Label images are only created for object detection and segmentation')
+    img.putpalette(palette or class_palette())
+    return img
+
+class LabelImageWriter():
+    """Save images of labels as PNGs with a pool of threads
+
+    PNG encoding releases the GIL, so images are rendered and saved by the threads while
+    labeling continues. At most `4 * threads` images are pending at once and any exception
+    raised while saving an image is re-raised by `write` or `close`.
+
+    Parameters
+    ------------
+    label_folder: str
+        The folder to save the images to, named by their x-y-z tile
+    ml_type: str
+        Either "object-detection" or "segmentation"
+    threads: int
+        The number of threads which save images
+    """
+    def __init__(self, label_folder, ml_type, threads=4):
+        self.label_folder = label_folder
+        self.ml_type = ml_type
+        self.count = 0
+        self._palette = class_palette()
+        self._max_pending = 4 * threads
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+
+    def write(self, tile, label):
+        """Save the image of the label of a tile ID"""
+        label_file = op.join(self.label_folder, '{}.png'.format(tile_id.to_name(tile)))
+        self._pending.append(self._executor.submit(self._save, label_file, label))
+        self.count += 1
+        if len(self._pending) >= self._max_pending:
+            self._pending.popleft().result()
+
+    def _save(self, label_file, label):
+        """Render and save the image of a label"""
+        label_image(self.ml_type, label, self._palette).save(label_file)
+
+    def close(self):
+        """Wait for all images to be saved"""
+        try:
+            while self._pending:
+                self._pending.popleft().result()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
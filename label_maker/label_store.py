@@ -0,0 +1,481 @@
+"""Write and read tile labels
+
+Labels are written to two formats: `labels.npz`, with one `.npy` member per tile, and an
+indexed label store which can be memory-mapped for fast random access. A label store is a
+folder containing:
+  - tiles.npy: the IDs of the tiles (see `label_maker.tile_id`), in the order they were written
+  - offsets.npy: the start of each label in the payload, plus the end of the last label
+  - data.bin: the flattened labels, concatenated
+  - meta.json: the label dtype, shape (with -1 for a variable first dimension) and encoding
+  - default.npy: optionally, the label of every tile within the store's coverage, a range of
+    tiles given in meta.json, which isn't in tiles.npy. This is the empty (background) label,
+    so tiles without features never need to be enumerated.
+"""
+import json
+import random
+from os import makedirs, remove, path as op
+import zipfile
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+from label_maker import rle, tile_id
+
+STORE_VERSION = 2
+
+class LabelWriter():
+    """Stream tile labels into a `labels.npz` file
+
+    Labels are held in a buffer until their total size reaches `buffer_size` bytes, then
+    written out as members of the zip file, so memory use is bounded by the buffer rather
+    than the number of tiles. The result is identical to `np.savez(labels_file, **labels)`
+    and can be read with `np.load`.
+
+    Parameters
+    ------------
+    labels_file: str
+        Path of the `.npz` file to write
+    buffer_size: int
+        Maximum number of bytes of label data held in memory before writing it out
+    """
+    def __init__(self, labels_file, buffer_size=64 * 1024 * 1024):
+        self.labels_file = labels_file
+        self.buffer_size = buffer_size
+        self.count = 0
+        self._zipf = zipfile.ZipFile(labels_file, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True)
+        self._buffer = []
+        self._buffered_bytes = 0
+
+    def write(self, tile, label):
+        """Add the label of a tile, given as an ID or an x-y-z string, to the file"""
+        if not isinstance(tile, str):
+            tile = tile_id.to_name(tile)
+        label = np.asanyarray(label)
+        self._buffer.append((tile, label))
+        self._buffered_bytes += label.nbytes
+        self.count += 1
+        if self._buffered_bytes >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered labels to the file"""
+        for tile, label in self._buffer:
+            # always force zip64 like np.savez, numpy gh-10776
+            with self._zipf.open('{}.npy'.format(tile), 'w', force_zip64=True) as fid:
+                npy_format.write_array(fid, label, allow_pickle=False)
+        self._buffer = []
+        self._buffered_bytes = 0
+
+    def close(self):
+        """Write any buffered labels and close the file"""
+        self.flush()
+        self._zipf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class LabelStoreWriter():
+    """Stream tile labels into an indexed label store
+
+    Each label is appended to the payload as it's written. The dtype and all but the first
+    dimension of the labels are taken from the first label (or given explicitly), so
+    variable-length object detection labels can be stored alongside each other. With
+    `encoding='rle'`, labels are stored run-length encoded (see `label_maker.rle`).
+
+    Parameters
+    ------------
+    store_folder: str
+        Path of the label store folder to write
+    dtype: numpy dtype
+        The dtype of the stored labels. Defaults to the dtype of the first label
+    encoding: str
+        None to store labels as is, or 'rle' to run-length encode them
+    label_shape: tuple
+        The shape of the labels of a run-length encoded store. Defaults to the shape of the
+        first label
+    """
+    def __init__(self, store_folder, dtype=None, encoding=None, label_shape=None):
+        if encoding not in (None, 'rle'):
+            raise ValueError('Unknown label encoding {}'.format(encoding))
+        if not op.isdir(store_folder):
+            makedirs(store_folder)
+        # remove the metadata of a previous store until this one is complete
+        if op.exists(op.join(store_folder, 'meta.json')):
+            remove(op.join(store_folder, 'meta.json'))
+        self.store_folder = store_folder
+        self.encoding = encoding
+        self.count = 0
+        self._dtype = np.dtype(dtype) if dtype is not None else None
+        self._label_shape = tuple(label_shape) if label_shape is not None else None
+        self._tiles = []
+        self._offsets = [0]
+        self._coverage = None
+        self._default = None
+        self._data = open(op.join(store_folder, 'data.bin'), 'wb')
+
+    def set_coverage(self, zoom, tile_range, default_label, encoded=False):
+        """Give all tiles in a range which aren't written to the store a default label
+
+        Parameters
+        ------------
+        zoom: int
+            The zoom level of the tiles
+        tile_range: tuple
+            The inclusive (xmin, ymin, xmax, ymax) XYZ tile indices of the coverage
+        default_label: np.ndarray
+            The label of the tiles which aren't written, usually the empty label
+        encoded: bool
+            Whether the default label is already run-length encoded
+        """
+        xmin, ymin, xmax, ymax = [int(i) for i in tile_range]
+        self._coverage = dict(zoom=int(zoom), xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax)
+        default_label = np.asanyarray(default_label)
+        if self.encoding == 'rle':
+            self._default = np.asarray(default_label if encoded else rle.encode(default_label), dtype=np.uint32)
+        else:
+            self._default = default_label.astype(self._dtype or default_label.dtype, copy=False)
+
+    def write(self, tile, label):
+        """Add the label of a tile, given as an ID or an x-y-z string, to the store"""
+        label = np.asanyarray(label)
+        if self._dtype is None:
+            self._dtype = label.dtype
+        if self._label_shape is None:
+            self._label_shape = label.shape if self.encoding else (-1,) + label.shape[1:]
+        fixed_shape = label.shape if self.encoding else label.shape[1:]
+        expected_shape = self._label_shape if self.encoding else self._label_shape[1:]
+        if fixed_shape != expected_shape:
+            raise ValueError('Label of tile {} has shape {}, expected {}'.format(
+                tile, label.shape, self._label_shape))
+        if self.encoding == 'rle':
+            self._append(tile, rle.encode(label))
+        else:
+            self._append(tile, label.astype(self._dtype, casting='same_kind', copy=False))
+
+    def write_encoded(self, tile, runs):
+        """Add the run-length encoded label of a tile to a run-length encoded store"""
+        if self.encoding != 'rle' or self._dtype is None or self._label_shape is None:
+            raise ValueError('Encoded labels require a run-length encoded store with a dtype and label_shape')
+        self._append(tile, np.asarray(runs, dtype=np.uint32))
+
+    def _append(self, tile, payload):
+        """Append a label payload to the data file and index it"""
+        self._data.write(np.ascontiguousarray(payload).tobytes())
+        self._tiles.append(tile_id.as_id(tile))
+        self._offsets.append(self._offsets[-1] + payload.size)
+        self.count += 1
+
+    def close(self):
+        """Write the tile index and metadata, and close the store"""
+        self._data.close()
+        np.save(op.join(self.store_folder, 'tiles.npy'), np.array(self._tiles, dtype=np.int64))
+        np.save(op.join(self.store_folder, 'offsets.npy'), np.array(self._offsets, dtype=np.int64))
+        if self._coverage:
+            np.save(op.join(self.store_folder, 'default.npy'), self._default)
+        meta = dict(version=STORE_VERSION, count=self.count, encoding=self.encoding,
+                    dtype=(self._dtype if self._dtype is not None else np.dtype(np.int64)).str,
+                    label_shape=list(self._label_shape or (-1,)), coverage=self._coverage)
+        # the metadata is written last, marking the store as complete
+        with open(op.join(self.store_folder, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class TileCoverage():
+    """A range of tiles at one zoom level, some of which are labeled explicitly
+
+    The tiles which aren't labeled explicitly (the implicit tiles) are never enumerated: they're
+    counted, indexed and sampled arithmetically from their position in the range. Positions are
+    ordered column by column, like `mercantile.tiles`.
+
+    Parameters
+    ------------
+    zoom: int
+        The zoom level of the tiles
+    tile_range: tuple
+        The inclusive (xmin, ymin, xmax, ymax) XYZ tile indices of the range
+    tiles: iterable
+        The IDs (or x-y-z names) of the explicitly labeled tiles. Those outside the range are ignored.
+    """
+    def __init__(self, zoom, tile_range, tiles=()):
+        self.zoom = int(zoom)
+        self.xmin, self.ymin, self.xmax, self.ymax = [int(i) for i in tile_range]
+        positions = self.positions(tiles)
+        # the sorted positions of the explicit tiles, to locate the implicit tiles between them
+        self._explicit = np.unique(positions[positions >= 0])
+
+    @property
+    def n_implicit(self):
+        """The number of tiles in the range which aren't labeled explicitly"""
+        return (self.xmax - self.xmin + 1) * (self.ymax - self.ymin + 1) - len(self._explicit)
+
+    def positions(self, tiles):
+        """Return the positions of tiles, given as IDs or x-y-z names, in the range, with -1 for those outside of it"""
+        x, y, z = tile_id.decode(tile_id.as_ids(tiles))
+        inside = (z == self.zoom) & (x >= self.xmin) & (x <= self.xmax) & (y >= self.ymin) & (y <= self.ymax)
+        return np.where(inside, (x - self.xmin) * (self.ymax - self.ymin + 1) + (y - self.ymin), -1)
+
+    def position(self, tile):
+        """Return the position of a tile in the range, or None if it's outside of it"""
+        try:
+            x, y, z = tile_id.decode(tile_id.as_id(tile))
+        except (TypeError, ValueError):
+            return None
+        if z != self.zoom or not self.xmin <= x <= self.xmax or not self.ymin <= y <= self.ymax:
+            return None
+        return (x - self.xmin) * (self.ymax - self.ymin + 1) + (y - self.ymin)
+
+    def implicit_ids(self, indices):
+        """Return the IDs of the implicit tiles at indices between 0 and `n_implicit`
+
+        Each index is located with a binary search of the explicit tiles' positions.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        # the number of implicit tiles before each explicit tile
+        preceding = self._explicit - np.arange(len(self._explicit))
+        positions = indices + np.searchsorted(preceding, indices, side='right')
+        ny = self.ymax - self.ymin + 1
+        return tile_id.encode(self.xmin + positions // ny, self.ymin + positions % ny, np.full_like(positions, self.zoom))
+
+    def sample_implicit(self, n):
+        """Return the IDs of `n` random implicit tiles, in range order"""
+        return self.implicit_ids(sorted(random.sample(range(self.n_implicit), n)))
+
+class LabelStore():
+    """Read tile labels from an indexed label store
+
+    The payload is memory-mapped, so opening a store only reads the tile index and each
+    label is a constant time slice of the payload. Like the result of `np.load` on
+    `labels.npz`, labels are accessed with `store[tile]` and `store.files` lists the tiles.
+    Tiles are given as IDs (see `label_maker.tile_id`) or x-y-z names and looked up with a
+    binary search of the sorted IDs. Run-length encoded labels are only decoded when they're
+    accessed this way.
+
+    Tiles within the store's coverage which weren't written have the default label. They're
+    located arithmetically, by their position in the coverage, so they're only enumerated
+    by `ids`, `files` and `items`.
+
+    Parameters
+    ------------
+    store_folder: str
+        Path of the label store folder
+    """
+    def __init__(self, store_folder):
+        with open(op.join(store_folder, 'meta.json')) as f:
+            meta = json.load(f)
+        self.store_folder = store_folder
+        self.encoding = meta.get('encoding')
+        self.dtype = np.dtype(meta['dtype'])
+        self.label_shape = tuple(meta['label_shape'])
+        self.coverage = None
+        # stores before version 2 list x-y-z names
+        self.tiles = tile_id.as_ids(np.load(op.join(store_folder, 'tiles.npy')))
+        self.offsets = np.load(op.join(store_folder, 'offsets.npy'))
+        if self.encoding == 'rle':
+            payload_dtype, self._payload_shape = np.dtype(np.uint32), (-1, 2)
+        else:
+            payload_dtype, self._payload_shape = self.dtype, self.label_shape
+        data_file = op.join(store_folder, 'data.bin')
+        if self.offsets[-1]:
+            self.data = np.memmap(data_file, dtype=payload_dtype, mode='r', shape=(int(self.offsets[-1]),))
+        else:
+            self.data = np.empty(0, dtype=payload_dtype)
+        self._sorter = np.argsort(self.tiles, kind='stable')
+        self._sorted = self.tiles[self._sorter]
+
+        self._default = None
+        if meta.get('coverage'):
+            self._default = np.load(op.join(store_folder, 'default.npy'))
+            c = meta['coverage']
+            self.coverage = TileCoverage(c['zoom'], (c['xmin'], c['ymin'], c['xmax'], c['ymax']), self.tiles)
+
+    @property
+    def n_implicit(self):
+        """The number of tiles with the default label which weren't written to the store"""
+        return self.coverage.n_implicit if self.coverage else 0
+
+    @property
+    def ids(self):
+        """The IDs of all tiles: those written to the store, then those with the default label"""
+        return np.concatenate((self.tiles, self.implicit_ids(np.arange(self.n_implicit))))
+
+    @property
+    def explicit_files(self):
+        """The x-y-z names of the tiles written to the store, in the order they were written"""
+        return tile_id.to_names(self.tiles)
+
+    @property
+    def files(self):
+        """The x-y-z names of all tiles: those written to the store, then those with the default label"""
+        return tile_id.to_names(self.ids)
+
+    def implicit_ids(self, indices):
+        """Return the IDs of the tiles with the default label at indices between 0 and `n_implicit`"""
+        if self.coverage:
+            return self.coverage.implicit_ids(indices)
+        return np.empty(0, dtype=np.int64)
+
+    def sample_implicit(self, n):
+        """Return the IDs of `n` random tiles with the default label, without enumerating them"""
+        return self.coverage.sample_implicit(n) if self.coverage else np.empty(0, dtype=np.int64)
+
+    def position(self, tile):
+        """Return the position of a tile in the store, or None if it wasn't written"""
+        try:
+            tile = tile_id.as_id(tile)
+        except (TypeError, ValueError):
+            return None
+        i = int(np.searchsorted(self._sorted, tile))
+        if i < len(self._sorted) and self._sorted[i] == tile:
+            return int(self._sorter[i])
+        return None
+
+    @property
+    def default(self):
+        """The label of the tiles within the coverage which weren't written, as stored, or None"""
+        return self._default
+
+    def label_lengths(self):
+        """Return the number of payload rows of each label written to the store, e.g. its bounding boxes"""
+        row_size = int(np.prod(self._payload_shape[1:], dtype=np.int64))
+        return np.diff(self.offsets) // max(row_size, 1)
+
+    def label(self, i):
+        """Return the label at a position in the store"""
+        return self._decode(self.encoded_label(i))
+
+    def encoded_label(self, i):
+        """Return the label at a position in the store as stored, e.g. run-length encoded"""
+        return self.data[self.offsets[i]:self.offsets[i + 1]].reshape(self._payload_shape)
+
+    def encoded(self, tile):
+        """Return the label of a tile as stored, e.g. run-length encoded"""
+        i = self.position(tile)
+        if i is not None:
+            return self.encoded_label(i)
+        if self.coverage and self.coverage.position(tile) is not None:
+            return self._default
+        raise KeyError(tile)
+
+    def items(self, encoded=False, implicit=True):
+        """Iterate over the (tile ID, label) pairs in the store, reading the payload sequentially
+
+        Parameters
+        ------------
+        encoded: bool
+            Whether to return the labels as stored, e.g. run-length encoded
+        implicit: bool
+            Whether to include the tiles with the default label which weren't written
+        """
+        label = self.encoded_label if encoded else self.label
+        for i, tile in enumerate(self.tiles.tolist()):
+            yield tile, label(i)
+        if implicit and self.n_implicit:
+            default = self._default if encoded else self._decode(self._default)
+            for tile in self.implicit_ids(np.arange(self.n_implicit)).tolist():
+                yield tile, default
+
+    def _decode(self, payload):
+        """Decode a label payload"""
+        if self.encoding == 'rle':
+            return rle.decode(payload, self.label_shape, self.dtype)
+        return payload
+
+    def __getitem__(self, tile):
+        return self._decode(self.encoded(tile))
+
+    def __contains__(self, tile):
+        return self.position(tile) is not None or bool(self.coverage and self.coverage.position(tile) is not None)
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.tiles) + self.n_implicit
+
+def sample_tiles(tiles, coverage, n, rng=random):
+    """Choose `n` random tiles, without replacement, from an array of IDs plus the implicit tiles of a coverage
+
+    The implicit tiles are sampled arithmetically, without enumerating them.
+
+    Parameters
+    ------------
+    tiles: np.ndarray
+        Tile IDs to sample from
+    coverage: TileCoverage
+        A coverage whose implicit tiles are also sampled from, or None
+    n: int
+        The number of tiles to choose. Raises a ValueError if there are fewer tiles than this.
+    rng: random.Random
+        The random generator to sample with. Defaults to the `random` module
+
+    Returns
+    ---------
+    tiles: np.ndarray
+        The chosen tile IDs, those from `tiles` first
+    """
+    tiles = tile_id.as_ids(tiles)
+    n_implicit = coverage.n_implicit if coverage else 0
+    picks = np.array(sorted(rng.sample(range(len(tiles) + n_implicit), n)), dtype=np.int64)
+    n_picked = int(np.searchsorted(picks, len(tiles)))
+    chosen = tiles[picks[:n_picked]]
+    if coverage:
+        chosen = np.concatenate((chosen, coverage.implicit_ids(picks[n_picked:] - len(tiles))))
+    return chosen
+
+def convert_labels(labels_file, store_folder, encoding=None):
+    """Convert a `labels.npz` file to an indexed label store
+
+    Parameters
+    ------------
+    labels_file: str
+        Path of the `.npz` file to read
+    store_folder: str
+        Path of the label store folder to write
+    encoding: str
+        None to store labels as is, or 'rle' to run-length encode them
+    """
+    labels = np.load(labels_file)
+    dtype = np.result_type(*[labels[tile].dtype for tile in labels.files]) if labels.files else None
+    with LabelStoreWriter(store_folder, dtype, encoding) as writer:
+        for tile in labels.files:
+            writer.write(tile, labels[tile])
+
+def open_labels(dest_folder, ml_type=None):
+    """Open the labels created by `label-maker labels` in a folder
+
+    The label store is created from `labels.npz` if it doesn't exist or is older than
+    `labels.npz`, e.g. for labels created by a previous version of label-maker.
+    Segmentation labels are run-length encoded.
+
+    Parameters
+    ------------
+    dest_folder: str
+        Folder containing `labels.npz` and/or the `label_store` folder
+    ml_type: str
+        Defines the type of machine learning. One of "classification", "object-detection", or "segmentation"
+
+    Returns
+    ---------
+    labels: LabelStore
+        The labels of each tile
+    """
+    labels_file = op.join(dest_folder, 'labels.npz')
+    store_folder = op.join(dest_folder, 'label_store')
+    meta_file = op.join(store_folder, 'meta.json')
+    encoding = 'rle' if ml_type == 'segmentation' else None
+    if op.exists(labels_file):
+        stale = not op.exists(meta_file) or op.getmtime(labels_file) > op.getmtime(meta_file)
+        if not stale:
+            with open(meta_file) as f:
+                stale = json.load(f).get('encoding') != encoding
+        if stale:
+            convert_labels(labels_file, store_folder, encoding)
+    return LabelStore(store_folder)
@@ -47,14 +47,44 @@ def parse_args(args):
     # add subcommands
     subparsers = parser.add_subparsers(dest='command')
 
-    subparsers.add_parser('download', parents=[pparser], help='', formatter_class=dhf)
+    d = subparsers.add_parser('download', parents=[pparser], help='', formatter_class=dhf)
     l = subparsers.add_parser('labels', parents=[pparser], help='', formatter_class=dhf)
     p = subparsers.add_parser('preview', parents=[pparser], help='', formatter_class=dhf)
     i = subparsers.add_parser('images', parents=[pparser], help='', formatter_class=dhf)
     subparsers.add_parser('package', parents=[pparser], help='', formatter_class=dhf)
 
+    # download has an optional parameter
+    d.add_argument('--connections', default=4, type=int,
+                   help='maximum number of connections to download the QA tiles over')
+    d.add_argument('--no-cache', action='store_true',
+                   help='download the QA tiles without the download cache shared by all folders')
+    d.add_argument('--cache-dir', default=None,
+                   help='folder of the download cache (defaults to $LABEL_MAKER_CACHE or ~/.cache/label-maker)')
+    d.add_argument('--cache-size', default=20, type=float,
+                   help='maximum size of the download cache in gigabytes')
+    d.add_argument('--full', action='store_true',
+                   help='save the QA tiles of the whole country rather than those within the bounding box')
+    d.add_argument('--aoi', default=None, type=str,
+                   help='GeoJSON FeatureCollection of the area of interest to save the QA tiles of')
+
     # labels has an optional parameter
     l.add_argument('-s', '--sparse', action='store_true')
+    l.add_argument('--filter-cache', default=0, type=int,
+                   help='number of feature property signatures to memoize class matches for (0 disables)')
+    l.add_argument('--workers', default=None, type=int,
+                   help='number of worker processes used to label tiles (defaults to the number of CPUs)')
+    l.add_argument('--chunk-size', default=64, type=int,
+                   help='number of tiles sent to a worker process at a time')
+    l.add_argument('--label-buffer', default=64, type=float,
+                   help='megabytes of labels to hold in memory before writing them to disk')
+    l.add_argument('--no-npz', action='store_true',
+                   help='only write the label store, not labels.npz')
+    l.add_argument('--geojson-positive-only', action='store_true',
+                   help='only write tiles which match a class to classification.geojson')
+    l.add_argument('--no-visualization', action='store_true',
+                   help='skip writing classification.geojson or the label images')
+    l.add_argument('--tippecanoe', action='store_true',
+                   help='retile the QA tiles with tippecanoe rather than in process')
 
     # preview has an optional parameter
     p.add_argument('-n', '--number', default=5, type=int,
@@ -105,10 +135,30 @@ def cli():
         config['http_auth'] = tuple(config['http_auth'])
 
     if cmd == 'download':
-        download_mbtiles(dest_folder=dest_folder, **config)
+        connections = args.get('connections')
+        cache = not args.get('no_cache')
+        cache_dir = args.get('cache_dir')
+        cache_size = int(args.get('cache_size') * 1024 ** 3)
+        full = args.get('full')
+        aoi = None
+        if args.get('aoi'):
+            aoi = unary_union([shape(f['geometry']) for f in json.load(open(args.get('aoi'), 'r'))['features']])
+        download_mbtiles(dest_folder=dest_folder, connections=connections, cache=cache, cache_dir=cache_dir,
+                         cache_size=cache_size, full=full, aoi=aoi, **config)
     elif cmd == 'labels':
         sparse = args.get('sparse', False)
-        make_labels(dest_folder=dest_folder, sparse=sparse, **config)
+        filter_cache = args.get('filter_cache')
+        workers = args.get('workers')
+        chunk_size = args.get('chunk_size')
+        label_buffer = args.get('label_buffer')
+        no_npz = args.get('no_npz')
+        geojson_positive_only = args.get('geojson_positive_only')
+        no_visualization = args.get('no_visualization')
+        tippecanoe = args.get('tippecanoe')
+        make_labels(dest_folder=dest_folder, sparse=sparse, filter_cache=filter_cache, workers=workers,
+                    chunk_size=chunk_size, label_buffer=label_buffer, no_npz=no_npz,
+                    geojson_positive_only=geojson_positive_only, no_visualization=no_visualization,
+                    tippecanoe=tippecanoe, **config)
     elif cmd == 'preview':
         number = args.get('number')
         preview(dest_folder=dest_folder, number=number, **config)
@@ -0,0 +1,185 @@
+"""Read vector tiles from an MBTiles file"""
+# MBTiles specification: https://github.com/mapbox/mbtiles-spec/blob/master/1.3/spec.md
+import gzip
+import os
+from os import path as op
+import sqlite3
+from urllib.request import pathname2url
+
+from mercantile import tile, bounds
+from shapely.geometry import box
+from shapely.prepared import prep
+
+# shrink the south-east corner of a bounding box, like mercantile.tiles, so tile bounds give one tile
+LL_EPSILON = 1e-11
+
+# the maximum number of bytes of an MBTiles file read through a memory map
+MMAP_SIZE = 1 << 30
+
+# the metadata key of the bounding box an MBTiles file was subset to, unlike `bounds` which may
+# be the extent of the data
+SUBSET_BBOX = 'label_maker_bbox'
+
+def connect(mbtiles_file):
+    """Open an MBTiles file read-only
+
+    The file is opened as immutable, so SQLite neither locks it nor checks it for changes, and
+    it's read through a memory map of up to `MMAP_SIZE` bytes rather than copied into the page
+    cache of the connection. The file must not be modified while it's open.
+    """
+    uri = 'file:{}?mode=ro&immutable=1'.format(pathname2url(op.abspath(mbtiles_file)))
+    conn = sqlite3.connect(uri, uri=True)
+    conn.execute('PRAGMA mmap_size = {}'.format(MMAP_SIZE))
+    return conn
+
+def tile_range(bounding_box, zoom):
+    """Return the (xmin, ymin, xmax, ymax) XYZ tile indices covering a bounding box
+
+    Parameters
+    ------------
+    bounding_box: list
+        The bounding box in the form `[xmin, ymin, xmax, ymax]` as longitude and latitude values
+    zoom: int
+        The zoom level of the tiles
+
+    Returns
+    ---------
+    tile_range: tuple
+        The inclusive range of tile columns and (XYZ) tile rows, matching `mercantile.tiles`
+    """
+    west, south, east, north = bounding_box
+    ul_tile = tile(max(-180.0, west), min(85.051129, north), zoom)
+    lr_tile = tile(min(180.0, east) - LL_EPSILON, max(-85.051129, south) + LL_EPSILON, zoom)
+    return ul_tile.x, ul_tile.y, lr_tile.x, lr_tile.y
+
+def read_tiles(mbtiles_file, zoom, bounding_box, batch_size=64, compressed=False):
+    """Iterate over batches of the tiles within a bounding box
+
+    Tiles are read with a single range query on the `tiles` table, in the order of its index,
+    and fetched from the cursor `batch_size` rows at a time, so only one batch of tile data is
+    held in memory.
+
+    Parameters
+    ------------
+    mbtiles_file: str
+        Path to the MBTiles file
+    zoom: int
+        The zoom level to read tiles at
+    bounding_box: list
+        The bounding box in the form `[xmin, ymin, xmax, ymax]` as longitude and latitude values
+    batch_size: int
+        The number of tiles in each batch
+    compressed: bool
+        Whether to yield the tile data as stored, which may be gzipped, e.g. to uncompress it
+        with `uncompress` in a worker process rather than the reader
+
+    Yields
+    ---------
+    batch: list
+        A list of up to `batch_size` (x, y, z, data) tuples, with XYZ tile indices and the
+        uncompressed vector tile data
+    """
+    xmin, ymin, xmax, ymax = tile_range(bounding_box, zoom)
+    conn = connect(mbtiles_file)
+    try:
+        # MBTiles rows are in the TMS scheme, with y increasing to the north
+        cursor = conn.execute(
+            'SELECT tile_column, tile_row, tile_data FROM tiles '
+            'WHERE zoom_level = ? AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ? '
+            'ORDER BY tile_column, tile_row',
+            (zoom, xmin, xmax, _flip_y(ymax, zoom), _flip_y(ymin, zoom)))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if compressed:
+                yield [(x, _flip_y(row, zoom), zoom, data) for x, row, data in rows]
+            else:
+                yield [(x, _flip_y(row, zoom), zoom, uncompress(data)) for x, row, data in rows]
+    finally:
+        conn.close()
+
+def subset(mbtiles_file, subset_file, bounding_box, aoi=None):
+    """Write the tiles of an MBTiles file within a bounding box to a new MBTiles file
+
+    The tiles of each zoom level are copied with a single range query on the tile column and
+    row, using the tile index, so only the tiles within the bounding box are read. The metadata
+    is copied, with the `bounds` and `label_maker_bbox` set to the bounding box.
+
+    Parameters
+    ------------
+    mbtiles_file: str
+        Path to the MBTiles file
+    subset_file: str
+        Path to write the subset to. It's replaced once it's complete, and may be `mbtiles_file`
+    bounding_box: list
+        The bounding box in the form `[xmin, ymin, xmax, ymax]` as longitude and latitude values
+    aoi: shapely.geometry.base.BaseGeometry
+        An area of interest within the bounding box. If given, only the tiles intersecting it are copied
+
+    Returns
+    ---------
+    count: int
+        The number of tiles in the subset
+    """
+    tmp_file = subset_file + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    conn = sqlite3.connect(tmp_file)
+    try:
+        conn.execute('ATTACH DATABASE ? AS source', (mbtiles_file,))
+        conn.execute('CREATE TABLE metadata (name text, value text)')
+        conn.execute('CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)')
+        conn.execute('INSERT INTO metadata SELECT name, value FROM source.metadata WHERE name NOT IN (?, ?)',
+                     ('bounds', SUBSET_BBOX))
+        conn.executemany('INSERT INTO metadata VALUES (?, ?)',
+                         [(name, ','.join(map(str, bounding_box))) for name in ('bounds', SUBSET_BBOX)])
+        minzoom, maxzoom = conn.execute('SELECT MIN(zoom_level), MAX(zoom_level) FROM source.tiles').fetchone()
+        for zoom in range(minzoom, maxzoom + 1) if minzoom is not None else []:
+            xmin, ymin, xmax, ymax = tile_range(bounding_box, zoom)
+            conn.execute(
+                'INSERT INTO tiles SELECT zoom_level, tile_column, tile_row, tile_data FROM source.tiles '
+                'WHERE zoom_level = ? AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?',
+                (zoom, xmin, xmax, _flip_y(ymax, zoom), _flip_y(ymin, zoom)))
+        if aoi is not None:
+            aoi = prep(aoi)
+            outside = [(z, x, row) for z, x, row in conn.execute('SELECT zoom_level, tile_column, tile_row FROM tiles')
+                       if not aoi.intersects(box(*bounds(x, _flip_y(row, z), z)))]
+            conn.executemany('DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?', outside)
+        conn.execute('CREATE UNIQUE INDEX tile_index on tiles (zoom_level, tile_column, tile_row)')
+        conn.execute('CREATE UNIQUE INDEX name on metadata (name)')
+        count = conn.execute('SELECT COUNT(*) FROM tiles').fetchone()[0]
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_file, subset_file)
+    return count
+
+def max_zoom(mbtiles_file):
+    """Return the highest zoom level of the tiles in an MBTiles file, or None if it has no tiles"""
+    conn = connect(mbtiles_file)
+    try:
+        return conn.execute('SELECT MAX(zoom_level) FROM tiles').fetchone()[0]
+    finally:
+        conn.close()
+
+def subset_bounds(mbtiles_file):
+    """Return the [west, south, east, north] bounding box an MBTiles file was subset to, or None if it wasn't"""
+    conn = connect(mbtiles_file)
+    try:
+        row = conn.execute('SELECT value FROM metadata WHERE name = ?', (SUBSET_BBOX,)).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    return [float(value) for value in row[0].split(',')]
+
+def _flip_y(y, zoom):
+    """Convert a tile row between the XYZ and TMS schemes"""
+    return (1 << zoom) - 1 - y
+
+def uncompress(data):
+    """Uncompress gzipped tile data, returning uncompressed data as is"""
+    if data[:2] == b'\x1f\x8b':
+        return gzip.decompress(data)
+    return data
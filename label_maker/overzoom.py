@@ -0,0 +1,128 @@
+"""Split the features of vector tiles into their child tiles at a higher zoom level
+
+OSM QA Tiles are zoom 12 tiles. Rather than decoding them to GeoJSON and retiling them with
+tippecanoe, each feature of a tile is scaled into the tile coordinates of every child tile it
+overlaps at the target zoom and, if it extends beyond the child tile, clipped to it.
+"""
+from math import floor
+
+import numpy as np
+from shapely.errors import TopologicalError
+from shapely.geometry import shape, mapping, MultiPoint, MultiLineString, MultiPolygon
+from shapely.ops import clip_by_rect
+
+from label_maker.vector_tile import geometry_bounds
+
+# the zoom level of OSM QA Tiles
+QA_TILES_ZOOM = 12
+
+# the buffer around each tile, in 256ths of the tile size, like the default of tippecanoe
+BUFFER = 5
+
+# the dimension of each geometry type and the multi-part geometry built from clipped parts
+_DIMENSIONS = dict(Point=0, MultiPoint=0, LineString=1, MultiLineString=1, Polygon=2, MultiPolygon=2)
+_MULTI_PART = {0: MultiPoint, 1: MultiLineString, 2: MultiPolygon}
+
+def split_tile(tile, x, y, z, zoom, tile_range=None, buffer=BUFFER):
+    """Split the features of a decoded vector tile into its child tiles at a zoom level
+
+    Parameters
+    ------------
+    tile: dict
+        A decoded vector tile, as returned by `label_maker.vector_tile.decode` with the
+        y axis pointing up
+    x, y, z: int
+        The tile indices
+    zoom: int
+        The zoom level of the child tiles, at least `z`
+    tile_range: tuple
+        The inclusive (xmin, ymin, xmax, ymax) range of child tiles to return, as returned by
+        `label_maker.mbtiles.tile_range`. Defaults to every child tile
+    buffer: float
+        The buffer around each child tile which features are clipped to, in 256ths of the tile size
+
+    Returns
+    ---------
+    children: list
+        An (x, y, tile) tuple for each child tile with features, ordered by column then row.
+        Each tile has the same layers as `tile`, with features in the child tile coordinates.
+    """
+    scale = 1 << (zoom - z)
+    # the range of children, as offsets from the first child
+    xmin, ymin, xmax, ymax = 0, 0, scale - 1, scale - 1
+    if tile_range is not None:
+        xmin, ymin = max(xmin, tile_range[0] - x * scale), max(ymin, tile_range[1] - y * scale)
+        xmax, ymax = min(xmax, tile_range[2] - x * scale), min(ymax, tile_range[3] - y * scale)
+
+    children = dict()
+    for name, layer in tile.items():
+        extent = layer['extent']
+        margin = extent * buffer / 256.
+        for feature in layer['features']:
+            bounds = geometry_bounds(feature['geometry'])
+            if bounds is None:
+                continue
+            left, bottom, right, top = (bound * scale / extent for bound in bounds)
+            # the y axis points up, so child rows are counted from the bottom of the tile
+            columns = range(max(xmin, floor(left - margin / extent)), min(xmax, floor(right + margin / extent)) + 1)
+            rows = range(max(scale - 1 - ymax, floor(bottom - margin / extent)),
+                         min(scale - 1 - ymin, floor(top + margin / extent)) + 1)
+            for column in columns:
+                for row in rows:
+                    geometry = _child_geometry(feature['geometry'], bounds, scale, column * extent,
+                                               row * extent, extent, margin)
+                    if geometry is None:
+                        continue
+                    child = children.setdefault((column, scale - 1 - row), dict())
+                    child_layer = child.get(name)
+                    if child_layer is None:
+                        child_layer = child[name] = dict(extent=extent, version=layer.get('version', 2), features=[])
+                    child_layer['features'].append(dict(feature, geometry=geometry))
+
+    return [(x * scale + column, y * scale + row, children[(column, row)]) for column, row in sorted(children)]
+
+def _child_geometry(geometry, bounds, scale, dx, dy, extent, margin):
+    """Return a geometry in the coordinates of a child tile, clipped to the buffered tile, or None if it's outside"""
+    offset = np.array([dx, dy])
+    coords = _transform(geometry['coordinates'], scale, offset)
+    child = dict(type=geometry['type'], coordinates=coords)
+    left, bottom = np.asarray(bounds[:2]) * scale - offset
+    right, top = np.asarray(bounds[2:]) * scale - offset
+    if left >= -margin and bottom >= -margin and right <= extent + margin and top <= extent + margin:
+        return child
+    return _clip(child, -margin, -margin, extent + margin, extent + margin)
+
+def _transform(coords, scale, offset):
+    """Scale and translate nested coordinates, with one NumPy operation per ring"""
+    if not coords:
+        return coords
+    # for points, return the coordinates transformed
+    if isinstance(coords[0], (int, float)):
+        return [coords[0] * scale - offset[0], coords[1] * scale - offset[1]]
+    # for lines and rings, transform all points at once
+    if isinstance(coords[0][0], (int, float)):
+        return (np.asarray(coords) * scale - offset).tolist()
+    # for other geometries, recurse
+    return [_transform(c, scale, offset) for c in coords]
+
+def _clip(geometry, xmin, ymin, xmax, ymax):
+    """Clip a GeoJSON-like geometry to a rectangle, returning None if nothing of the same dimension is left"""
+    try:
+        clipped = clip_by_rect(shape(geometry), xmin, ymin, xmax, ymax)
+    except (TopologicalError, ValueError):
+        return None
+    if clipped.is_empty:
+        return None
+    dimension = _DIMENSIONS[geometry['type']]
+    if clipped.geom_type == 'GeometryCollection':
+        # keep the parts of the same dimension, e.g. not the lines where a polygon touches the rectangle
+        parts = []
+        for part in clipped.geoms:
+            if _DIMENSIONS.get(part.geom_type) == dimension:
+                parts.extend(part.geoms if part.geom_type.startswith('Multi') else [part])
+        if not parts:
+            return None
+        clipped = parts[0] if len(parts) == 1 else _MULTI_PART[dimension](parts)
+    elif _DIMENSIONS.get(clipped.geom_type) != dimension:
+        return None
+    return mapping(clipped)
@@ -8,6 +8,8 @@ import rasterio
 from PIL import Image
 
 from label_maker.utils import is_tif, get_image_format
+from label_maker.label_store import open_labels
+from label_maker.stats import label_stats
 
 
 def package_directory(dest_folder, classes, imagery, ml_type, seed=False,
@@ -54,8 +56,7 @@ def package_directory(dest_folder, classes, imagery, ml_type, seed=False,
         raise ValueError('`split_vals` must sum to one. Please update your config.')
 
     # open labels file, create tile array
-    labels_file = op.join(dest_folder, 'labels.npz')
-    labels = np.load(labels_file)
+    labels = open_labels(dest_folder, ml_type)
     tile_names = [tile for tile in labels.files]
     tile_names.sort()
     tiles = np.array(tile_names)
@@ -63,11 +64,7 @@ def package_directory(dest_folder, classes, imagery, ml_type, seed=False,
 
     # find maximum number of features in advance so numpy shapes match
     if ml_type == 'object-detection':
-        max_features = 0
-        for tile in labels.files:
-            features = len(labels[tile])
-            if features > max_features:
-                max_features = features
+        max_features = label_stats(dest_folder, ml_type, classes, labels).max_features
 
     x_vals = []
     y_vals = []
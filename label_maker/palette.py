@@ -8,3 +8,7 @@ def class_color(c):
     if c == 0:
         return (0, 0, 0) # background class
     return ImageColor.getrgb(colors[c % len(colors)])
+
+def class_palette(num_colors=256):
+    """Return a flat list of the rgb values of class indices 0 to `num_colors - 1`, for `P` mode images"""
+    return [value for c in range(num_colors) for value in class_color(c)]
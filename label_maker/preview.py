@@ -4,10 +4,13 @@
 from os import path as op
 from os import makedirs
 
-import numpy as np
 from PIL import Image, ImageDraw
 
-from label_maker.utils import class_match, get_image_function
+from label_maker.utils import get_image_function
+from label_maker.label_store import open_labels
+from label_maker.selection import TileSelection
+from label_maker.stats import label_stats
+from label_maker import tile_id
 
 def preview(dest_folder, number, classes, imagery, ml_type, imagery_offset=False, **kwargs):
     """Produce imagery examples for specified classes
@@ -36,8 +39,7 @@ def preview(dest_folder, number, classes, imagery, ml_type, imagery_offset=False
         Other properties from CLI config passed as keywords to other utility functions
     """
     # open labels file
-    labels_file = op.join(dest_folder, 'labels.npz')
-    tiles = np.load(labels_file)
+    tiles = open_labels(dest_folder, ml_type)
 
     # create example tiles directory
     examples_dir = op.join(dest_folder, 'examples')
@@ -50,6 +52,10 @@ def preview(dest_folder, number, classes, imagery, ml_type, imagery_offset=False
     # get image acquisition function based on imagery string
     image_function = get_image_function(imagery)
 
+    # select the tiles of each class with the class-presence bitmask of every tile
+    selection = TileSelection.from_store(tiles, ml_type, len(classes))
+    stats = label_stats(dest_folder, ml_type, classes, tiles)
+
     for i, cl in enumerate(classes):
         # create class directory
         class_dir = op.join(dest_folder, 'examples', cl.get('name'))
@@ -57,15 +63,13 @@ def preview(dest_folder, number, classes, imagery, ml_type, imagery_offset=False
         if not op.isdir(class_dir):
             makedirs(class_dir)
 
-        class_tiles = (t for t in tiles.files
-                       if class_match(ml_type, tiles[t], i + 1))
         print('Downloading at most {} tiles for class {}'.format(number, cl.get('name')))
-        for n, tile in enumerate(class_tiles):
-            if n >= number:
-                break
-
+        if not stats.tile_counts[i + 1]:
+            continue
+        class_tiles = selection.positive(i + 1)[:number]
+        for tile in class_tiles.tolist():
             kwargs['imagery_offset'] = imagery_offset
-            tile_img = image_function(tile, imagery, class_dir, kwargs)
+            tile_img = image_function(tile_id.to_name(tile), imagery, class_dir, kwargs)
 
             if ml_type == 'object-detection':
                 img = Image.open(tile_img)
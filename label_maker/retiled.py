@@ -0,0 +1,128 @@
+"""Record which tiles the retiled MBTiles files in a folder cover, to reuse them across bounding boxes
+
+When QA tiles are retiled with tippecanoe, each output file covers the range of tiles at the
+target zoom level of the area it was built for. The files are listed in `retiled.json` in the
+destination folder, with their zoom level, tile range and a signature of the source they were
+built from. A new bounding box is split into the parts covered by existing files, which are
+read from them, and the missing parts, which are the only ones retiled. Files which aren't
+listed, e.g. from a previous version of Label Maker, are only used once they're added.
+
+Tile ranges are inclusive (xmin, ymin, xmax, ymax) XYZ tile indices, as returned by
+`label_maker.mbtiles.tile_range`.
+"""
+import json
+import os
+from os import path as op
+
+from mercantile import bounds
+
+MANIFEST_FILE = 'retiled.json'
+
+class RetiledManifest():
+    """The retiled MBTiles files of a destination folder and the tiles they cover
+
+    Parameters
+    ------------
+    dest_folder: str
+        Folder of the retiled files
+    """
+    def __init__(self, dest_folder):
+        self.dest_folder = dest_folder
+        self.manifest_file = op.join(dest_folder, MANIFEST_FILE)
+        self.entries = []
+        if op.exists(self.manifest_file):
+            with open(self.manifest_file) as f:
+                self.entries = json.load(f)['files']
+
+    def plan(self, source, zoom, target):
+        """Split a tile range into the parts covered by retiled files and the missing parts
+
+        Files retiled from a source which has changed since are ignored.
+
+        Parameters
+        ------------
+        source: str
+            Path of the QA tiles or GeoJSON file the tiles are retiled from
+        zoom: int
+            The zoom level of the tiles
+        target: tuple
+            The tile range to cover
+
+        Returns
+        ---------
+        plan: tuple
+            A list of (file path, tile range) pairs of the covered parts, which don't overlap,
+            and a list of the tile ranges of the missing parts
+        """
+        signature = source_signature(source)
+        parts, missing = [], [tuple(target)]
+        for entry in self.entries:
+            if entry['zoom'] != zoom or entry['source'] != signature:
+                continue
+            file_path = op.join(self.dest_folder, entry['file'])
+            if not op.exists(file_path):
+                continue
+            remaining = []
+            for rng in missing:
+                common = intersection(rng, entry['tile_range'])
+                if common is None:
+                    remaining.append(rng)
+                else:
+                    parts.append((file_path, common))
+                    remaining.extend(subtract(rng, common))
+            missing = remaining
+        return parts, missing
+
+    def add(self, source, zoom, file_path, covered, signature=None):
+        """Record a retiled file and the tile range it covers, replacing any previous record of it"""
+        name = op.relpath(file_path, self.dest_folder)
+        self.entries = [entry for entry in self.entries if entry['file'] != name]
+        self.entries.append(dict(file=name, zoom=zoom, tile_range=list(covered),
+                                 source=signature if signature is not None else source_signature(source)))
+        with open(self.manifest_file + '.tmp', 'w') as f:
+            json.dump(dict(files=self.entries), f)
+        os.replace(self.manifest_file + '.tmp', self.manifest_file)
+
+    def listed(self, file_path):
+        """Return True if a retiled file is recorded in the manifest"""
+        name = op.relpath(file_path, self.dest_folder)
+        return any(entry['file'] == name for entry in self.entries)
+
+def source_signature(source):
+    """Return the name, size and modification time of a source file, or only its name if it doesn't exist"""
+    if not op.exists(source):
+        return [op.basename(source)]
+    stat = os.stat(source)
+    return [op.basename(source), stat.st_size, int(stat.st_mtime)]
+
+def intersection(a, b):
+    """Return the intersection of two tile ranges, or None if they don't overlap"""
+    xmin, ymin = max(a[0], b[0]), max(a[1], b[1])
+    xmax, ymax = min(a[2], b[2]), min(a[3], b[3])
+    if xmin > xmax or ymin > ymax:
+        return None
+    return xmin, ymin, xmax, ymax
+
+def subtract(a, b):
+    """Return up to four tile ranges covering the tiles of range `a` outside of range `b`, which is within it"""
+    xmin, ymin, xmax, ymax = a
+    parts = [(xmin, ymin, b[0] - 1, ymax), (b[2] + 1, ymin, xmax, ymax),
+             (b[0], ymin, b[2], b[1] - 1), (b[0], b[3] + 1, b[2], ymax)]
+    return [part for part in parts if part[0] <= part[2] and part[1] <= part[3]]
+
+def range_bounds(rng, zoom):
+    """Return the [west, south, east, north] bounds of the tiles in a tile range"""
+    west, _, _, north = bounds(rng[0], rng[1], zoom)
+    _, south, east, _ = bounds(rng[2], rng[3], zoom)
+    return [west, south, east, north]
+
+def range_box(rng, zoom):
+    """Return a bounding box whose tile range is `rng`, spanning the centers of its corner tiles"""
+    west, north = _center(rng[0], rng[1], zoom)
+    east, south = _center(rng[2], rng[3], zoom)
+    return [west, south, east, north]
+
+def _center(x, y, zoom):
+    """Return the longitude and latitude of the center of a tile"""
+    west, south, east, north = bounds(x, y, zoom)
+    return (west + east) / 2, (south + north) / 2
@@ -0,0 +1,51 @@
+"""Run-length encode segmentation labels
+
+Segmentation labels are mostly background, so a 256 x 256 mask is stored as an (n, 2) array
+of (class index, run length) pairs, in row-major order. An empty mask is a single run.
+"""
+import numpy as np
+
+def encode(mask):
+    """Run-length encode a label mask
+
+    Parameters
+    ------------
+    mask: np.ndarray
+        A mask of class indices, e.g. a 256 x 256 segmentation label
+
+    Returns
+    ---------
+    runs: np.ndarray
+        An (n, 2) uint32 array of (class index, run length) pairs
+    """
+    flat = np.ravel(mask)
+    if not flat.size:
+        return np.empty((0, 2), dtype=np.uint32)
+    starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+    lengths = np.diff(np.append(starts, flat.size))
+    return np.stack((flat[starts], lengths), axis=1).astype(np.uint32)
+
+def decode(runs, shape=(256, 256), dtype=np.uint8):
+    """Decode run-length encoded (class index, run length) pairs to a dense mask
+
+    Parameters
+    ------------
+    runs: np.ndarray
+        An (n, 2) array of (class index, run length) pairs
+    shape: tuple
+        The shape of the mask
+    dtype: numpy dtype
+        The dtype of the mask
+
+    Returns
+    ---------
+    mask: np.ndarray
+        The dense mask
+    """
+    runs = np.asarray(runs)
+    return np.repeat(runs[:, 0].astype(dtype), runs[:, 1]).reshape(shape)
+
+def class_counts(runs, num_classes):
+    """Count the pixels of each class index in run-length encoded pairs, without decoding them"""
+    runs = np.asarray(runs, dtype=np.int64)
+    return np.bincount(runs[:, 0], weights=runs[:, 1], minlength=num_classes + 1).astype(np.int64)
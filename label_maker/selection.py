@@ -0,0 +1,172 @@
+"""Select tiles by the classes present in their labels
+
+A class-presence bitmask is computed once for every labeled tile, with NumPy operations over
+the label store's payload rather than by decoding labels one at a time. Positive examples,
+background tiles and random samples of background tiles are then selected from the bitmask.
+"""
+import random
+
+import numpy as np
+
+from label_maker import rle, tile_id
+from label_maker.label_store import sample_tiles
+
+def class_counts(ml_type, label, num_classes):
+    """Count the occurrences of each class index in a label
+
+    Returns an array of length `num_classes + 1`: the one-hot label itself for classification,
+    the number of bounding boxes of each class for object detection, and the number of pixels
+    of each class (counted from the run-length encoded label) for segmentation. A tile matches a class if its count is non-zero.
+    """
+    if ml_type == 'classification':
+        return np.asarray(label, dtype=np.int64)
+    elif ml_type == 'object-detection':
+        return np.bincount(np.asarray(label[:, 4], dtype=np.int64), minlength=num_classes + 1)
+    elif ml_type == 'segmentation':
+        return rle.class_counts(label, num_classes)
+    return None
+
+class TileSelection():
+    """Positive and background tiles, selected with a class-presence bitmask of each tile
+
+    Tiles which are labeled implicitly, by a label store's coverage, all have the same label
+    and are only enumerated when they're selected as positive examples.
+
+    Parameters
+    ------------
+    tiles: np.ndarray
+        The IDs of the explicitly labeled tiles
+    presence: np.ndarray
+        A boolean array of shape `(len(tiles), num_classes + 1)`, True where a class index
+        is present in a tile's label. Class index 0 is the background.
+    coverage: TileCoverage
+        The coverage of the implicitly labeled tiles, or None
+    default_presence: np.ndarray
+        The class indices present in the label of the implicit tiles. Defaults to none of them
+    """
+    def __init__(self, tiles, presence, coverage=None, default_presence=None):
+        self.tiles = tile_id.as_ids(tiles)
+        presence = np.asarray(presence, dtype=bool)
+        self.num_classes = presence.shape[1] - 1
+        # bit i % 8 of byte i // 8 is set if class index i is present
+        self.bitmask = np.packbits(presence, axis=1, bitorder='little')
+        self.coverage = coverage
+        if default_presence is None:
+            default_presence = np.zeros(presence.shape[1], dtype=bool)
+        self._default = np.asarray(default_presence, dtype=bool)
+
+    @classmethod
+    def from_store(cls, store, ml_type, num_classes):
+        """Select from the tiles of a LabelStore
+
+        Parameters
+        ------------
+        store: LabelStore
+            The labels of each tile
+        ml_type: str
+            Defines the type of machine learning. One of "classification", "object-detection", or "segmentation"
+        num_classes: int
+            The number of classes, excluding the background
+        """
+        default_presence = None
+        if store.coverage is not None:
+            default_presence = label_class_counts(store, ml_type, num_classes, store.default) > 0
+        presence = store_class_counts(store, ml_type, num_classes) > 0
+        return cls(store.tiles, presence, store.coverage, default_presence)
+
+    def has_class(self, class_index):
+        """Return a boolean mask of the explicit tiles whose label contains a class index"""
+        return ((self.bitmask[:, class_index >> 3] >> (class_index & 7)) & 1).astype(bool)
+
+    def positive_mask(self):
+        """Return a boolean mask of the explicit tiles whose label contains any class but the background"""
+        return (self.bitmask[:, 0] & 0xFE).astype(bool) | np.any(self.bitmask[:, 1:], axis=1)
+
+    def positive(self, class_index=None):
+        """Return the IDs of the tiles whose label contains a class index, or any class if None
+
+        Explicit tiles are returned in store order, followed by the implicit tiles if their
+        label matches.
+        """
+        if class_index is None:
+            ids, default_match = self.tiles[self.positive_mask()], np.any(self._default[1:])
+        else:
+            ids, default_match = self.tiles[self.has_class(class_index)], self._default[class_index]
+        if default_match and self.coverage:
+            ids = np.concatenate((ids, self.coverage.implicit_ids(np.arange(self.coverage.n_implicit))))
+        return ids
+
+    def background(self):
+        """Return the IDs of the explicit tiles whose label contains no class, in store order
+
+        Implicit background tiles are counted by `n_background` and sampled by
+        `sample_background`, but not enumerated.
+        """
+        return self.tiles[~self.positive_mask()]
+
+    @property
+    def n_background(self):
+        """The number of tiles whose label contains no class, including implicit tiles"""
+        n_explicit = len(self.tiles) - int(np.count_nonzero(self.positive_mask()))
+        return n_explicit + self._implicit_background()
+
+    def sample_background(self, n, seed=None):
+        """Return the IDs of `n` random background tiles, explicit tiles first
+
+        Parameters
+        ------------
+        n: int
+            The number of tiles to choose. Raises a ValueError if there are fewer background tiles than this.
+        seed: int
+            Random generator seed. Optional, use to make the sample reproducible.
+        """
+        coverage = self.coverage if self._implicit_background() else None
+        return sample_tiles(self.background(), coverage, n, random.Random(seed) if seed else random)
+
+    def _implicit_background(self):
+        """Return the number of implicit tiles whose label contains no class"""
+        if self.coverage is None or np.any(self._default[1:]):
+            return 0
+        return self.coverage.n_implicit
+
+def store_class_counts(store, ml_type, num_classes):
+    """Count the occurrences of each class index in each label written to a LabelStore
+
+    Classification labels are read at once, and the class column of every bounding box or
+    run-length encoded run is added to the counts of its tile, so labels aren't decoded.
+
+    Returns
+    ---------
+    counts: np.ndarray
+        An int64 array of shape `(len(store.tiles), num_classes + 1)`, like `class_counts`
+        for each label
+    """
+    n = len(store.tiles)
+    counts = np.zeros((n, num_classes + 1), dtype=np.int64)
+    if not n:
+        return counts
+    if ml_type == 'classification' and len(store.label_shape) == 1:
+        labels = np.asarray(store.data).reshape(n, -1)[:, :num_classes + 1]
+        counts[:, :labels.shape[1]] = labels
+    elif (ml_type == 'object-detection' and store.encoding is None) or \
+            (ml_type == 'segmentation' and store.encoding == 'rle'):
+        # each bounding box is (xmin, ymin, xmax, ymax, class) and each run is (class, length)
+        rows = np.asarray(store.data).reshape(-1, 5 if ml_type == 'object-detection' else 2)
+        row_tiles = np.repeat(np.arange(n), store.label_lengths())
+        classes = rows[:, 4 if ml_type == 'object-detection' else 0].astype(np.int64)
+        valid = (classes >= 0) & (classes <= num_classes)
+        weights = rows[valid, 1].astype(np.int64) if ml_type == 'segmentation' else 1
+        np.add.at(counts, (row_tiles[valid], classes[valid]), weights)
+    else:
+        for i in range(n):
+            counts[i] = label_class_counts(store, ml_type, num_classes, store.encoded_label(i))
+    return counts
+
+def label_class_counts(store, ml_type, num_classes, label):
+    """Return `class_counts` of a label read from a LabelStore as stored, with length `num_classes + 1`"""
+    if ml_type == 'segmentation' and store.encoding != 'rle':
+        label = rle.encode(label)
+    counts = np.zeros(num_classes + 1, dtype=np.int64)
+    label_counts = class_counts(ml_type, label, num_classes)[:num_classes + 1]
+    counts[:len(label_counts)] = label_counts
+    return counts
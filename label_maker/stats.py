@@ -0,0 +1,139 @@
+"""Per-class label statistics, saved next to the labels
+
+`label-maker labels` accumulates the statistics as each tile is labeled and saves them to
+`label_stats.json` in the destination folder. The other commands read them from there instead
+of rescanning the labels; they're only recomputed, from the label store, if the file is
+missing or older than the labels.
+"""
+import json
+from os import path as op
+
+import numpy as np
+
+from label_maker.label_store import open_labels
+from label_maker.selection import class_counts, label_class_counts, store_class_counts
+
+STATS_FILE = 'label_stats.json'
+
+class LabelStats():
+    """The number of tiles and features of each class, accumulated one label at a time
+
+    Features are bounding boxes for object detection, pixels for segmentation and, for
+    classification, the same as tiles. Index 0 of the counts is the background class.
+
+    Parameters
+    ------------
+    ml_type: str
+        Defines the type of machine learning. One of "classification", "object-detection", or "segmentation"
+    classes: list
+        A list of classes for machine learning training, as in the config file
+    """
+    def __init__(self, ml_type, classes):
+        self.ml_type = ml_type
+        self.class_names = [cl.get('name') for cl in classes]
+        self.tile_counts = np.zeros(len(classes) + 1, dtype=np.int64)
+        self.feature_counts = np.zeros(len(classes) + 1, dtype=np.int64)
+        self.total_tiles = 0
+        self.positive_tiles = 0
+        self.max_features = 0
+
+    def add(self, counts, n_tiles=1):
+        """Add the class counts (see `selection.class_counts`) of the label of `n_tiles` tiles"""
+        if not n_tiles:
+            return
+        counts = np.asarray(counts, dtype=np.int64)[:len(self.tile_counts)]
+        self.tile_counts[:len(counts)] += n_tiles * (counts > 0)
+        self.feature_counts[:len(counts)] += n_tiles * counts
+        self.total_tiles += n_tiles
+        if np.any(counts[1:]):
+            self.positive_tiles += n_tiles
+        if self.ml_type == 'object-detection':
+            self.max_features = max(self.max_features, int(counts.sum()))
+
+    def add_label(self, label, n_tiles=1):
+        """Add a label, as returned by the tile mapper, of `n_tiles` tiles"""
+        self.add(class_counts(self.ml_type, label, len(self.class_names)), n_tiles)
+
+    def print_summary(self):
+        """Print the number of tiles (and bounding boxes) of each class"""
+        print('---')
+        for i, name in enumerate(self.class_names):
+            if self.ml_type == 'object-detection':
+                print('{}: {} features in {} tiles'.format(name, self.feature_counts[i + 1], self.tile_counts[i + 1]))
+            else:
+                print('{}: {} tiles'.format(name, self.tile_counts[i + 1]))
+        print('Total tiles: {}'.format(self.total_tiles))
+
+    def to_dict(self):
+        """Return the statistics as a JSON serializable dict"""
+        return dict(ml_type=self.ml_type, classes=self.class_names, tile_counts=self.tile_counts.tolist(),
+                    feature_counts=self.feature_counts.tolist(), total_tiles=self.total_tiles,
+                    positive_tiles=self.positive_tiles, max_features=self.max_features)
+
+    @classmethod
+    def from_dict(cls, stats):
+        """Create statistics from the result of `to_dict`"""
+        self = cls(stats['ml_type'], [dict(name=name) for name in stats['classes']])
+        self.tile_counts[:] = stats['tile_counts']
+        self.feature_counts[:] = stats['feature_counts']
+        self.total_tiles = stats['total_tiles']
+        self.positive_tiles = stats['positive_tiles']
+        self.max_features = stats['max_features']
+        return self
+
+    @classmethod
+    def from_store(cls, store, ml_type, classes):
+        """Compute the statistics of the labels in a LabelStore, reading its payload once"""
+        self = cls(ml_type, classes)
+        counts = store_class_counts(store, ml_type, len(classes))
+        self.tile_counts += np.count_nonzero(counts, axis=0)
+        self.feature_counts += counts.sum(axis=0)
+        self.total_tiles = len(counts)
+        self.positive_tiles = int(np.count_nonzero(np.any(counts[:, 1:], axis=1)))
+        if ml_type == 'object-detection' and len(counts):
+            self.max_features = int(counts.sum(axis=1).max())
+        if store.n_implicit:
+            self.add(label_class_counts(store, ml_type, len(classes), store.default), store.n_implicit)
+        return self
+
+    def save(self, dest_folder):
+        """Write the statistics to `label_stats.json` in a folder"""
+        with open(op.join(dest_folder, STATS_FILE), 'w') as f:
+            json.dump(self.to_dict(), f)
+
+def label_stats(dest_folder, ml_type, classes, labels=None):
+    """Return the statistics of the labels in a folder
+
+    The statistics saved by `label-maker labels` are used if they're at least as new as the
+    label store and match `ml_type` and `classes`. Otherwise they're computed from the labels
+    and saved.
+
+    Parameters
+    ------------
+    dest_folder: str
+        Folder containing the labels
+    ml_type: str
+        Defines the type of machine learning. One of "classification", "object-detection", or "segmentation"
+    classes: list
+        A list of classes for machine learning training, as in the config file
+    labels: LabelStore
+        The labels in the folder, if they're already open
+
+    Returns
+    ---------
+    stats: LabelStats
+        The statistics of the labels
+    """
+    stats_file = op.join(dest_folder, STATS_FILE)
+    if labels is None:
+        # opening the labels converts labels.npz to a label store if it's newer
+        labels = open_labels(dest_folder, ml_type)
+    if op.exists(stats_file) and \
+            op.getmtime(stats_file) >= op.getmtime(op.join(labels.store_folder, 'meta.json')):
+        with open(stats_file) as f:
+            stats = json.load(f)
+        if stats.get('ml_type') == ml_type and stats.get('classes') == [cl.get('name') for cl in classes]:
+            return LabelStats.from_dict(stats)
+    stats = LabelStats.from_store(labels, ml_type, classes)
+    stats.save(dest_folder)
+    return stats
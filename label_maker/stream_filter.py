@@ -1,13 +1,196 @@
-"""Filter streaming geojson by a bounding box"""
-import sys
+"""Filter streaming geojson by a bounding box
+
+Reads line-delimited GeoJSON features, e.g. from `tippecanoe-decode -c`, from stdin and writes
+those intersecting the bounding box to stdout, in the same order:
+
+    python stream_filter.py '[xmin, ymin, xmax, ymax]' [--workers N] < features.json
+
+A list of bounding boxes keeps the features intersecting any of them.
+
+Most features are accepted or rejected by comparing the envelope of their coordinates to the
+bounding box; shapely geometries are only built for features whose envelope crosses its edge.
+Chunks of lines are filtered by a pool of worker processes. The throughput is reported on stderr.
+"""
+import argparse
+from collections import deque
+from itertools import islice
 import json
+import multiprocessing as mp
+import sys
+import time
+
 from shapely.geometry import shape, box
 
-bbox = box(*json.loads(sys.argv[1]))
+# the bounding box, set once in each worker process
+_worker = dict()
+
+def intersects(geometry, bounding_box, bbox_shape=None):
+    """Return whether a GeoJSON geometry intersects a bounding box
+
+    Parameters
+    ------------
+    geometry: dict
+        A GeoJSON geometry
+    bounding_box: list
+        The bounding box in the form `[xmin, ymin, xmax, ymax]`
+    bbox_shape: shapely.geometry.Polygon
+        The bounding box as a shapely geometry, if it's already built
+
+    Returns
+    ---------
+    intersects: bool
+        The same as `shapely.geometry.box(*bounding_box).intersects(shape(geometry))`
+    """
+    if not geometry:
+        return False
+    if 'coordinates' in geometry:
+        bounds = _envelope(geometry['coordinates'])
+    else:
+        bounds = shape(geometry).bounds or None
+    if bounds is None:
+        return False
+    xmin, ymin, xmax, ymax = bounds
+    west, south, east, north = bounding_box
+    if xmax < west or xmin > east or ymax < south or ymin > north:
+        return False
+    if xmin >= west and xmax <= east and ymin >= south and ymax <= north:
+        return True
+    return (bbox_shape or box(*bounding_box)).intersects(shape(geometry))
+
+def _envelope(coords):
+    """Return the (xmin, ymin, xmax, ymax) envelope of nested GeoJSON coordinates, or None if there are none
+
+    Plain Python is faster than NumPy for the few coordinates of most OSM features.
+    """
+    if not coords:
+        return None
+    # for points, the envelope is the point
+    if isinstance(coords[0], (int, float)):
+        return coords[0], coords[1], coords[0], coords[1]
+    # for lines and rings, the envelope of their points
+    if coords[0] and isinstance(coords[0][0], (int, float)):
+        xs = [point[0] for point in coords]
+        ys = [point[1] for point in coords]
+        return min(xs), min(ys), max(xs), max(ys)
+    # for other geometries, the envelope of their parts
+    envelopes = [e for e in map(_envelope, coords) if e is not None]
+    if not envelopes:
+        return None
+    return (min(e[0] for e in envelopes), min(e[1] for e in envelopes),
+            max(e[2] for e in envelopes), max(e[3] for e in envelopes))
+
+def filter_lines(lines, bounding_box, bbox_shape=None):
+    """Filter lines of GeoJSON features by a bounding box, or a list of bounding boxes
+
+    Returns
+    ---------
+    result: tuple
+        The lines of the features intersecting the bounding box, or any of the bounding boxes,
+        without their `tippecanoe` member, joined into one string, and the number of features read
+    """
+    return _filter(lines, _boxes(bounding_box, bbox_shape))
+
+def _boxes(bounding_box, bbox_shape=None):
+    """Return (bounding box, shapely geometry) pairs of a bounding box or a list of bounding boxes"""
+    if isinstance(bounding_box[0], (int, float)):
+        return [(bounding_box, bbox_shape or box(*bounding_box))]
+    return [(bbox, box(*bbox)) for bbox in bounding_box]
+
+def _filter(lines, boxes):
+    """Filter lines of GeoJSON features by (bounding box, shapely geometry) pairs"""
+    kept, count = [], 0
+    for line in lines:
+        if not line.strip():
+            continue
+        feature = json.loads(line)
+        feature.pop('tippecanoe', None)
+        count += 1
+        if any(intersects(feature['geometry'], bbox, bbox_shape) for bbox, bbox_shape in boxes):
+            kept.append(json.dumps(feature) + '\n')
+    return ''.join(kept), count
+
+def stream_filter(lines, bounding_box, out, workers=None, chunk_size=1024):
+    """Write the GeoJSON features intersecting a bounding box, in their input order
+
+    Lines are read in chunks of `chunk_size` and each chunk is submitted to the process pool
+    as one task. At most two tasks per worker are in flight at once, so memory use is bounded
+    by the chunk size rather than the length of the input.
+
+    Parameters
+    ------------
+    lines: iterable
+        Lines of GeoJSON features
+    bounding_box: list
+        The bounding box in the form `[xmin, ymin, xmax, ymax]`, or a list of bounding boxes
+    out: file
+        File to write the features to, one per line
+    workers: int
+        The number of worker processes. Defaults to the number of CPUs; with 1 the lines
+        are filtered in this process.
+    chunk_size: int
+        The number of lines in each task
+
+    Returns
+    ---------
+    count: int
+        The number of features read
+    """
+    lines = iter(lines)
+    chunks = iter(lambda: list(islice(lines, chunk_size)), [])
+    workers = workers or mp.cpu_count()
+    count = 0
+
+    if workers == 1:
+        _init_worker(bounding_box)
+        for chunk in chunks:
+            kept, n = _filter_chunk(chunk)
+            out.write(kept)
+            count += n
+        return count
+
+    pool = mp.Pool(workers, initializer=_init_worker, initargs=(bounding_box,))
+    try:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_filter_chunk, (chunk,)))
+            while pending and (len(pending) >= 2 * workers or pending[0].ready()):
+                kept, n = pending.popleft().get()
+                out.write(kept)
+                count += n
+        while pending:
+            kept, n = pending.popleft().get()
+            out.write(kept)
+            count += n
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return count
+
+def _init_worker(bounding_box):
+    """Store the bounding box, or bounding boxes, for the tasks run by this process"""
+    _worker['boxes'] = _boxes(bounding_box)
+
+def _filter_chunk(chunk):
+    """Filter a chunk of lines by the bounding boxes of this process"""
+    return _filter(chunk, _worker['boxes'])
+
+def main():
+    """Filter stdin to stdout, reporting the throughput on stderr"""
+    parser = argparse.ArgumentParser(description='Filter line-delimited GeoJSON features by a bounding box')
+    parser.add_argument('bounding_box', type=json.loads,
+                        help='[xmin, ymin, xmax, ymax], or a list of them, as a JSON array')
+    parser.add_argument('--workers', default=None, type=int,
+                        help='number of worker processes (defaults to the number of CPUs)')
+    parser.add_argument('--chunk-size', default=1024, type=int,
+                        help='number of lines sent to a worker process at a time')
+    args = parser.parse_args()
+
+    start = time.time()
+    count = stream_filter(sys.stdin, args.bounding_box, sys.stdout, args.workers, args.chunk_size)
+    elapsed = time.time() - start
+    sys.stderr.write('Filtered {} features in {:.1f}s ({:.0f} features/sec)\n'.format(
+        count, elapsed, count / elapsed if elapsed else 0))
 
-for line in sys.stdin:
-    geo = json.loads(line)
-    geom = shape(geo['geometry'])
-    geo.pop('tippecanoe')
-    if bbox.intersects(geom):
-        sys.stdout.write(json.dumps(geo) + '\n')
+if __name__ == '__main__':
+    main()
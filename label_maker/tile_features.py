@@ -0,0 +1,82 @@
+"""Stream GeoJSON features of tiles to a file"""
+import json
+import math
+
+import numpy as np
+
+from label_maker import tile_id
+
+def tile_bounds(ids):
+    """Return the (west, south, east, north) bounds of tile IDs, as arrays matching `mercantile.bounds`
+
+    Longitudes are computed for all tiles at once. Latitudes only depend on the tile row,
+    so they're computed once per distinct row edge, with the same functions as mercantile.
+    """
+    x, y, z = tile_id.decode(np.asarray(ids, dtype=np.int64).ravel())
+    z2 = np.power(2.0, z)
+    west = x / z2 * 360.0 - 180.0
+    east = (x + 1) / z2 * 360.0 - 180.0
+    # the north edge of row y and the south edge of row y + 1 are the same
+    edges, inverse = np.unique(np.concatenate((z << 32 | y, z << 32 | (y + 1))), return_inverse=True)
+    lats = np.array([_latitude(edge & 0xFFFFFFFF, edge >> 32) for edge in edges.tolist()], dtype=np.float64)
+    north, south = np.split(lats[inverse], 2)
+    return west, south, east, north
+
+def _latitude(y, zoom):
+    """Return the latitude of the north edge of a tile row, like `mercantile.ul`"""
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / math.pow(2, zoom)))))
+
+class TileFeatureWriter():
+    """Stream tiles as Polygon features of a GeoJSON FeatureCollection
+
+    Features are held in a buffer of `batch_size` tiles, whose polygons are then computed at
+    once and written out one feature per line, so memory use is bounded by the buffer rather
+    than the number of tiles.
+
+    Parameters
+    ------------
+    geojson_file: str
+        Path of the GeoJSON file to write
+    batch_size: int
+        The number of tiles whose polygons are computed at once
+    """
+    def __init__(self, geojson_file, batch_size=4096):
+        self.geojson_file = geojson_file
+        self.batch_size = batch_size
+        self.count = 0
+        self._file = open(geojson_file, 'w')
+        self._file.write('{"type": "FeatureCollection", "features": [\n')
+        self._tiles = []
+        self._properties = []
+
+    def write(self, tile, properties):
+        """Add a feature for a tile ID with the given properties"""
+        self._tiles.append(tile)
+        self._properties.append(properties)
+        if len(self._tiles) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered features to the file"""
+        if not self._tiles:
+            return
+        bounds = [b.tolist() for b in tile_bounds(self._tiles)]
+        for west, south, east, north, properties in zip(*bounds, self._properties):
+            feature = dict(type='Feature', geometry=dict(type='Polygon', coordinates=[
+                [[west, south], [west, north], [east, north], [east, south], [west, south]]]), properties=properties)
+            self._file.write('{}{}'.format(',\n' if self.count else '', json.dumps(feature)))
+            self.count += 1
+        self._tiles = []
+        self._properties = []
+
+    def close(self):
+        """Write any buffered features and close the file"""
+        self.flush()
+        self._file.write('\n]}\n')
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
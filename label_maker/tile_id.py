@@ -0,0 +1,84 @@
+"""Pack tile indices into 64-bit integer IDs
+
+A tile ID holds the zoom level in bits 56-60 and the Morton code (the interleaved bits) of the
+tile x and y indices in bits 0-55, supporting zoom levels up to 28. IDs sort by zoom level,
+then along a Z-order curve, so nearby tiles have nearby IDs. Sets of tiles are NumPy int64
+arrays; `x-y-z` strings are only created for file names with `to_names`.
+"""
+import numpy as np
+
+MAX_ZOOM = 28
+_ZOOM_SHIFT = 56
+_MORTON_MASK = (1 << _ZOOM_SHIFT) - 1
+
+def encode(x, y, z):
+    """Return the IDs of tiles given their x, y and z indices, as scalars or arrays
+
+    Returns an int for scalar indices and an int64 array otherwise.
+    """
+    if all(isinstance(i, (int, np.integer)) for i in (x, y, z)):
+        # plain integer arithmetic is much faster than NumPy for a single tile
+        x, y, z = int(x), int(y), int(z)
+    else:
+        x, y, z = [np.asarray(i, dtype=np.int64) for i in (x, y, z)]
+    if np.any(z > MAX_ZOOM):
+        raise ValueError('Tile IDs support zoom levels up to {}'.format(MAX_ZOOM))
+    return (z << _ZOOM_SHIFT) | _spread(x) | (_spread(y) << 1)
+
+def decode(ids):
+    """Return the x, y and z indices of tile IDs, as int64 arrays (or ints for a scalar ID)"""
+    ids = int(ids) if isinstance(ids, (int, np.integer)) else np.asarray(ids, dtype=np.int64)
+    morton = ids & _MORTON_MASK
+    return _compact(morton), _compact(morton >> 1), ids >> _ZOOM_SHIFT
+
+def from_name(name):
+    """Return the ID of a tile given as an `x-y-z` string"""
+    x, y, z = name.split('-')
+    return encode(int(x), int(y), int(z))
+
+def from_names(names):
+    """Return the IDs of tiles given as `x-y-z` strings, as an int64 array"""
+    names = list(names)
+    if not names:
+        return np.empty(0, dtype=np.int64)
+    # split all names at once rather than one at a time
+    xyz = np.array('-'.join(names).split('-'), dtype=np.int64).reshape(-1, 3)
+    return encode(xyz[:, 0], xyz[:, 1], xyz[:, 2])
+
+def to_name(tile_id):
+    """Return the `x-y-z` string of a tile ID"""
+    return '{}-{}-{}'.format(*decode(tile_id))
+
+def to_names(ids):
+    """Return the `x-y-z` strings of tile IDs"""
+    x, y, z = decode(np.asarray(ids, dtype=np.int64).ravel())
+    return ['{}-{}-{}'.format(*xyz) for xyz in zip(x.tolist(), y.tolist(), z.tolist())]
+
+def as_id(tile):
+    """Return the ID of a tile given as an ID or an `x-y-z` string"""
+    return from_name(tile) if isinstance(tile, str) else int(tile)
+
+def as_ids(tiles):
+    """Return the IDs of tiles given as IDs or `x-y-z` strings, as an int64 array"""
+    tiles = np.asarray(tiles if isinstance(tiles, np.ndarray) else list(tiles))
+    if tiles.dtype.kind in 'US':
+        return from_names(tiles.tolist())
+    return tiles.astype(np.int64, copy=False)
+
+def _spread(v):
+    """Insert a zero bit between each of the lower 32 bits of v"""
+    v = v & 0xFFFFFFFF
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    return (v | (v << 1)) & 0x5555555555555555
+
+def _compact(v):
+    """Collect every other bit of v, the inverse of _spread"""
+    v = v & 0x5555555555555555
+    v = (v | (v >> 1)) & 0x3333333333333333
+    v = (v | (v >> 2)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v >> 4)) & 0x00FF00FF00FF00FF
+    v = (v | (v >> 8)) & 0x0000FFFF0000FFFF
+    return (v | (v >> 16)) & 0xFFFFFFFF
@@ -0,0 +1,75 @@
+"""Map a function over the tiles of an MBTiles file with a pool of worker processes"""
+from collections import deque
+import multiprocessing as mp
+
+from label_maker.mbtiles import read_tiles, uncompress
+
+# the mapper and its arguments, set once in each worker process
+_worker = dict()
+
+def tilereduce(mbtiles_file, zoom, bounding_box, mapper, args, workers=None, chunk_size=64):
+    """Apply a mapper to every tile within a bounding box, yielding the results in order
+
+    Tiles are read from the MBTiles file in chunks of `chunk_size` and each chunk is submitted
+    to the process pool as one task. At most two tasks per worker are in flight at once, so
+    memory use is bounded by the chunk size rather than the number of tiles. The tile data is
+    sent to the workers as stored and uncompressed there, so the reader isn't a bottleneck
+    for the pool. Results are yielded in the order the tiles were read and any exception raised
+    by the mapper is re-raised here. The workers are spawned rather than forked, since the caller
+    may have threads running, e.g. writing label images, whose locks a fork could copy while held.
+
+    Parameters
+    ------------
+    mbtiles_file: str
+        Path to the MBTiles file
+    zoom: int
+        The zoom level to read tiles at
+    bounding_box: list
+        The bounding box in the form `[xmin, ymin, xmax, ymax]` as longitude and latitude values
+    mapper: function
+        A module level function called as `mapper(x, y, z, data, args)` for each tile
+    args: dict
+        Additional arguments passed to the mapper. They are sent to each worker once.
+    workers: int
+        The number of worker processes. Defaults to the number of CPUs; with 1 the tiles
+        are processed in this process.
+    chunk_size: int
+        The number of tiles in each task
+
+    Yields
+    ---------
+    result:
+        The return value of the mapper for each tile
+    """
+    chunks = read_tiles(mbtiles_file, zoom, bounding_box, chunk_size, compressed=True)
+    workers = workers or mp.cpu_count()
+
+    if workers == 1:
+        _init_worker(mapper, args)
+        for chunk in chunks:
+            yield from _map_chunk(chunk)
+        return
+
+    pool = mp.get_context('spawn').Pool(workers, initializer=_init_worker, initargs=(mapper, args))
+    try:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_map_chunk, (chunk,)))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _init_worker(mapper, args):
+    """Store the mapper and its arguments for the tasks run by this process"""
+    _worker['mapper'] = mapper
+    _worker['args'] = args
+
+def _map_chunk(chunk):
+    """Uncompress the data of a chunk of (x, y, z, data) tiles and apply the mapper to them"""
+    mapper, args = _worker['mapper'], _worker['args']
+    return [mapper(x, y, z, uncompress(data), args) for x, y, z, data in chunk]
@@ -0,0 +1,271 @@
+"""Decode Mapbox Vector Tiles lazily: feature properties first, geometries on demand"""
+# Vector tile specification: https://github.com/mapbox/vector-tile-spec/blob/master/2.1/vector_tile.proto
+import struct
+
+import numpy as np
+from mapbox_vector_tile.decoder import TileData
+from shapely.geometry import shape
+
+# geometry decoding is delegated to mapbox_vector_tile so decoded geometries are identical
+_geometry_decoder = TileData()
+
+def decode(data, y_coord_down=False):
+    """Decode a vector tile, deferring the decoding of each feature geometry until it's used
+
+    Parse the protobuf message directly, decoding the id, type and properties of every
+    feature but skipping over the encoded geometry. Each feature geometry is a LazyGeometry
+    whose coordinates are only decoded when they're accessed, e.g. to build a shape for a
+    feature matching a class. Filters on feature properties never decode geometries, and
+    neither do `$type` filters, except on polygons with several rings.
+
+    Parameters
+    ------------
+    data: bytes
+        Encoded (uncompressed) vector tile data
+    y_coord_down: bool
+        If False (the default), flip the y axis so the origin is at the bottom left of the tile
+
+    Returns
+    ---------
+    tile: dict
+        The decoded tile, with the same structure as `mapbox_vector_tile.decode`: each
+        layer name maps to a dict with `extent`, `version` and `features`
+    """
+    tile = dict()
+    for field, _, value in _fields(data, 0, len(data)):
+        if field == 3:
+            name, layer = _decode_layer(data, value[0], value[1], y_coord_down)
+            tile[name] = layer
+    return tile
+
+def geometry_bounds(geometry):
+    """Return the (xmin, ymin, xmax, ymax) bounds of a GeoJSON-like geometry, or None if it's empty
+
+    Like shapely, only the exterior ring of a polygon is considered.
+    """
+    geometry_type, coords = geometry['type'], geometry['coordinates']
+    if geometry_type == 'Point':
+        points = [coords]
+    elif geometry_type in ['LineString', 'MultiPoint']:
+        points = coords
+    elif geometry_type == 'MultiLineString':
+        points = [point for line in coords for point in line]
+    elif geometry_type == 'Polygon':
+        points = coords[0] if coords else []
+    elif geometry_type == 'MultiPolygon':
+        points = [point for polygon in coords for point in polygon[0]]
+    else:
+        return shape(geometry).bounds or None
+    if not len(points):
+        return None
+    points = np.asarray(points, dtype=np.float64)
+    return np.concatenate((points.min(axis=0), points.max(axis=0)))
+
+class LazyGeometry():
+    """A GeoJSON-like geometry mapping which decodes its coordinates on first access
+
+    The `type` member is derived from the feature type and the MoveTo commands without decoding
+    the coordinates, except for polygons with several rings: whether the rings are holes or
+    other polygons depends on their winding order.
+    """
+    __slots__ = ('_data', '_commands', '_ftype', '_extent', '_y_coord_down', '_geometry', '_type')
+
+    def __init__(self, data, commands, ftype, extent, y_coord_down):
+        self._data = data
+        self._commands = commands
+        self._ftype = ftype
+        self._extent = extent
+        self._y_coord_down = y_coord_down
+        self._geometry = None
+        self._type = None
+
+    @property
+    def decoded(self):
+        """Whether the geometry coordinates have been decoded"""
+        return self._geometry is not None
+
+    @property
+    def __geo_interface__(self):
+        return self._decode()
+
+    def _decode(self):
+        if self._geometry is None:
+            self._geometry = _geometry_decoder.parse_geometry(
+                self._command_integers(), self._ftype, self._extent, self._y_coord_down)
+            self._data = None
+        return self._geometry
+
+    def _command_integers(self):
+        """Return the geometry commands and parameters as a list of integers"""
+        commands = []
+        for item in self._commands:
+            if isinstance(item, tuple):
+                commands.extend(_packed(self._data, *item))
+            else:
+                commands.append(item)
+        return commands
+
+    def _geometry_type(self):
+        """Return the GeoJSON geometry type, decoding the geometry only if it's a polygon with several rings"""
+        if self._geometry is not None:
+            return self._geometry['type']
+        if self._type is None:
+            moves, points = _move_to_counts(self._command_integers())
+            if self._ftype == 1:
+                self._type = 'Point' if points == 1 else 'MultiPoint'
+            elif self._ftype == 2:
+                self._type = 'LineString' if moves <= 1 else 'MultiLineString'
+            elif self._ftype == 3 and moves == 1:
+                # unless the ring has no area, which mapbox_vector_tile decodes as an empty MultiPolygon
+                self._type = 'Polygon'
+            else:
+                return self._decode()['type']
+        return self._type
+
+    def __getitem__(self, key):
+        if key == 'type':
+            return self._geometry_type()
+        return self._decode()[key]
+
+    def __setitem__(self, key, value):
+        self._decode()[key] = value
+
+    def __contains__(self, key):
+        return key in self._decode()
+
+    def __iter__(self):
+        return iter(self._decode())
+
+    def __len__(self):
+        return len(self._decode())
+
+    def get(self, key, default=None):
+        """Return a geometry member, decoding the geometry if necessary"""
+        if key == 'type':
+            return self._geometry_type()
+        return self._decode().get(key, default)
+
+    def keys(self):
+        """Return the geometry members, decoding the geometry if necessary"""
+        return self._decode().keys()
+
+def _move_to_counts(commands):
+    """Return the number of MoveTo commands of a geometry and the number of points they move to"""
+    moves, points, i = 0, 0, 0
+    while i < len(commands):
+        command, count = commands[i] & 7, commands[i] >> 3
+        if command == 1:
+            moves += 1
+            points += count
+        # MoveTo and LineTo are followed by a pair of parameters for each point, ClosePath by none
+        i += 1 + (2 * count if command in (1, 2) else 0)
+    return moves, points
+
+def _decode_layer(data, start, end, y_coord_down):
+    """Decode a layer message, returning its name and a dict of its contents"""
+    name, version, extent = None, 1, 4096
+    keys, values, features = [], [], []
+    for field, _, value in _fields(data, start, end):
+        if field == 1:
+            name = data[value[0]:value[1]].decode('utf-8')
+        elif field == 2:
+            features.append(value)
+        elif field == 3:
+            keys.append(data[value[0]:value[1]].decode('utf-8'))
+        elif field == 4:
+            values.append(_decode_value(data, *value))
+        elif field == 5:
+            extent = value
+        elif field == 15:
+            version = value
+
+    decoded = []
+    for feature_start, feature_end in features:
+        fid, ftype, tags, commands = 0, 0, [], []
+        for field, wire_type, value in _fields(data, feature_start, feature_end):
+            if field == 1:
+                fid = value
+            elif field == 2:
+                tags.extend(_packed(data, *value) if wire_type == 2 else [value])
+            elif field == 3:
+                ftype = value
+            elif field == 4:
+                commands.append(value)
+        properties = {keys[k]: values[v] for k, v in zip(tags[::2], tags[1::2])}
+        decoded.append(dict(
+            geometry=LazyGeometry(data, commands, ftype, extent, y_coord_down),
+            properties=properties,
+            id=fid,
+            type=ftype
+        ))
+    return name, dict(extent=extent, version=version, features=decoded)
+
+def _decode_value(data, start, end):
+    """Decode a Value message, giving fields the same precedence as mapbox_vector_tile"""
+    fields = {field: value for field, _, value in _fields(data, start, end)}
+    if 7 in fields:
+        return bool(fields[7])
+    elif 3 in fields:
+        return struct.unpack('<d', fields[3])[0]
+    elif 2 in fields:
+        return struct.unpack('<f', fields[2])[0]
+    elif 4 in fields:
+        value = fields[4]
+        return value - (1 << 64) if value >= (1 << 63) else value
+    elif 6 in fields:
+        value = fields[6]
+        return (value >> 1) ^ -(value & 1)
+    elif 1 in fields:
+        return data[fields[1][0]:fields[1][1]].decode('utf-8')
+    elif 5 in fields:
+        return fields[5]
+    raise ValueError('Value message has no known value field')
+
+def _fields(data, pos, end):
+    """Iterate over the (field number, wire type, value) of each field in a message
+
+    Varints are returned as integers, fixed-width values as bytes and length-delimited
+    values as a (start, end) tuple of offsets into `data`.
+    """
+    while pos < end:
+        key, pos = _read_varint(data, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire_type == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        elif wire_type == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        else:
+            raise ValueError('Unsupported protobuf wire type {}'.format(wire_type))
+        yield key >> 3, wire_type, value
+
+def _packed(data, start, end):
+    """Decode a packed field of varints"""
+    values = []
+    pos = start
+    while pos < end:
+        value, pos = _read_varint(data, pos)
+        values.append(value)
+    return values
+
+def _read_varint(data, pos):
+    """Read a varint, returning its value and the position after it"""
+    byte = data[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+    result, shift = byte & 0x7f, 7
+    pos += 1
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
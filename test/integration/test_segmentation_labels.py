@@ -33,7 +33,7 @@ class TestSegmentationLabel(unittest.TestCase):
             '62093-50164-17': 2400,
             '62094-50162-17': 21234,
             '62094-50164-17': 19146,
-            '62094-50163-17': 21611,
+            '62094-50163-17': 21930,
             '62093-50163-17': 31568
         }
 
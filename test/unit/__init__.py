@@ -0,0 +1,10 @@
+"""Unit tests
+
+Tests comparing wall-clock timings are skipped unless the `LABEL_MAKER_BENCHMARK` environment
+variable is set, e.g. `LABEL_MAKER_BENCHMARK=1 python -m pytest test/unit -k benchmark`.
+"""
+import os
+import unittest
+
+benchmark = unittest.skipUnless(os.environ.get('LABEL_MAKER_BENCHMARK'),
+                                'set LABEL_MAKER_BENCHMARK=1 to run benchmarks')
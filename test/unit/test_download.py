@@ -0,0 +1,205 @@
+"""Tests for download.py"""
+import gzip
+import hashlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+from os import path as op
+import random
+import re
+import shutil
+from socketserver import ThreadingMixIn
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from label_maker import download
+from label_maker.download import SegmentedDownload, download_mbtiles, _etag_md5
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serve the content of the server, with byte ranges unless they're disabled"""
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        """Send the headers of the content, or Not Modified if the ETag in If-None-Match matches"""
+        with self.server.lock:
+            self.server.heads.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == self.server.etag:
+            self._send_headers(304, 0)
+        else:
+            self._send_headers(200, len(self.server.content))
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Send the content, or the requested range of it if the ETag in If-Range matches"""
+        server = self.server
+        content, start = server.content, 0
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        with server.lock:
+            server.requests.append(match and (int(match.group(1)), int(match.group(2))))
+            fail = server.failures > 0
+            server.failures -= 1
+        if match and server.ranges and (if_range is None or if_range == server.etag):
+            start, end = int(match.group(1)), int(match.group(2))
+            content = content[start:end + 1]
+            self._send_headers(206, len(content), 'bytes {}-{}/{}'.format(start, end, len(server.content)))
+        else:
+            self._send_headers(200, len(content))
+        # drop the connection part way through the response
+        self.wfile.write(content[:server.fail_after] if fail else content)
+        self.close_connection = True
+
+    def _send_headers(self, status, length, content_range=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(length))
+        self.send_header('ETag', self.server.etag)
+        self.send_header('Last-Modified', 'Tue, 01 Sep 2020 00:00:00 GMT')
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if content_range:
+            self.send_header('Content-Range', content_range)
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+class _Server(ThreadingMixIn, HTTPServer):
+    """An HTTP server handling each request in a thread"""
+    daemon_threads = True
+
+def _serve(content):
+    """Start a local HTTP server for some content, returning it and the URL of a file"""
+    server = _Server(('127.0.0.1', 0), _Handler)
+    server.content = content
+    server.etag = '"{}"'.format(hashlib.md5(content).hexdigest())
+    server.ranges = True
+    server.failures = 0
+    server.fail_after = 0
+    server.requests = []
+    server.heads = []
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/portugal.mbtiles.gz'.format(server.server_address[1])
+
+class TestDownload(unittest.TestCase):
+    """Tests for downloading files in byte-range segments from a local HTTP server"""
+    def setUp(self):
+        self.dest_folder = tempfile.mkdtemp()
+        rng = random.Random(0)
+        self.content = bytes(rng.getrandbits(8) for _ in range(256 * 1024))
+        self.server, self.url = _serve(self.content)
+        self.path = op.join(self.dest_folder, 'portugal.mbtiles.gz')
+        # split the test content into 4 segments, saving their progress every chunk
+        patches = [mock.patch.object(download, 'MIN_SEGMENT_SIZE', 64 * 1024),
+                   mock.patch.object(download, 'SAVE_INTERVAL', 1),
+                   mock.patch.object(download.time, 'sleep')]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dest_folder)
+
+    def _download(self, connections=4):
+        """Download the content, returning the data streamed"""
+        return b''.join(SegmentedDownload(self.url, self.path, connections, chunk_size=8192).stream(block_size=10000))
+
+    def test_download(self):
+        """Test downloading segments in parallel, streaming the data in order"""
+        self.assertEqual(self._download(), self.content)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(op.exists(self.path + '.part'))
+        self.assertFalse(op.exists(self.path + '.part.json'))
+        self.assertEqual(sorted(self.server.requests), [(0, 65535), (65536, 131071), (131072, 196607),
+                                                        (196608, 262143)])
+
+        # small files are downloaded in one segment
+        self.server.requests = []
+        self.assertEqual(self._download(connections=16), self.content)
+        self.assertEqual(len(self.server.requests), 4)
+        os.remove(self.path)
+        with mock.patch.object(download, 'MIN_SEGMENT_SIZE', 1024 * 1024):
+            self.server.requests = []
+            self.assertEqual(self._download(), self.content)
+            self.assertEqual(self.server.requests, [(0, len(self.content) - 1)])
+
+    def test_retry(self):
+        """Test that segments are requested again from where the connection was dropped"""
+        self.server.failures, self.server.fail_after = 2, 10000
+        self.assertEqual(self._download(), self.content)
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertTrue(any(start % 65536 for start, _ in self.server.requests))
+
+    def test_resume(self):
+        """Test resuming an interrupted download from the progress of each segment"""
+        self.server.failures, self.server.fail_after = 1000, 10000
+        with mock.patch.object(download, 'RETRIES', 0):
+            with self.assertRaises(Exception):
+                self._download()
+        with open(self.path + '.part.json') as f:
+            state = json.load(f)
+        self.assertEqual(state['size'], len(self.content))
+        self.assertTrue(any(position > start for start, _, position in state['segments']))
+        self.assertTrue(any(position < end for _, end, position in state['segments']))
+
+        self.server.failures, self.server.requests = 0, []
+        self.assertEqual(self._download(), self.content)
+        # only the rest of each segment is requested
+        self.assertEqual(sorted(self.server.requests),
+                         [(position, end - 1) for _, end, position in state['segments'] if position < end])
+
+        # a partial download of a file which has changed since is started again
+        self.server.failures = 1000
+        with mock.patch.object(download, 'RETRIES', 0):
+            with self.assertRaises(Exception):
+                self._download()
+        self.server.content = self.content[::-1]
+        self.server.etag = '"{}"'.format(hashlib.md5(self.server.content).hexdigest())
+        self.server.failures, self.server.requests = 0, []
+        self.assertEqual(self._download(), self.server.content)
+        self.assertEqual(sorted(start for start, _ in self.server.requests), [0, 65536, 131072, 196608])
+
+    def test_no_ranges(self):
+        """Test downloading from a server which doesn't accept byte ranges"""
+        self.server.ranges = False
+        self.assertEqual(self._download(), self.content)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_verify(self):
+        """Test that a download which doesn't match its ETag is discarded"""
+        self.server.etag = '"{}"'.format(hashlib.md5(b'other').hexdigest())
+        with self.assertRaises(IOError):
+            self._download()
+        self.assertFalse(op.exists(self.path))
+        self.assertFalse(op.exists(self.path + '.part'))
+
+        # if the file changes during the download, the server ignores the range request
+        self.server.etag = '"1-2"'
+        with mock.patch.object(SegmentedDownload, '_probe', autospec=True,
+                               side_effect=lambda d: setattr(d, 'etag', '"1-1"') or
+                               d.__dict__.update(size=len(self.content), ranges=True)):
+            with self.assertRaisesRegex(IOError, 'changed during the download'):
+                self._download()
+
+    def test_etag_md5(self):
+        """Test private function _etag_md5"""
+        self.assertEqual(_etag_md5('"D41D8CD98F00B204E9800998ECF8427E"'), 'd41d8cd98f00b204e9800998ecf8427e')
+        self.assertEqual(_etag_md5('W/"d41d8cd98f00b204e9800998ecf8427e"'), 'd41d8cd98f00b204e9800998ecf8427e')
+        self.assertIsNone(_etag_md5('"d41d8cd98f00b204e9800998ecf8427e-12"'))
+        self.assertIsNone(_etag_md5(None))
+
+    def test_download_mbtiles(self):
+        """Test that the QA tiles are decompressed as they're downloaded"""
+        self.server.content = gzip.compress(self.content)
+        self.server.etag = '"{}"'.format(hashlib.md5(self.server.content).hexdigest())
+        url = self.url.replace('portugal', '{}')
+        with mock.patch.object(download, 'QA_TILES_URL', url):
+            download_mbtiles(self.dest_folder, 'portugal', connections=2, cache=False)
+        with open(op.join(self.dest_folder, 'portugal.mbtiles'), 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(os.listdir(self.dest_folder), ['portugal.mbtiles'])
+
+if __name__ == '__main__':
+    unittest.main()
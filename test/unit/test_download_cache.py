@@ -0,0 +1,143 @@
+"""Tests for download_cache.py"""
+import gzip
+import hashlib
+import os
+from os import path as op
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from label_maker import download, download_cache
+from label_maker.download import download_mbtiles
+from label_maker.download_cache import DownloadCache, link
+from label_maker.mbtiles import read_tiles
+from test.unit.test_download import _serve
+
+class TestDownloadCache(unittest.TestCase):
+    """Tests for the download cache shared by destination folders"""
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache_dir = op.join(self.folder, 'cache')
+        rng = random.Random(0)
+        self.content = bytes(rng.getrandbits(8) for _ in range(64 * 1024))
+        self.server, self.url = _serve(self.content)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.folder)
+
+    def _add(self, cache, url, content, etag=None):
+        """Add content to a cache"""
+        file_path = op.join(self.folder, 'download')
+        with open(file_path, 'wb') as f:
+            f.write(content)
+        return cache.add(url, file_path, hashlib.sha256(content).hexdigest(), etag)
+
+    def test_lookup(self):
+        """Test that cached files are revalidated with a conditional request"""
+        cache = DownloadCache(self.cache_dir)
+        self.assertIsNone(cache.lookup(self.url))
+        blob = self._add(cache, self.url, self.content, self.server.etag)
+        self.assertEqual(cache.lookup(self.url), blob)
+        self.assertEqual(self.server.heads, [self.server.etag])
+
+        # a file which has changed on the server is downloaded again
+        self.server.etag = '"changed"'
+        self.assertIsNone(cache.lookup(self.url))
+
+        # but the cached file is used if the server can't be reached
+        self.server.shutdown()
+        self.server.server_close()
+        with mock.patch('builtins.print'):
+            self.assertEqual(cache.lookup(self.url), blob)
+
+    def test_evict(self):
+        """Test that the least recently used files are evicted once the cache is too large"""
+        cache = DownloadCache(self.cache_dir, max_size=2500)
+        with mock.patch.object(download_cache.time, 'time', side_effect=range(100)):
+            blobs = [self._add(cache, 'http://example.com/{}'.format(i), bytes([i]) * 1000) for i in range(2)]
+            # the same content from another URL is stored once
+            self.assertEqual(self._add(cache, 'http://example.com/copy', bytes([0]) * 1000), blobs[0])
+            self.assertEqual(cache.size(), 2000)
+            # using the first file makes the second one the least recently used
+            cache._use('http://example.com/0', cache._entry('http://example.com/0'))  # pylint: disable=protected-access
+            blobs.append(self._add(cache, 'http://example.com/2', bytes([2]) * 1000))
+        self.assertEqual([op.exists(blob) for blob in blobs], [True, False, True])
+        self.assertIsNone(cache._entry('http://example.com/1'))  # pylint: disable=protected-access
+        self.assertEqual(cache.size(), 2000)
+
+        # the file just added is kept, even if it's larger than the cache
+        blob = self._add(cache, 'http://example.com/large', bytes([3]) * 5000)
+        self.assertTrue(op.exists(blob))
+        self.assertEqual(cache.size(), 5000)
+
+    def test_link(self):
+        """Test hard linking files, with copies as a fallback"""
+        source = op.join(self.folder, 'source')
+        with open(source, 'wb') as f:
+            f.write(self.content)
+        dest = op.join(self.folder, 'dest')
+        self.assertEqual(link(source, dest), 'hardlink')
+        self.assertTrue(op.samefile(source, dest))
+        self.assertEqual(link(source, dest), 'hardlink')
+
+        os.remove(dest)
+        with mock.patch.object(download_cache.os, 'link', side_effect=OSError), \
+                mock.patch.object(download_cache, '_reflink', return_value=False):
+            self.assertEqual(link(source, dest), 'copy')
+        self.assertFalse(op.samefile(source, dest))
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_download_mbtiles(self):
+        """Test that QA tiles are downloaded once and linked into each destination folder"""
+        self.server.content = gzip.compress(self.content)
+        self.server.etag = '"{}"'.format(hashlib.md5(self.server.content).hexdigest())
+        url = self.url.replace('portugal', '{}')
+        dest_folders = [op.join(self.folder, name) for name in ['a', 'b', 'c']]
+        with mock.patch.object(download, 'QA_TILES_URL', url), mock.patch('builtins.print'):
+            for dest_folder in dest_folders[:2]:
+                os.makedirs(dest_folder)
+                download_mbtiles(dest_folder, 'portugal', cache_dir=self.cache_dir)
+            self.assertEqual(len(self.server.requests), 1)
+            files = [op.join(dest_folder, 'portugal.mbtiles') for dest_folder in dest_folders]
+            self.assertTrue(op.samefile(files[0], files[1]))
+            with open(files[1], 'rb') as f:
+                self.assertEqual(f.read(), self.content)
+            self.assertEqual(os.listdir(op.join(self.cache_dir, 'partial')), [])
+
+            # a file which has changed is downloaded again
+            self.server.content = gzip.compress(self.content[::-1])
+            self.server.etag = '"{}"'.format(hashlib.md5(self.server.content).hexdigest())
+            os.makedirs(dest_folders[2])
+            download_mbtiles(dest_folders[2], 'portugal', cache_dir=self.cache_dir)
+            self.assertEqual(len(self.server.requests), 2)
+            with open(files[2], 'rb') as f:
+                self.assertEqual(f.read(), self.content[::-1])
+    def test_download_mbtiles_subset(self):
+        """Test that only the QA tiles within the bounding box are saved, with or without the cache"""
+        mbtiles_file = 'test/fixtures/integration/portugal-z17.mbtiles'
+        bounding_box = [-9.4575, 38.8467, -9.4560, 38.8470]
+        with open(mbtiles_file, 'rb') as f:
+            self.server.content = gzip.compress(f.read())
+        self.server.etag = '"{}"'.format(hashlib.md5(self.server.content).hexdigest())
+        url = self.url.replace('portugal', '{}')
+        expected = list(read_tiles(mbtiles_file, 17, bounding_box))
+        with mock.patch.object(download, 'QA_TILES_URL', url), mock.patch('builtins.print'):
+            for cache in [True, False]:
+                dest_folder = op.join(self.folder, str(cache))
+                os.makedirs(dest_folder)
+                download_mbtiles(dest_folder, 'portugal', bounding_box=bounding_box, cache=cache,
+                                 cache_dir=self.cache_dir)
+                download_file = op.join(dest_folder, 'portugal.mbtiles')
+                self.assertLess(op.getsize(download_file), op.getsize(mbtiles_file))
+                self.assertEqual(list(read_tiles(download_file, 17, [-9.5, 38.8, -9.4, 38.9])), expected)
+        # the whole country is kept in the cache
+        blobs = os.listdir(op.join(self.cache_dir, 'blobs'))
+        self.assertEqual(op.getsize(op.join(self.cache_dir, 'blobs', blobs[0])), op.getsize(mbtiles_file))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,13 @@
 """Tests for filter.py"""
+import timeit
 import unittest
 from geojson import Feature, Polygon, LineString
 
 from label_maker.filter import create_filter, _compile, _compile_property_reference, \
      _compile_comparison_op, _compile_logical_op, _compile_in_op, _compile_has_op, \
-     _compile_negation, _stringify
+     _compile_negation, _stringify, _filter_key, _index_terms, _filter_properties, \
+     ClassMatcher, MemoizedClassMatcher, class_matcher
+from test.unit import benchmark
 
 line_geometry = LineString([(0, 0), (1, 1)])
 polygon_geometry = Polygon([(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)])
@@ -108,15 +111,238 @@ class TestCompiledFilters(unittest.TestCase):
         self.assertTrue(ff(passing))
         self.assertFalse(ff(failing))
 
+    def test_cached(self):
+        """Test that equivalent filters share one compiled function"""
+        ff = create_filter(['any', ['==', 'a', 5], ['has', 'b']])
+        self.assertIs(ff, create_filter(['any', ['==', 'a', 5], ['has', 'b']]))
+        self.assertIsNot(ff, create_filter(['any', ['==', 'a', 5], ['has', 'c']]))
+
+class TestClassMatcher(unittest.TestCase):
+    """Tests for matching features against multiple classes"""
+
+    classes = [dict(name='Building', filter=['has', 'building'], buffer=2),
+               dict(name='Roads', filter=['has', 'highway']),
+               dict(name='Polygons', filter=['==', '$type', 'Polygon'])]
+
+    def test_match(self):
+        """Test that a feature reports every matching class index"""
+        matcher = ClassMatcher(self.classes)
+        self.assertEqual(len(matcher), 3)
+        self.assertEqual(matcher.buffers, (2, None, None))
+        self.assertEqual(matcher.match(Feature(geometry=polygon_geometry, properties=dict(building='yes'))), [1, 3])
+        self.assertEqual(matcher.match(Feature(geometry=line_geometry, properties=dict(highway='primary'))), [2])
+        self.assertEqual(matcher.match(Feature(geometry=line_geometry, properties=dict(natural='water'))), [])
+
+    def test_match_indexed(self):
+        """Test that indexed matching agrees with evaluating every filter"""
+        classes = [dict(name='a', filter=['==', 'highway', 'primary']),
+                   dict(name='b', filter=['in', 'highway', 'primary', 'secondary']),
+                   dict(name='c', filter=['all', ['has', 'building'], ['!=', 'building', 'no']]),
+                   dict(name='d', filter=['any', ['==', 'amenity', 'parking'], ['has', 'parking']]),
+                   dict(name='e', filter=['!has', 'building']),
+                   dict(name='f', filter=['==', 'a', None]),
+                   dict(name='g', filter=['all', ['==', '$type', 'LineString'], ['in', 'highway', 'primary']]),
+                   dict(name='h', filter=['all', ['has', 'a'], ['any', ['has', 'b'], ['has', 'c']]]),
+                   dict(name='i', filter=['any', ['all', ['has', 'b'], ['has', 'c']], ['none', ['has', 'a']]]),
+                   dict(name='j', filter=['==', 'building', 'yes'])]
+        matcher = ClassMatcher(classes)
+        properties = [dict(highway='primary'), dict(highway='secondary'), dict(highway='track'),
+                      dict(building='yes'), dict(building='no'), dict(amenity='parking'),
+                      dict(parking='surface', a=1), dict(a=None), dict(), dict(c=1), dict(a=1, c=1),
+                      dict(a=1, b=1), dict(b=1, c=1), dict(building=['no']), dict(building=['yes'], a=[1])]
+        for props in properties:
+            for geometry in [line_geometry, polygon_geometry]:
+                feat = Feature(geometry=geometry, properties=props)
+                expected = [i + 1 for i, ff in enumerate(matcher.filters) if ff(feat)]
+                self.assertEqual(matcher.match(feat), expected)
+                self.assertEqual(matcher.match_any([feat], [0] * (len(classes) + 1))[1:],
+                                 [int(i + 1 in expected) for i in range(len(classes))])
+
+        # the compiled filters nest like Mapbox GL filters
+        self.assertFalse(create_filter(classes[7]['filter'])(Feature(geometry=line_geometry, properties=dict(c=1))))
+        self.assertEqual(ClassMatcher([dict(filter=['==', 'building', 'yes'])]).match(
+            Feature(geometry=line_geometry, properties=dict(building=['no']))), [])
+
+    def test_match_any(self):
+        """Test flagging the classes matched by any feature of a tile"""
+        matcher = ClassMatcher(self.classes)
+        features = [Feature(geometry=line_geometry, properties=dict(natural='water')),
+                    Feature(geometry=line_geometry, properties=dict(highway='primary'))]
+        self.assertEqual(matcher.match_any(features, [0, 0, 0, 0]), [0, 0, 1, 0])
+        self.assertEqual(matcher.match_any([], [0, 0, 0, 0]), [0, 0, 0, 0])
+        self.assertEqual(matcher.match_any(features[:1], [0, 1, 0, 0]), [0, 1, 0, 0])
+
+    def test_match_any_early_exit(self):
+        """Test that scanning stops once every class has matched"""
+        matcher = ClassMatcher(self.classes)
+        building = Feature(geometry=polygon_geometry, properties=dict(building='yes'))
+        road = Feature(geometry=line_geometry, properties=dict(highway='primary'))
+        scanned = []
+
+        def features():
+            """yield features, recording how many were scanned"""
+            for f in [building, road, building, road]:
+                scanned.append(f)
+                yield f
+        self.assertEqual(matcher.match_any(features(), [0, 0, 0, 0]), [0, 1, 1, 1])
+        self.assertEqual(len(scanned), 2)
+
+    def test_class_matcher(self):
+        """Test that a matcher is built once per class configuration"""
+        matcher = class_matcher(self.classes)
+        self.assertIs(matcher, class_matcher([dict(cl) for cl in self.classes]))
+        self.assertIsNot(matcher, class_matcher(self.classes[:2]))
+
+class TestMemoizedClassMatcher(unittest.TestCase):
+    """Tests for memoizing class matches by feature signature"""
+
+    classes = [dict(name='Building', filter=['has', 'building']),
+               dict(name='Polygon roads', filter=['all', ['==', '$type', 'Polygon'], ['has', 'highway']])]
+
+    def test_match(self):
+        """Test that memoized matches agree with the class matcher and are counted"""
+        matcher = MemoizedClassMatcher(self.classes, 2)
+        features = [Feature(geometry=polygon_geometry, properties={'building': 'yes', '@id': 1}),
+                    Feature(geometry=polygon_geometry, properties={'building': 'yes', '@id': 2}),
+                    Feature(geometry=line_geometry, properties={'highway': 'primary', '@id': 3}),
+                    Feature(geometry=polygon_geometry, properties={'highway': 'primary', '@id': 4})]
+        self.assertEqual([matcher.match(f) for f in features], [[1], [1], [], [2]])
+        self.assertEqual(matcher.stats(), (1, 3))
+        self.assertEqual(matcher.take_stats(), (1, 3))
+        self.assertEqual(matcher.match(features[0]), [1])
+        self.assertEqual(matcher.take_stats(), (0, 1))  # evicted by the bounded cache
+
+    def test_match_any(self):
+        """Test flagging the classes matched by any feature of a tile"""
+        matcher = MemoizedClassMatcher(self.classes, 10)
+        features = [Feature(geometry=line_geometry, properties=dict(highway='primary')),
+                    Feature(geometry=polygon_geometry, properties=dict(highway='primary'))]
+        self.assertEqual(matcher.match_any(features, [0, 0, 0]), [0, 0, 1])
+
+    def test_id_filters(self):
+        """Test that filters referencing $id are evaluated for every feature"""
+        matcher = MemoizedClassMatcher([dict(name='a', filter=['==', '$id', 1])], 10)
+        feature = Feature(id=1, geometry=line_geometry, properties=dict())
+        self.assertEqual(matcher.match(feature), [1])
+        self.assertEqual(matcher.match(feature), [1])
+        self.assertEqual(matcher.stats(), (0, 2))
+
+    def test_class_matcher(self):
+        """Test that class_matcher only memoizes when given a cache size"""
+        self.assertIsInstance(class_matcher(self.classes), ClassMatcher)
+        self.assertIsInstance(class_matcher(self.classes, 10), MemoizedClassMatcher)
+
+class TestFilterBenchmark(unittest.TestCase):
+    """Microbenchmark for compiled filter functions"""
+
+    per_feature_filter = ['all', ['==', '$type', 'Polygon'],
+                          ['any', ['has', 'building'], ['in', 'amenity', 'parking', 'school']]]
+    per_feature_features = [Feature(geometry=polygon_geometry, properties=dict(building='yes')),
+                            Feature(geometry=polygon_geometry, properties=dict(amenity='bank')),
+                            Feature(geometry=line_geometry, properties=dict(highway='primary'))]
+
+    def _eval_filter(self, f):
+        """the previous implementation: rebuild and eval the filter string per feature"""
+        p = f['properties'] if f else {} # pylint: disable=unused-variable
+        return eval(_compile(self.per_feature_filter)) # pylint: disable=eval-used
+
+    def test_per_feature(self):
+        """Test that compiled filters agree with re-evaluating the filter string"""
+        compiled_filter = create_filter(self.per_feature_filter)
+        for f in self.per_feature_features:
+            self.assertEqual(self._eval_filter(f), compiled_filter(f))
+
+    @benchmark
+    def test_per_feature_benchmark(self):
+        """Compare per-feature cost against re-evaluating the filter string"""
+        compiled_filter = create_filter(self.per_feature_filter)
+        features = self.per_feature_features
+        eval_cost = min(timeit.repeat(lambda: [self._eval_filter(f) for f in features], number=2000, repeat=3))
+        compiled_cost = min(timeit.repeat(lambda: [compiled_filter(f) for f in features], number=2000, repeat=3))
+        self.assertLess(compiled_cost, eval_cost)
+
+    dense_classes = [dict(name='Building', filter=['has', 'building']),
+                     dict(name='Primary', filter=['==', 'highway', 'primary']),
+                     dict(name='Secondary', filter=['==', 'highway', 'secondary']),
+                     dict(name='Minor roads', filter=['in', 'highway', 'residential', 'service', 'tertiary']),
+                     dict(name='Parking', filter=['==', 'amenity', 'parking']),
+                     dict(name='School', filter=['==', 'amenity', 'school']),
+                     dict(name='Water', filter=['any', ['==', 'natural', 'water'], ['has', 'waterway']]),
+                     dict(name='Park', filter=['==', 'leisure', 'park']),
+                     dict(name='Railway', filter=['has', 'railway']),
+                     dict(name='Trees', filter=['==', 'natural', 'tree'])]
+    # a synthetic dense urban tile: mostly buildings, some roads and a few other features
+    dense_tags = [dict(building='yes')] * 60 + [dict(building='house', amenity='school')] * 5 + \
+        [dict(highway='residential')] * 15 + [dict(highway='primary')] * 5 + \
+        [dict(amenity='parking')] * 5 + [dict(natural='tree')] * 5 + [dict(barrier='fence')] * 5
+
+    def _dense_features(self, repeat):
+        """Return the features of the dense tile"""
+        return [Feature(geometry=polygon_geometry, properties=dict(t, **{'@id': n}))
+                for n, t in enumerate(self.dense_tags * repeat)]
+
+    def test_dense_tile(self):
+        """Test that single-pass class matching agrees with evaluating every class filter"""
+        matcher = ClassMatcher(self.dense_classes)
+        for f in self._dense_features(1):
+            self.assertEqual(matcher.match(f), [i + 1 for i, ff in enumerate(matcher.filters) if ff(f)])
+
+    @benchmark
+    def test_dense_tile_benchmark(self):
+        """Compare single-pass class matching against evaluating every class filter"""
+        matcher = ClassMatcher(self.dense_classes)
+        features = self._dense_features(50)
+
+        def match_each(feat):
+            """evaluate every class filter against the feature"""
+            return [i + 1 for i, ff in enumerate(matcher.filters) if ff(feat)]
+
+        each_cost = min(timeit.repeat(lambda: [match_each(f) for f in features], number=3, repeat=3))
+        indexed_cost = min(timeit.repeat(lambda: [matcher.match(f) for f in features], number=3, repeat=3))
+        self.assertLess(indexed_cost, each_cost)
+
+    classification_classes = [dict(name='Building', filter=['has', 'building']),
+                              dict(name='Roads', filter=['has', 'highway']),
+                              dict(name='Parking', filter=['==', 'amenity', 'parking']),
+                              dict(name='Polygons', filter=['==', '$type', 'Polygon'])]
+
+    def _classification_features(self):
+        """Return the features of a tile of mostly buildings"""
+        tags = [dict(building='yes')] * 8 + [dict(highway='residential'), dict(amenity='parking')]
+        return [Feature(geometry=polygon_geometry, properties=dict(t, **{'@id': n}))
+                for n, t in enumerate(tags * 500)]
+
+    def test_classification_tile(self):
+        """Test that classifying a tile with early exit agrees with filtering every feature for every class"""
+        matcher = ClassMatcher(self.classification_classes)
+        features = self._classification_features()
+        self.assertEqual(matcher.match_any(features, [0] * 5),
+                         [0] + [int(bool([f for f in features if ff(f)])) for ff in matcher.filters])
+
+    @benchmark
+    def test_classification_tile_benchmark(self):
+        """Compare per-tile classification cost with and without early exit"""
+        matcher = ClassMatcher(self.classification_classes)
+        features = self._classification_features()
+
+        def each_class():
+            """the previous implementation: filter every feature for every class"""
+            return [0] + [int(bool([f for f in features if ff(f)])) for ff in matcher.filters]
+
+        each_cost = min(timeit.repeat(each_class, number=3, repeat=3))
+        early_cost = min(timeit.repeat(lambda: matcher.match_any(features, [0] * 5), number=3, repeat=3))
+        self.assertLess(early_cost, each_cost)
+
 class TestFilter(unittest.TestCase):
     """Tests for private filter.py functions"""
 
     def test_compile(self):
         """Test private function _compile"""
         self.assertEqual(_compile(['==', 'a', 5]), 'p.get("a")==5')
-        self.assertEqual(_compile(['any', ['==', 'a', 5], ['==', 'b', 3]]), 'p.get("a")==5 or p.get("b")==3')
-        self.assertEqual(_compile(['all', ['==', 'a', 5], ['==', 'b', 3]]), 'p.get("a")==5 and p.get("b")==3')
-        self.assertEqual(_compile(['none', ['==', 'a', 5], ['==', 'b', 3]]), 'not (p.get("a")==5 or p.get("b")==3)')
+        self.assertEqual(_compile(['any', ['==', 'a', 5], ['==', 'b', 3]]), '(p.get("a")==5) or (p.get("b")==3)')
+        self.assertEqual(_compile(['all', ['==', 'a', 5], ['==', 'b', 3]]), '(p.get("a")==5) and (p.get("b")==3)')
+        self.assertEqual(_compile(['none', ['==', 'a', 5], ['==', 'b', 3]]),
+                         'not ((p.get("a")==5) or (p.get("b")==3))')
         self.assertEqual(_compile(['in', 'a', 1, 2]), 'p.get("a") in [1, 2]')
         self.assertEqual(_compile(['!in', 'a', 1, 2]), 'not (p.get("a") in [1, 2])')
         self.assertEqual(_compile(['has', 'a']), '"a" in p')
@@ -135,7 +361,8 @@ class TestFilter(unittest.TestCase):
 
     def test_compile_logical_op(self):
         """Test private function _compile_logical_op"""
-        self.assertEqual(_compile_logical_op([['==', 'a', 5], ['==', 'b', 3]], ' and '), 'p.get("a")==5 and p.get("b")==3')
+        self.assertEqual(_compile_logical_op([['==', 'a', 5], ['==', 'b', 3]], ' and '),
+                         '(p.get("a")==5) and (p.get("b")==3)')
 
     def test_compile_in_op(self):
         """Test private function _compile_in_op"""
@@ -151,6 +378,31 @@ class TestFilter(unittest.TestCase):
         """Test private function _compile_negation"""
         self.assertEqual(_compile_negation('a'), 'not (a)')
 
+    def test_filter_key(self):
+        """Test private function _filter_key"""
+        self.assertEqual(_filter_key(['==', 'a', 5]), '["==","a",5]')
+        self.assertEqual(_filter_key(None), 'null')
+
+    def test_index_terms(self):
+        """Test private function _index_terms"""
+        self.assertEqual(_index_terms(['has', 'a']), ([('a', None)], True))
+        self.assertEqual(_index_terms(['==', 'a', 5]), ([('a', (5,))], True))
+        self.assertEqual(_index_terms(['in', 'a', 1, 2]), ([('a', (1, 2))], True))
+        self.assertEqual(_index_terms(['any', ['has', 'a'], ['==', 'b', 3]]), ([('a', None), ('b', (3,))], True))
+        self.assertEqual(_index_terms(['all', ['!has', 'a'], ['==', 'b', 3]]), ([('b', (3,))], False))
+        self.assertEqual(_index_terms(['any', ['!has', 'a'], ['==', 'b', 3]]), (None, False))
+        self.assertEqual(_index_terms(['==', '$type', 'Polygon']), (None, False))
+        self.assertEqual(_index_terms(['==', 'a', None]), (None, False))
+        self.assertEqual(_index_terms(['!in', 'a', 1]), (None, False))
+        self.assertEqual(_index_terms([]), (None, False))
+
+    def test_filter_properties(self):
+        """Test private function _filter_properties"""
+        self.assertEqual(_filter_properties(['==', 'a', 5]), {'a'})
+        self.assertEqual(_filter_properties(['all', ['has', 'a'], ['none', ['==', '$type', 'Point'], ['in', 'b', 1]]]),
+                         {'a', '$type', 'b'})
+        self.assertEqual(_filter_properties(None), set())
+
     def test_stringify(self):
         """Test private function _stringify"""
         self.assertEqual(_stringify(5), '5')
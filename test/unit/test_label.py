@@ -1,8 +1,20 @@
 """Tests for label.py"""
+from contextlib import redirect_stdout
+import io
+import json
+from os import path as op
+import shutil
+import sqlite3
+import tempfile
 import unittest
 import numpy as np
+from shapely.geometry import shape
 
-from label_maker.label import _mapper, _convert_coordinates, _pixel_bbox, _pixel_bounds_convert, _bbox_class
+from label_maker import rle, tile_id
+from label_maker.filter import ClassMatcher
+from label_maker.label import make_labels, _mapper, _overzoom_mapper, _convert_coordinates, _pixel_bbox, \
+    _pixel_bboxes, _object_bboxes, _segmentation_mask
+from label_maker.mbtiles import subset
 
 class TestLabel(unittest.TestCase):
     """Tests for private label functions"""
@@ -16,22 +28,43 @@ class TestLabel(unittest.TestCase):
         # for classification we return the one-hot array
         ml_type = 'classification'
         tile, label = _mapper(x, y, z, test_tile_data, dict(ml_type=ml_type, classes=classes))
-        self.assertEqual(tile, ('{!s}-{!s}-{!s}'.format(x, y, z)))
+        self.assertEqual(tile, tile_id.encode(x, y, z))
         self.assertTrue(np.array_equal(label, np.array([0, 1], dtype=np.int)))
 
         # for object-detection we return the bounding box and class
         ml_type = 'object-detection'
         tile, label = _mapper(x, y, z, test_tile_data, dict(ml_type=ml_type, classes=classes))
-        self.assertEqual(tile, ('{!s}-{!s}-{!s}'.format(x, y, z)))
+        self.assertEqual(tile, tile_id.encode(x, y, z))
         self.assertTrue(np.array_equal(label, np.array([[2, 232, 23, 253, 1]], dtype=np.int)))
 
-        # for segmentation we return the rasterized image
+        # for segmentation we return the run-length encoded rasterized image
         ml_type = 'segmentation'
         tile, label = _mapper(x, y, z, test_tile_data, dict(ml_type=ml_type, classes=classes))
         match_label = np.zeros((256, 256), dtype=np.int)
         match_label[236:249, 6:19] = 1
-        self.assertEqual(tile, ('{!s}-{!s}-{!s}'.format(x, y, z)))
-        self.assertTrue(np.array_equal(label, match_label))
+        self.assertEqual(tile, tile_id.encode(x, y, z))
+        self.assertTrue(np.array_equal(rle.decode(label), match_label))
+
+    def test_overzoom_mapper(self):
+        """Test for private function _overzoom_mapper"""
+        test_tile_data = b'\x1a5\n\x03osm\x12\x18\x12\x02\x00\x00\x18\x03"\x10\t\xc8\x01\xb8>\x1a\x00\x8f\x03\x90\x03\x00\x00\x90\x03\x0f\x1a\x08building"\x05\n\x03yes(\x80 x\x01'
+        classes = [dict(name="Building", filter=['has', 'building'])]
+        args = dict(ml_type='object-detection', classes=classes, zoom=4)
+
+        # the building is in the bottom left child tile, at twice the scale
+        tile_labels, cache_stats = _overzoom_mapper(1, 2, 3, test_tile_data, args)
+        self.assertIsNone(cache_stats)
+        self.assertEqual(len(tile_labels), 1)
+        tile, label = tile_labels[0]
+        self.assertEqual(tile, tile_id.encode(2, 5, 4))
+        self.assertTrue(np.array_equal(label, np.array([[8, 214, 41, 247, 1]])))
+
+        # child tiles without features matching a class are left out
+        args['classes'] = [dict(name="Roads", filter=['has', 'highway'])]
+        args['filter_cache'] = 16
+        tile_labels, cache_stats = _overzoom_mapper(1, 2, 3, test_tile_data, args)
+        self.assertEqual(tile_labels, [])
+        self.assertEqual(cache_stats, (0, 1))
 
     def test_convert_coordinates(self):
         """Test for private function _convert_coordinates"""
@@ -45,25 +78,75 @@ class TestLabel(unittest.TestCase):
         """Test for private function _pixel_bbox"""
         self.assertEqual(_pixel_bbox([1024, 512, 3072, 3584]), [60, 28, 195, 227])
 
-    def test_pixel_bounds_convert(self):
-        """Test for private function _pixel_bounds_convert"""
-        # ensure x and y edges match
-        self.assertEqual(_pixel_bounds_convert((0, 4096)), 255)
-        self.assertEqual(_pixel_bounds_convert((0, 0)), 0)
-        self.assertEqual(_pixel_bounds_convert((1, 0)), 255)
-        self.assertEqual(_pixel_bounds_convert((1, 4096)), 0)
-
-        # test interior point
-        self.assertEqual(_pixel_bounds_convert((0, 2048)), 128)
-        self.assertEqual(_pixel_bounds_convert((1, 2048)), 127)
-
-    def test_bbox_class(self):
-        """Test for private function _bbox_class"""
-        bc = _bbox_class(3)
-        passing = [0, 0, 1, 1, 3]
-        failing = [0, 0, 1, 1, 2]
-        self.assertTrue(bc(passing))
-        self.assertFalse(bc(failing))
+    def test_pixel_bboxes(self):
+        """Test for private function _pixel_bboxes"""
+        bounds = np.array([[1024, 512, 3072, 3584], [0, 0, 4096, 4096], [2048, 2048, 2048, 2048]])
+        self.assertTrue(np.array_equal(_pixel_bboxes(bounds), [[60, 28, 195, 227], [0, 0, 255, 255], [124, 123, 132, 131]]))
+        self.assertEqual(_pixel_bboxes(np.empty((0, 4))).shape, (0, 4))
+
+    def test_object_bboxes(self):
+        """Test for private function _object_bboxes"""
+        matcher = ClassMatcher([dict(name='Building', filter=['has', 'building']),
+                                dict(name='Buffered', filter=['has', 'building'], buffer=50)])
+        features = [dict(geometry=dict(type='LineString', coordinates=[[i * 10, i * 20], [i * 30, 4000 - i]]),
+                         properties=dict(building='yes')) for i in range(100)]
+        features.append(dict(geometry=dict(type='Point', coordinates=[5, 5]), properties=dict(highway='primary')))
+        bboxes = _object_bboxes(features, matcher)
+        self.assertEqual(bboxes.shape, (200, 5))
+        for n, feat in enumerate(features[:100]):
+            geo = shape(feat['geometry'])
+            self.assertEqual(bboxes[2 * n].tolist(), _pixel_bbox(geo.bounds) + [1])
+            self.assertEqual(bboxes[2 * n + 1].tolist(), _pixel_bbox(geo.buffer(50, 4).bounds) + [2])
+        self.assertEqual(_object_bboxes([], matcher).shape, (0, 5))
+
+    def test_segmentation_mask(self):
+        """Test for private function _segmentation_mask"""
+        square = dict(type='Polygon', coordinates=[[[1024, 1024], [2048, 1024], [2048, 2048], [1024, 2048], [1024, 1024]]])
+        overlapping = dict(type='Polygon', coordinates=[[[-1024, -1024], [1024, -1024], [1024, 1024], [-1024, 1024], [-1024, -1024]]])
+        features = [dict(geometry=square, properties=dict(building='yes', amenity='school')),
+                    dict(geometry=overlapping, properties=dict(building='yes'))]
+        matcher = ClassMatcher([dict(name='Building', filter=['has', 'building']),
+                                dict(name='School', filter=['==', 'amenity', 'school'])])
+        mask = _segmentation_mask(features, matcher)
+        self.assertEqual(mask.dtype, np.uint8)
+        # a feature matching both classes is converted once and rasterized with the last class
+        self.assertEqual(np.count_nonzero(mask == 2), 64 * 64)
+        # features extending beyond the tile are clipped to it
+        self.assertEqual(np.count_nonzero(mask == 1), 64 * 64)
+        self.assertEqual(mask[254, 0], 1)
+        self.assertFalse(np.any(_segmentation_mask(features, ClassMatcher([dict(name='None', filter=['has', 'a'])]))))
+
+class TestMakeLabels(unittest.TestCase):
+    """Tests for make_labels"""
+    def setUp(self):
+        self.dest_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dest_folder)
+
+    def test_source_bounds(self):
+        """Test that QA tiles downloaded for a bounding box not covering the labeled one are rejected"""
+        config = json.load(open('test/fixtures/integration/config.integration.json'))
+        config.update(dest_folder=self.dest_folder, sparse=False, workers=1)
+        mbtiles_file = op.join(self.dest_folder, 'portugal.mbtiles')
+        subset('test/fixtures/integration/portugal-z17.mbtiles', mbtiles_file, [-9.4575, 38.8467, -9.4550, 38.8490])
+        with self.assertRaisesRegex(ValueError, 'Re-run `label-maker download`'):
+            make_labels(**config)
+        self.assertFalse(op.exists(op.join(self.dest_folder, 'labels.npz')))
+
+    def test_full_download_bounds(self):
+        """Test that the bounds metadata of a full download, the extent of its data, isn't checked"""
+        config = json.load(open('test/fixtures/integration/config.integration.json'))
+        config.update(dest_folder=self.dest_folder, sparse=False, workers=1)
+        mbtiles_file = op.join(self.dest_folder, 'portugal.mbtiles')
+        shutil.copyfile('test/fixtures/integration/portugal-z17.mbtiles', mbtiles_file)
+        conn = sqlite3.connect(mbtiles_file)
+        conn.execute("UPDATE metadata SET value = '-9.4575,38.8467,-9.4550,38.8490' WHERE name = 'bounds'")
+        conn.commit()
+        conn.close()
+        with redirect_stdout(io.StringIO()):
+            make_labels(**config)
+        self.assertTrue(op.exists(op.join(self.dest_folder, 'labels.npz')))
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,67 @@
+"""Tests for label_images.py"""
+import os
+from os import path as op
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from label_maker import rle, tile_id
+from label_maker.label_images import LabelImageWriter, label_image
+from label_maker.palette import class_color, class_palette
+
+class TestLabelImages(unittest.TestCase):
+    """Tests for label images"""
+    def setUp(self):
+        self.dest_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dest_folder)
+
+    def test_class_palette(self):
+        """Test that the palette holds the color of each class index"""
+        palette = class_palette()
+        self.assertEqual(len(palette), 256 * 3)
+        for c in [0, 1, 6, 7, 255]:
+            self.assertEqual(tuple(palette[3 * c:3 * c + 3]), class_color(c))
+
+    def test_segmentation_image(self):
+        """Test that a segmentation image matches coloring each pixel by class"""
+        mask = np.zeros((256, 256), dtype=np.uint8)
+        mask[10:20, 30:40] = 2
+        mask[100:, 200:] = 7
+        img = label_image('segmentation', rle.encode(mask))
+        self.assertEqual(img.mode, 'P')
+        expected = np.array([class_color(l) for l in np.nditer(mask)]).reshape(256, 256, 3).astype(np.uint8)
+        self.assertTrue(np.array_equal(np.array(img.convert('RGB')), expected))
+
+    def test_object_detection_image(self):
+        """Test that an object detection image matches drawing each box by class"""
+        bboxes = np.array([[10, 10, 50, 60, 1], [40, 20, 255, 255, 3]])
+        img = label_image('object-detection', bboxes)
+        expected = Image.new('RGB', (256, 256))
+        draw = ImageDraw.Draw(expected)
+        for box in bboxes:
+            draw.rectangle(((box[0], box[1]), (box[2], box[3])), outline=class_color(box[4]))
+        self.assertTrue(np.array_equal(np.array(img.convert('RGB')), np.array(expected)))
+        with self.assertRaises(ValueError):
+            label_image('classification', np.array([0, 1]))
+
+    def test_label_image_writer(self):
+        """Test that images are saved by the writer's threads"""
+        tiles = tile_id.from_names(['{}-2-10'.format(x) for x in range(20)])
+        with LabelImageWriter(self.dest_folder, 'object-detection', threads=2) as writer:
+            for tile in tiles:
+                writer.write(tile, np.array([[10, 10, 50, 60, 1]]))
+        self.assertEqual(writer.count, 20)
+        self.assertEqual(sorted(os.listdir(self.dest_folder)), sorted('{}.png'.format(t) for t in tile_id.to_names(tiles)))
+
+        # errors while saving are raised
+        with self.assertRaises(OSError):
+            with LabelImageWriter(op.join(self.dest_folder, 'missing'), 'object-detection') as writer:
+                writer.write(tiles[0], np.array([[10, 10, 50, 60, 1]]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+"""Tests for label_store.py"""
+import os
+from os import path as op
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from label_maker import rle, tile_id
+from label_maker.label_store import LabelWriter, LabelStoreWriter, LabelStore, TileCoverage, convert_labels, \
+    open_labels, sample_tiles
+
+class TestLabelWriter(unittest.TestCase):
+    """Tests for streaming labels to disk"""
+    def setUp(self):
+        self.dest_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dest_folder)
+
+    def test_label_writer(self):
+        """Test that streamed labels can be loaded like np.savez output"""
+        labels = {'1-2-3': np.array([0, 1]), '1-3-3': np.empty((0, 5), dtype=np.int64),
+                  '2-2-3': np.ones((256, 256), dtype=np.uint8)}
+        labels_file = op.join(self.dest_folder, 'labels.npz')
+        with LabelWriter(labels_file) as writer:
+            for tile, label in labels.items():
+                writer.write(tile, label)
+        self.assertEqual(writer.count, 3)
+
+        loaded = np.load(labels_file)
+        self.assertEqual(loaded.files, list(labels.keys()))
+        for tile, label in labels.items():
+            self.assertEqual(loaded[tile].dtype, label.dtype)
+            self.assertTrue(np.array_equal(loaded[tile], label))
+
+    def test_label_writer_buffer(self):
+        """Test that labels are written once the buffer is full"""
+        labels_file = op.join(self.dest_folder, 'labels.npz')
+        writer = LabelWriter(labels_file, buffer_size=256 * 256)
+        writer.write('1-2-3', np.zeros(10, dtype=np.uint8))
+        self.assertEqual(len(writer._buffer), 1)
+        writer.write('1-3-3', np.zeros((256, 256), dtype=np.uint8))
+        self.assertEqual(len(writer._buffer), 0)
+        writer.write('2-2-3', np.zeros(10, dtype=np.uint8))
+        writer.close()
+        self.assertEqual(np.load(labels_file).files, ['1-2-3', '1-3-3', '2-2-3'])
+
+class TestLabelStore(unittest.TestCase):
+    """Tests for the indexed label store"""
+    def setUp(self):
+        self.dest_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dest_folder)
+
+    def test_label_store(self):
+        """Test that labels are read back from the store by tile and in order"""
+        labels = {'1-2-3': np.array([[0, 0, 1, 1, 1], [2, 2, 3, 3, 2]]), '1-3-3': np.empty((0, 5), dtype=np.int64),
+                  '2-2-3': np.array([[4, 4, 5, 5, 1]])}
+        store_folder = op.join(self.dest_folder, 'label_store')
+        with LabelStoreWriter(store_folder) as writer:
+            for tile, label in labels.items():
+                writer.write(tile, label)
+
+        store = LabelStore(store_folder)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.files, list(labels.keys()))
+        self.assertTrue('1-3-3' in store)
+        self.assertFalse('3-3-3' in store)
+        self.assertIsInstance(store.data, np.memmap)
+        for tile, label in labels.items():
+            self.assertEqual(store[tile].dtype, label.dtype)
+            self.assertTrue(np.array_equal(store[tile], label))
+        self.assertEqual(tile_id.to_names(store.tiles), list(labels.keys()))
+        self.assertTrue(np.array_equal(store[tile_id.from_name('2-2-3')], labels['2-2-3']))
+        self.assertEqual([tile for tile, _ in store.items()], tile_id.from_names(labels.keys()).tolist())
+
+        # labels must have the same trailing dimensions
+        writer = LabelStoreWriter(op.join(self.dest_folder, 'other'))
+        writer.write('1-2-3', np.zeros((2, 5)))
+        with self.assertRaises(ValueError):
+            writer.write('1-3-3', np.zeros((2, 4)))
+
+    def test_rle_label_store(self):
+        """Test that run-length encoded labels are decoded on access"""
+        mask = np.zeros((256, 256), dtype=np.uint8)
+        mask[10:20, 30:40] = 2
+        store_folder = op.join(self.dest_folder, 'label_store')
+        with LabelStoreWriter(store_folder, encoding='rle') as writer:
+            writer.write('1-2-3', mask)
+            writer.write_encoded('1-3-3', rle.encode(np.zeros((256, 256))))
+
+        store = LabelStore(store_folder)
+        self.assertEqual(store['1-2-3'].dtype, np.uint8)
+        self.assertTrue(np.array_equal(store['1-2-3'], mask))
+        self.assertFalse(np.any(store['1-3-3']))
+        self.assertEqual(store.encoded('1-3-3').tolist(), [[0, 256 * 256]])
+        self.assertEqual([label.shape[1] for _, label in store.items(encoded=True)], [2, 2])
+
+        # segmentation labels are run-length encoded when converted
+        np.savez(op.join(self.dest_folder, 'labels.npz'), **{'1-2-3': mask})
+        store = open_labels(self.dest_folder, 'segmentation')
+        self.assertEqual(store.encoding, 'rle')
+        self.assertTrue(np.array_equal(store['1-2-3'], mask))
+
+    def test_implicit_labels(self):
+        """Test that tiles in the coverage which weren't written have the default label"""
+        store_folder = op.join(self.dest_folder, 'label_store')
+        with LabelStoreWriter(store_folder, encoding='rle') as writer:
+            writer.write('2-3-3', np.ones((256, 256), dtype=np.uint8))
+            writer.set_coverage(3, (1, 2, 3, 4), np.zeros((256, 256), dtype=np.uint8))
+
+        store = LabelStore(store_folder)
+        self.assertEqual(len(store), 9)
+        self.assertEqual(store.n_implicit, 8)
+        self.assertEqual(store.explicit_files, ['2-3-3'])
+        self.assertEqual(sorted(store.files), sorted('{}-{}-3'.format(x, y) for x in range(1, 4) for y in range(2, 5)))
+        self.assertTrue(np.all(store['2-3-3'] == 1))
+        self.assertFalse(np.any(store['1-4-3']))
+        self.assertEqual(store.encoded('3-2-3').tolist(), [[0, 256 * 256]])
+        self.assertTrue('3-4-3' in store)
+        self.assertFalse('4-4-3' in store)
+        self.assertFalse('2-3-4' in store)
+        with self.assertRaises(KeyError):
+            store['4-4-3']  # pylint: disable=pointless-statement
+        self.assertEqual(len(list(store.items(implicit=False))), 1)
+        self.assertEqual(len(list(store.items(encoded=True))), 9)
+
+    def test_tile_coverage(self):
+        """Test that implicit tiles are located arithmetically"""
+        coverage = TileCoverage(3, (1, 2, 3, 4), ['2-3-3', '1-2-3', '9-9-3', '3-4-3'])
+        self.assertEqual(coverage.n_implicit, 6)
+        self.assertEqual(coverage.position('1-2-3'), 0)
+        self.assertEqual(coverage.position('2-3-3'), 4)
+        self.assertIsNone(coverage.position('2-3-2'))
+        self.assertIsNone(coverage.position('not-a-tile'))
+        self.assertEqual(coverage.position(tile_id.from_name('2-3-3')), 4)
+        self.assertEqual(coverage.positions(['3-4-3', '9-9-3']).tolist(), [8, -1])
+        self.assertEqual(tile_id.to_names(coverage.implicit_ids(range(6))),
+                         ['1-3-3', '1-4-3', '2-2-3', '2-4-3', '3-2-3', '3-3-3'])
+        self.assertEqual(tile_id.to_names(coverage.implicit_ids([5, 0])), ['3-3-3', '1-3-3'])
+        self.assertEqual(len(set(coverage.sample_implicit(6).tolist())), 6)
+
+    def test_sample_tiles(self):
+        """Test sampling tiles from a list and the implicit tiles of a coverage"""
+        explicit = tile_id.from_names(['2-3-3'])
+        coverage = TileCoverage(3, (1, 2, 3, 4), explicit)
+        all_tiles = set(explicit.tolist() + coverage.implicit_ids(range(coverage.n_implicit)).tolist())
+        sample = sample_tiles(explicit, coverage, 9)
+        self.assertEqual(sample.dtype, np.int64)
+        self.assertEqual(set(sample.tolist()), all_tiles)
+        self.assertEqual(tile_id.to_name(sample[0]), '2-3-3')
+        self.assertEqual(len(set(sample_tiles(explicit, coverage, 4).tolist())), 4)
+        self.assertEqual(tile_id.to_names(sample_tiles(['1-1-1', '1-2-1'], None, 2)), ['1-1-1', '1-2-1'])
+        with self.assertRaises(ValueError):
+            sample_tiles(explicit, coverage, 10)
+
+    def test_empty_label_store(self):
+        """Test that a store without labels can be read"""
+        store_folder = op.join(self.dest_folder, 'label_store')
+        LabelStoreWriter(store_folder).close()
+        self.assertEqual(LabelStore(store_folder).files, [])
+
+    def test_convert_labels(self):
+        """Test that a labels.npz file is converted, and reconverted when it's newer than the store"""
+        labels_file = op.join(self.dest_folder, 'labels.npz')
+        shutil.copyfile('test/fixtures/integration/labels-cl.npz', labels_file)
+        expected = np.load(labels_file)
+        store = open_labels(self.dest_folder)
+        self.assertEqual(store.files, expected.files)
+        for tile in expected.files:
+            self.assertTrue(np.array_equal(store[tile], expected[tile]))
+
+        # an up to date store is opened as is
+        meta_mtime = op.getmtime(op.join(self.dest_folder, 'label_store', 'meta.json'))
+        self.assertEqual(open_labels(self.dest_folder).files, expected.files)
+        self.assertEqual(op.getmtime(op.join(self.dest_folder, 'label_store', 'meta.json')), meta_mtime)
+
+        # a newer labels.npz replaces the store
+        np.savez(labels_file, **{'1-2-3': np.array([1, 0])})
+        os.utime(labels_file, (meta_mtime + 1, meta_mtime + 1))
+        self.assertEqual(open_labels(self.dest_folder).files, ['1-2-3'])
+
+        # stores written before tile IDs list x-y-z names
+        np.save(op.join(self.dest_folder, 'label_store', 'tiles.npy'), np.array(['1-2-3']))
+        self.assertEqual(LabelStore(op.join(self.dest_folder, 'label_store')).tiles.tolist(),
+                         [tile_id.from_name('1-2-3')])
+
+        convert_labels('test/fixtures/integration/labels-od.npz', op.join(self.dest_folder, 'od'))
+        store = LabelStore(op.join(self.dest_folder, 'od'))
+        expected = np.load('test/fixtures/integration/labels-od.npz')
+        for tile in expected.files:
+            self.assertTrue(np.array_equal(store[tile], expected[tile]))
+
+if __name__ == '__main__':
+    unittest.main()
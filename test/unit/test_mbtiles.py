@@ -0,0 +1,172 @@
+"""Tests for mbtiles.py"""
+import gzip
+from os import path as op
+import shutil
+import sqlite3
+import tempfile
+import timeit
+import unittest
+
+from mercantile import tiles, bounds
+from shapely.geometry import Point
+
+from label_maker.mbtiles import connect, tile_range, read_tiles, subset, max_zoom, uncompress, \
+    subset_bounds, _flip_y
+from test.unit import benchmark
+
+mbtiles_file = 'test/fixtures/integration/portugal-z17.mbtiles'
+bounding_box = [-9.4575, 38.8467, -9.4510, 38.8513]
+
+class TestMBTiles(unittest.TestCase):
+    """Tests for reading MBTiles files"""
+    def test_tile_range(self):
+        """Test that the tile range covers the same tiles as mercantile"""
+        for bbox, zoom in [(bounding_box, 17), ([-10, 35, 5, 45], 6), ([-180, -90, 180, 90], 2)]:
+            xmin, ymin, xmax, ymax = tile_range(bbox, zoom)
+            expected = list(tiles(*bbox, [zoom]))
+            self.assertEqual((xmin, ymin), (expected[0].x, expected[0].y))
+            self.assertEqual((xmax, ymax), (expected[-1].x, expected[-1].y))
+
+    def test_read_tiles(self):
+        """Test that tiles are read in batches with XYZ indices and uncompressed data"""
+        batches = list(read_tiles(mbtiles_file, 17, bounding_box, batch_size=2))
+        self.assertEqual([len(b) for b in batches], [2, 2, 2, 2, 1])
+        tile_list = [t for b in batches for t in b]
+        self.assertEqual(sorted('{}-{}-{}'.format(*t[:3]) for t in tile_list),
+                         sorted('{}-{}-{}'.format(*t) for t in tiles(*bounding_box, [17])))
+        self.assertTrue(all(t[3][:2] != b'\x1f\x8b' for t in tile_list))
+
+        # tiles outside of the bounding box are not read
+        small_bbox = [-9.4575, 38.8467, -9.4560, 38.8470]
+        self.assertEqual(list(read_tiles(mbtiles_file, 17, small_bbox)),
+                         [[t for t in tile_list if t[:3] in tiles(*small_bbox, [17])]])
+
+    def test_subset(self):
+        """Test that a subset has the tiles and metadata of the tiles within a bounding box"""
+        folder = tempfile.mkdtemp()
+        try:
+            subset_file = op.join(folder, 'subset.mbtiles')
+            small_bbox = [-9.4575, 38.8467, -9.4560, 38.8470]
+            self.assertEqual(subset(mbtiles_file, subset_file, small_bbox), 2)
+            self.assertEqual(list(read_tiles(subset_file, 17, bounding_box)), list(read_tiles(mbtiles_file, 17, small_bbox)))
+            conn = sqlite3.connect(subset_file)
+            metadata = dict(conn.execute('SELECT name, value FROM metadata'))
+            indexes = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+            conn.close()
+            self.assertEqual(metadata['bounds'], '-9.4575,38.8467,-9.456,38.847')
+            self.assertEqual(metadata['format'], 'pbf')
+            self.assertEqual(subset_bounds(subset_file), small_bbox)
+            self.assertIn('tile_index', indexes)
+
+            # only the tiles intersecting an area of interest, and a subset can be replaced by its own subset
+            aoi = Point(-9.4573, 38.8468).buffer(0.00001)
+            self.assertEqual(subset(subset_file, subset_file, small_bbox, aoi), 1)
+            self.assertEqual(list(read_tiles(subset_file, 17, small_bbox))[0][0][:3], (62092, 50164, 17))
+            self.assertFalse(op.exists(subset_file + '.tmp'))
+        finally:
+            shutil.rmtree(folder)
+
+    def test_max_zoom(self):
+        """Test reading the highest zoom level of the tiles"""
+        self.assertEqual(max_zoom(mbtiles_file), 17)
+
+    def test_subset_bounds(self):
+        """Test that only the bounding box of subsets is read, not the bounds metadata of any file"""
+        self.assertIsNone(subset_bounds(mbtiles_file))
+
+    def test_flip_y(self):
+        """Test private function _flip_y"""
+        self.assertEqual(_flip_y(50162, 17), 80909)
+        self.assertEqual(_flip_y(_flip_y(3, 2), 2), 3)
+
+    def test_connect(self):
+        """Test that MBTiles files are opened read-only"""
+        conn = connect(mbtiles_file)
+        try:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM tiles').fetchone()[0], 363)
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute('DELETE FROM tiles')
+        finally:
+            conn.close()
+
+    def test_read_tiles_compressed(self):
+        """Test that tiles can be read without uncompressing their data"""
+        compressed = [t for b in read_tiles(mbtiles_file, 17, bounding_box, compressed=True) for t in b]
+        self.assertTrue(all(t[3][:2] == b'\x1f\x8b' for t in compressed))
+        self.assertEqual([t[:3] + (uncompress(t[3]),) for t in compressed],
+                         [t for b in read_tiles(mbtiles_file, 17, bounding_box) for t in b])
+
+    def test_uncompress(self):
+        """Test uncompressing tile data"""
+        self.assertEqual(uncompress(gzip.compress(b'tile')), b'tile')
+        self.assertEqual(uncompress(b'tile'), b'tile')
+
+    def test_large_file(self):
+        """Test reading the tiles within a bounding box from a larger MBTiles file"""
+        folder = tempfile.mkdtemp()
+        try:
+            large_file, bbox = _large_file(folder, 32)
+            scan, ranged, _ = _readers(large_file, bbox)
+            self.assertEqual(len(ranged()), 256)
+            self.assertEqual(scan(), sorted(ranged()))
+        finally:
+            shutil.rmtree(folder)
+
+    @benchmark
+    def test_benchmark(self):
+        """Compare reading the tiles within a bounding box from a large MBTiles file"""
+        folder = tempfile.mkdtemp()
+        try:
+            large_file, bbox = _large_file(folder, 128)
+            costs = [min(timeit.repeat(f, number=3, repeat=3)) / 3 for f in _readers(large_file, bbox)]
+        finally:
+            shutil.rmtree(folder)
+        self.assertLess(costs[1], costs[0])
+        self.assertLess(costs[2], costs[1])
+
+def _large_file(folder, size):
+    """Write a `size` x `size` tile file repeating the tiles of the fixture, returning it and a 16 x 16 tile bounding box in it"""
+    source = sqlite3.connect(mbtiles_file)
+    data = [row[0] for row in source.execute('SELECT tile_data FROM tiles')]
+    source.close()
+
+    x0, y0 = 62000, 50100
+    large_file = op.join(folder, 'large.mbtiles')
+    conn = sqlite3.connect(large_file)
+    conn.execute('CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)')
+    conn.executemany('INSERT INTO tiles VALUES (17, ?, ?, ?)', (
+        (x0 + i % size, _flip_y(y0 + i // size, 17), data[i % len(data)]) for i in range(size * size)))
+    conn.execute('CREATE UNIQUE INDEX tile_index on tiles (zoom_level, tile_column, tile_row)')
+    conn.commit()
+    conn.close()
+    offset = size // 2 - 8
+    west, _, _, north = bounds(x0 + offset, y0 + offset, 17)
+    _, south, east, _ = bounds(x0 + offset + 15, y0 + offset + 15, 17)
+    return large_file, [west, south, east, north]
+
+def _readers(large_file, bbox):
+    """Return functions reading the tiles within a bounding box with a full scan, a range query, and a range
+    query leaving the tiles compressed"""
+    xmin, ymin, xmax, ymax = tile_range(bbox, 17)
+
+    def scan():
+        """read every tile and keep those within the bounding box, uncompressed"""
+        conn = sqlite3.connect(large_file)
+        result = [(x, _flip_y(row, 17), 17, uncompress(tile_data))
+                  for x, row, tile_data in conn.execute('SELECT tile_column, tile_row, tile_data FROM tiles')
+                  if xmin <= x <= xmax and ymin <= _flip_y(row, 17) <= ymax]
+        conn.close()
+        return sorted(result)
+
+    def ranged():
+        """read the tiles within the bounding box, uncompressed"""
+        return [t for b in read_tiles(large_file, 17, bbox) for t in b]
+
+    def ranged_compressed():
+        """read the tiles within the bounding box, leaving them to be uncompressed by the workers"""
+        return [t for b in read_tiles(large_file, 17, bbox, compressed=True) for t in b]
+
+    return scan, ranged, ranged_compressed
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Tests for overzoom.py"""
+import unittest
+
+import mapbox_vector_tile
+from shapely.geometry import shape, box
+
+from label_maker.overzoom import split_tile, _clip
+from label_maker.vector_tile import decode
+
+def _tile(*features):
+    """Encode and lazily decode a tile with an osm layer of (WKT geometry, properties) features"""
+    return decode(mapbox_vector_tile.encode(dict(name='osm', features=[
+        dict(geometry=geometry, properties=properties) for geometry, properties in features])))
+
+class TestOverzoom(unittest.TestCase):
+    """Tests for splitting tiles into their child tiles"""
+    def test_split_tile(self):
+        """Test that features are scaled into the child tiles they overlap"""
+        tile = _tile(('POINT (100 100)', dict(amenity='bench')),
+                     ('POLYGON ((3000 3000, 3500 3000, 3500 3500, 3000 3500, 3000 3000))', dict(building='yes')))
+        children = split_tile(tile, 1, 2, 3, 4)
+        # the y axis points up, so the bottom left quarter of the tile is the child in the second row
+        self.assertEqual([child[:2] for child in children], [(2, 5), (3, 4)])
+        point, polygon = children[0][2]['osm']['features'], children[1][2]['osm']['features']
+        self.assertEqual(point[0]['geometry'], dict(type='Point', coordinates=[200, 200]))
+        self.assertEqual(point[0]['properties'], dict(amenity='bench'))
+        self.assertEqual(shape(polygon[0]['geometry']).bounds, (1904, 1904, 2904, 2904))
+        self.assertEqual(children[1][2]['osm']['extent'], 4096)
+
+        # at the same zoom level, the tile is returned as is
+        children = split_tile(tile, 1, 2, 3, 3)
+        self.assertEqual([child[:2] for child in children], [(1, 2)])
+        self.assertEqual(len(children[0][2]['osm']['features']), 2)
+
+    def test_split_tile_clip(self):
+        """Test that features crossing child tiles are clipped to each buffered child tile"""
+        tile = _tile(('LINESTRING (0 1000, 4096 1000)', dict(highway='primary')),
+                     ('POLYGON ((1000 1000, 3000 1000, 3000 3000, 1000 3000, 1000 1000))', dict(landuse='farmland')))
+        children = dict(((x, y), child) for x, y, child in split_tile(tile, 0, 0, 0, 2))
+        self.assertEqual(sorted(children), [(0, 1), (0, 2), (0, 3), (1, 1), (1, 2), (1, 3), (2, 1), (2, 2), (2, 3),
+                                            (3, 3)])
+        # the line crosses the bottom row, and is clipped to the buffer of 80 units around each tile
+        for x in range(4):
+            features = children[(x, 3)]['osm']['features']
+            self.assertEqual(features[0]['properties'], dict(highway='primary'))
+            xmin, _, xmax, _ = shape(features[0]['geometry']).bounds
+            self.assertEqual((xmin, xmax), (0 if x == 0 else -80, 4096 if x == 3 else 4176))
+        # the polygon covers the middle child and is clipped at the edges of the others
+        middle = shape(children[(1, 2)]['osm']['features'][0]['geometry'])
+        self.assertEqual(middle.bounds, (-80, -80, 4176, 4176))
+        corner = shape(children[(0, 1)]['osm']['features'][0]['geometry'])
+        self.assertEqual(corner.bounds, (4000, -80, 4176, 3808))
+
+        # children outside of the tile range are left out
+        children = split_tile(tile, 0, 0, 0, 2, tile_range=(1, 2, 3, 3))
+        self.assertEqual([child[:2] for child in children], [(1, 2), (1, 3), (2, 2), (2, 3), (3, 3)])
+
+    def test_clip(self):
+        """Test clipping geometries, keeping parts of the same dimension"""
+        polygon = dict(type='Polygon', coordinates=[[[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]]])
+        self.assertTrue(shape(_clip(polygon, 5, 5, 20, 20)).equals(box(5, 5, 10, 10)))
+        self.assertIsNone(_clip(polygon, 20, 20, 30, 30))
+        # a polygon touching the rectangle along an edge has no area left
+        self.assertIsNone(_clip(polygon, 10, 0, 20, 10))
+        points = dict(type='MultiPoint', coordinates=[[0, 0], [50, 50]])
+        self.assertEqual(_clip(points, 10, 10, 100, 100), dict(type='Point', coordinates=(50.0, 50.0)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+"""Tests for retiled.py"""
+from contextlib import redirect_stdout
+import io
+import json
+import os
+from os import path as op
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from label_maker.label import make_labels
+from label_maker.mbtiles import tile_range
+from label_maker.retiled import RetiledManifest, intersection, subtract, range_bounds, range_box
+
+mbtiles_file = 'test/fixtures/integration/portugal-z17.mbtiles'
+
+class TestRetiled(unittest.TestCase):
+    """Tests for reusing retiled files across bounding boxes"""
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_intersection(self):
+        """Test intersecting tile ranges"""
+        self.assertEqual(intersection((0, 0, 9, 9), (5, -5, 20, 3)), (5, 0, 9, 3))
+        self.assertIsNone(intersection((0, 0, 9, 9), (10, 0, 20, 9)))
+
+    def test_subtract(self):
+        """Test that the tiles of a range outside of another are covered once"""
+        a, b = (0, 0, 9, 9), (3, 4, 5, 9)
+        tiles = set((x, y) for part in subtract(a, b)
+                    for x in range(part[0], part[2] + 1) for y in range(part[1], part[3] + 1))
+        self.assertEqual(sum((p[2] - p[0] + 1) * (p[3] - p[1] + 1) for p in subtract(a, b)), len(tiles))
+        self.assertEqual(tiles, set((x, y) for x in range(10) for y in range(10)
+                                    if not (3 <= x <= 5 and 4 <= y <= 9)))
+        self.assertEqual(subtract(a, a), [])
+
+    def test_range_bounds(self):
+        """Test that the bounding boxes of tile ranges give the same tile ranges"""
+        rng = (62092, 50162, 62094, 50164)
+        self.assertEqual(tile_range(range_bounds(rng, 17), 17), rng)
+        self.assertEqual(tile_range(range_box(rng, 17), 17), rng)
+        self.assertEqual(tile_range(range_box((62092, 50162, 62092, 50162), 17), 17), (62092, 50162, 62092, 50162))
+
+    def test_plan(self):
+        """Test that a tile range is split into the covered and missing parts"""
+        source = op.join(self.folder, 'portugal.mbtiles')
+        shutil.copyfile(mbtiles_file, source)
+        manifest = RetiledManifest(self.folder)
+        for name, rng in [('a', (0, 0, 4, 9)), ('b', (3, 0, 9, 4))]:
+            shutil.copyfile(mbtiles_file, op.join(self.folder, name))
+            manifest.add(source, 17, op.join(self.folder, name), rng)
+
+        parts, missing = RetiledManifest(self.folder).plan(source, 17, (2, 2, 7, 7))
+        self.assertEqual(parts, [(op.join(self.folder, 'a'), (2, 2, 4, 7)), (op.join(self.folder, 'b'), (5, 2, 7, 4))])
+        self.assertEqual(missing, [(5, 5, 7, 7)])
+
+        # files of other zoom levels, or retiled from a source which has changed, aren't used
+        self.assertEqual(manifest.plan(source, 16, (2, 2, 7, 7)), ([], [(2, 2, 7, 7)]))
+        os.utime(source, (0, 0))
+        self.assertEqual(manifest.plan(source, 17, (2, 2, 7, 7)), ([], [(2, 2, 7, 7)]))
+
+    def test_legacy(self):
+        """Test that a retiled file missing from the manifest is added for the bounding box it's labeled with"""
+        config = json.load(open('test/fixtures/integration/config.integration.json'))
+        config.update(dest_folder=self.folder, sparse=False, workers=1)
+        legacy_file = op.join(self.folder, 'portugal-z17.mbtiles')
+        shutil.copyfile(mbtiles_file, legacy_file)
+        source = op.join(self.folder, 'portugal.mbtiles')
+        target = tile_range(config['bounding_box'], 17)
+        self.assertFalse(RetiledManifest(self.folder).listed(legacy_file))
+
+        # the QA tiles aren't needed
+        with redirect_stdout(io.StringIO()):
+            make_labels(**config)
+        self.assertEqual(len(np.load(op.join(self.folder, 'labels.npz')).files),
+                         (target[2] - target[0] + 1) * (target[3] - target[1] + 1))
+        manifest = RetiledManifest(self.folder)
+        self.assertTrue(manifest.listed(legacy_file))
+        self.assertEqual(manifest.plan(source, 17, target), ([(legacy_file, target)], []))
+
+        # outside of that bounding box, tiles are missing
+        wider = (target[0] - 2, target[1], target[2], target[3])
+        self.assertEqual(manifest.plan(source, 17, wider),
+                         ([(legacy_file, target)], [(target[0] - 2, target[1], target[0] - 1, target[3])]))
+
+    def test_make_labels(self):
+        """Test that labels read from several retiled files are the same as from one"""
+        config = json.load(open('test/fixtures/integration/config.integration.json'))
+        config.update(dest_folder=op.join(self.folder, 'one'), sparse=False, workers=1)
+        os.makedirs(config['dest_folder'])
+        shutil.copyfile(mbtiles_file, op.join(config['dest_folder'], 'portugal-z17.mbtiles'))
+        with redirect_stdout(io.StringIO()):
+            make_labels(**config)
+        expected = np.load(op.join(config['dest_folder'], 'labels.npz'))
+
+        # the tiles of two columns in one file, of the third in another
+        config.update(dest_folder=op.join(self.folder, 'two'))
+        os.makedirs(config['dest_folder'])
+        source = op.join(config['dest_folder'], 'portugal.mbtiles')
+        manifest = RetiledManifest(config['dest_folder'])
+        xmin, ymin, xmax, ymax = tile_range(config['bounding_box'], 17)
+        for name, rng in [('a', (xmin, ymin, xmin + 1, ymax)), ('b', (xmin + 2, ymin, xmax, ymax))]:
+            shutil.copyfile(mbtiles_file, op.join(config['dest_folder'], name))
+            manifest.add(source, 17, op.join(config['dest_folder'], name), rng)
+        with redirect_stdout(io.StringIO()):
+            make_labels(**config)
+        labels = np.load(op.join(config['dest_folder'], 'labels.npz'))
+        self.assertEqual(sorted(labels.files), sorted(expected.files))
+        for tile in expected.files:
+            self.assertTrue(np.array_equal(labels[tile], expected[tile]))
+
+    def test_missing_source(self):
+        """Test that tiles which aren't covered without the QA tiles to retile them are an error"""
+        config = json.load(open('test/fixtures/integration/config.integration.json'))
+        config.update(dest_folder=self.folder, sparse=False, workers=1)
+        source = op.join(self.folder, 'portugal.mbtiles')
+        xmin, ymin, xmax, ymax = tile_range(config['bounding_box'], 17)
+        shutil.copyfile(mbtiles_file, op.join(self.folder, 'a'))
+        RetiledManifest(self.folder).add(source, 17, op.join(self.folder, 'a'), (xmin, ymin, xmax - 1, ymax))
+        with self.assertRaises(ValueError) as context:
+            make_labels(**config)
+        self.assertIn(source, str(context.exception))
+        self.assertIn(str([(xmax, ymin, xmax, ymax)]), str(context.exception))
+        self.assertFalse(op.exists(op.join(self.folder, 'labels.npz')))
+
+    def test_retile_missing(self):
+        """Test that the missing tile ranges are retiled separately, from one decoding of the QA tiles"""
+        config = json.load(open('test/fixtures/integration/config.integration.json'))
+        config.update(dest_folder=self.folder, sparse=False, workers=1, tippecanoe=True)
+        source = op.join(self.folder, 'portugal.mbtiles')
+        shutil.copyfile(mbtiles_file, source)
+        xmin, ymin, xmax, ymax = tile_range(config['bounding_box'], 17)
+        shutil.copyfile(mbtiles_file, op.join(self.folder, 'a'))
+        RetiledManifest(self.folder).add(source, 17, op.join(self.folder, 'a'), (xmin + 1, ymin, xmin + 1, ymax))
+
+        def filter_qa_tiles(mbtiles, geojson_file, bounding_boxes, workers=None):
+            """write a point in the first tile of each column"""
+            with open(geojson_file, 'w') as f:
+                for x in range(xmin, xmax + 1):
+                    point = dict(type='Point', coordinates=list(range_box((x, ymin, x, ymin), 17)[:2]))
+                    f.write(json.dumps(dict(type='Feature', geometry=point, properties=dict(x=x))) + '\n')
+
+        retiled = {}
+        def retile(geojson_file, retiled_file, zoom, options=()):
+            """copy the fixture, which covers the bounding box, recording the features"""
+            with open(geojson_file) as f:
+                retiled[op.basename(retiled_file)] = [json.loads(line)['properties']['x'] for line in f]
+            shutil.copyfile(mbtiles_file, retiled_file)
+
+        with mock.patch('label_maker.label._filter_qa_tiles', side_effect=filter_qa_tiles) as decode, \
+                mock.patch('label_maker.label._retile', side_effect=retile), redirect_stdout(io.StringIO()):
+            make_labels(**config)
+        missing = [(xmin, ymin, xmin, ymax), (xmin + 2, ymin, xmax, ymax)]
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(decode.call_args[0][2], [range_bounds(rng, 17) for rng in missing])
+        # the cached column isn't retiled
+        names = ['portugal-z17-{}-{}-{}-{}.mbtiles'.format(*rng) for rng in missing]
+        self.assertEqual(retiled, {names[0]: [xmin], names[1]: list(range(xmin + 2, xmax + 1))})
+        manifest = RetiledManifest(self.folder)
+        self.assertEqual(manifest.plan(source, 17, (xmin, ymin, xmax, ymax))[1], [])
+        self.assertEqual(len(np.load(op.join(self.folder, 'labels.npz')).files),
+                         (xmax - xmin + 1) * (ymax - ymin + 1))
+        # the intermediate GeoJSON files are removed
+        self.assertEqual([name for name in os.listdir(self.folder)
+                          if name.startswith('portugal-z17') and name.endswith('.geojson')], [])
+
+if __name__ == '__main__':
+    unittest.main()
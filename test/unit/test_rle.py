@@ -0,0 +1,80 @@
+"""Tests for rle.py"""
+import json
+from os import path as op
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from label_maker import rle, tile_id
+from label_maker.label import _mapper
+from label_maker.label_store import LabelStoreWriter
+from label_maker.mbtiles import read_tiles
+from test.unit import benchmark
+
+class TestRLE(unittest.TestCase):
+    """Tests for run-length encoding segmentation labels"""
+    def test_encode_decode(self):
+        """Test that masks are run-length encoded and decoded losslessly"""
+        mask = np.zeros((256, 256), dtype=np.uint8)
+        mask[3:9, 4:200] = 2
+        mask[255, 255] = 1
+        runs = rle.encode(mask)
+        self.assertEqual(runs.dtype, np.uint32)
+        self.assertEqual(runs[:3].tolist(), [[0, 3 * 256 + 4], [2, 196], [0, 60]])
+        self.assertEqual(runs[-1].tolist(), [1, 1])
+        self.assertEqual(int(runs[:, 1].sum()), 256 * 256)
+        decoded = rle.decode(runs)
+        self.assertEqual(decoded.dtype, np.uint8)
+        self.assertTrue(np.array_equal(decoded, mask))
+
+        self.assertEqual(rle.encode(np.zeros((256, 256))).tolist(), [[0, 256 * 256]])
+        self.assertEqual(rle.encode(np.empty(0)).shape, (0, 2))
+        self.assertTrue(np.array_equal(rle.decode(rle.encode(np.arange(6).reshape(2, 3)), (2, 3)),
+                                       np.arange(6).reshape(2, 3)))
+
+    def test_class_counts(self):
+        """Test that pixel counts are computed without decoding"""
+        runs = np.array([[0, 10], [2, 5], [0, 3], [2, 1]])
+        self.assertEqual(rle.class_counts(runs, 3).tolist(), [13, 0, 6, 0])
+
+    @benchmark
+    def test_benchmark(self):
+        """Compare the memory and disk used by dense and run-length encoded segmentation labels"""
+        config = json.load(open('test/fixtures/integration/config.integration.segmentation.json'))
+        args = dict(ml_type='segmentation', classes=config['classes'])
+        labels = [_mapper(x, y, z, data, args)
+                  for batch in read_tiles('test/fixtures/integration/portugal-z17.mbtiles',
+                                          config['zoom'], config['bounding_box'])
+                  for x, y, z, data in batch]
+        dense = [(tile, rle.decode(runs)) for tile, runs in labels]
+        for (_, runs), (_, mask) in zip(labels, dense):
+            self.assertTrue(np.array_equal(rle.encode(mask), runs))
+
+        dense_bytes = sum(mask.nbytes for _, mask in dense)
+        rle_bytes = sum(runs.nbytes for _, runs in labels)
+
+        dest_folder = tempfile.mkdtemp()
+        try:
+            with LabelStoreWriter(op.join(dest_folder, 'dense')) as writer:
+                for tile, mask in dense:
+                    writer.write(tile, mask)
+            with LabelStoreWriter(op.join(dest_folder, 'rle'), np.uint8, 'rle', (256, 256)) as writer:
+                for tile, runs in labels:
+                    writer.write_encoded(tile, runs)
+            np.savez(op.join(dest_folder, 'labels.npz'), **{tile_id.to_name(tile): mask for tile, mask in dense})
+            npz_disk = op.getsize(op.join(dest_folder, 'labels.npz'))
+            dense_disk = op.getsize(op.join(dest_folder, 'dense', 'data.bin'))
+            rle_disk = op.getsize(op.join(dest_folder, 'rle', 'data.bin'))
+        finally:
+            shutil.rmtree(dest_folder)
+
+        self.assertEqual(len(labels), 9)
+        self.assertEqual(dense_bytes, len(labels) * 256 * 256)
+        self.assertLess(rle_bytes * 10, dense_bytes)
+        self.assertLess(rle_disk * 10, dense_disk)
+        self.assertLess(rle_disk, npz_disk)
+
+if __name__ == '__main__':
+    unittest.main()
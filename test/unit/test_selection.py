@@ -0,0 +1,105 @@
+"""Tests for selection.py"""
+from os import path as op
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from label_maker import rle, tile_id
+from label_maker.label_store import LabelStoreWriter, LabelStore, TileCoverage
+from label_maker.selection import TileSelection, class_counts, store_class_counts
+
+class TestSelection(unittest.TestCase):
+    """Tests for selecting tiles by class"""
+    def setUp(self):
+        self.dest_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dest_folder)
+
+    def _store(self, labels, **kwargs):
+        """Write labels to a store and open it"""
+        store_folder = op.join(self.dest_folder, 'label_store')
+        with LabelStoreWriter(store_folder, **kwargs) as writer:
+            for tile, label in labels:
+                writer.write(tile, label)
+        return LabelStore(store_folder)
+
+    def test_class_counts(self):
+        """Test counting the classes of each type of label"""
+        self.assertEqual(class_counts('classification', np.array([0, 1, 0]), 2).tolist(), [0, 1, 0])
+        bboxes = np.array([[0, 0, 1, 1, 2], [0, 0, 1, 1, 2]])
+        self.assertEqual(class_counts('object-detection', bboxes, 2).tolist(), [0, 0, 2])
+        self.assertEqual(class_counts('object-detection', np.empty((0, 5), dtype=np.int64), 2).tolist(), [0, 0, 0])
+        mask = np.zeros((256, 256), dtype=np.uint8)
+        mask[:2, :3] = 1
+        self.assertEqual(class_counts('segmentation', rle.encode(mask), 2).tolist(), [256 * 256 - 6, 6, 0])
+
+    def test_tile_selection(self):
+        """Test selecting positive and background tiles from a class-presence bitmask"""
+        tiles = tile_id.from_names(['1-2-3', '1-3-3', '2-2-3', '2-3-3'])
+        presence = np.zeros((4, 10), dtype=bool)
+        presence[0, 9] = presence[2, 1] = presence[2, 3] = True
+        presence[1, 0] = presence[3, 0] = True
+        coverage = TileCoverage(3, (1, 2, 3, 4), tiles)
+        selection = TileSelection(tiles, presence, coverage)
+        self.assertEqual(selection.bitmask.shape, (4, 2))
+        self.assertEqual(selection.positive_mask().tolist(), [True, False, True, False])
+        self.assertEqual(tile_id.to_names(selection.positive()), ['1-2-3', '2-2-3'])
+        self.assertEqual(tile_id.to_names(selection.positive(9)), ['1-2-3'])
+        self.assertEqual(tile_id.to_names(selection.positive(3)), ['2-2-3'])
+        self.assertEqual(len(selection.positive(2)), 0)
+        self.assertEqual(tile_id.to_names(selection.background()), ['1-3-3', '2-3-3'])
+        self.assertEqual(selection.n_background, 2 + 5)
+
+        sample = selection.sample_background(7)
+        self.assertEqual(set(sample.tolist()),
+                         set(tiles[[1, 3]].tolist()) | set(coverage.implicit_ids(range(5)).tolist()))
+        self.assertEqual(selection.sample_background(3, seed=42).tolist(),
+                         selection.sample_background(3, seed=42).tolist())
+        with self.assertRaises(ValueError):
+            selection.sample_background(8)
+
+        # implicit tiles with a class are positive examples, not background
+        default = np.zeros(10, dtype=bool)
+        default[1] = True
+        selection = TileSelection(tiles, presence, coverage, default)
+        self.assertEqual(len(selection.positive()), 2 + 5)
+        self.assertEqual(len(selection.positive(1)), 1 + 5)
+        self.assertEqual(selection.n_background, 2)
+        self.assertEqual(set(selection.sample_background(2).tolist()), set(tiles[[1, 3]].tolist()))
+
+    def test_store_class_counts(self):
+        """Test that the class counts of each label are read from the store's payload"""
+        store = self._store([('1-2-3', np.array([1, 0, 0])), ('1-3-3', np.array([0, 1, 1]))])
+        self.assertEqual(store_class_counts(store, 'classification', 2).tolist(), [[1, 0, 0], [0, 1, 1]])
+
+        store = self._store([('1-2-3', np.array([[0, 0, 1, 1, 2], [0, 0, 1, 1, 2]])),
+                             ('1-3-3', np.empty((0, 5), dtype=np.int64)),
+                             ('2-2-3', np.array([[0, 0, 1, 1, 1]]))])
+        self.assertEqual(store.label_lengths().tolist(), [2, 0, 1])
+        self.assertEqual(store_class_counts(store, 'object-detection', 2).tolist(), [[0, 0, 2], [0, 0, 0], [0, 1, 0]])
+
+        mask = np.zeros((256, 256), dtype=np.uint8)
+        mask[:2, :3] = 2
+        store = self._store([('1-2-3', mask), ('1-3-3', np.zeros((256, 256), dtype=np.uint8))], encoding='rle')
+        expected = [[256 * 256 - 6, 0, 6], [256 * 256, 0, 0]]
+        self.assertEqual(store_class_counts(store, 'segmentation', 2).tolist(), expected)
+        store = self._store([('1-2-3', mask), ('1-3-3', np.zeros((256, 256), dtype=np.uint8))])
+        self.assertEqual(store_class_counts(store, 'segmentation', 2).tolist(), expected)
+
+    def test_from_store(self):
+        """Test selecting from a store with implicit labels"""
+        store_folder = op.join(self.dest_folder, 'label_store')
+        with LabelStoreWriter(store_folder, np.uint8, 'rle', (256, 256)) as writer:
+            writer.write('2-3-3', np.ones((256, 256), dtype=np.uint8))
+            writer.write('2-2-3', np.zeros((256, 256), dtype=np.uint8))
+            writer.set_coverage(3, (1, 2, 3, 4), np.zeros((256, 256), dtype=np.uint8))
+        selection = TileSelection.from_store(LabelStore(store_folder), 'segmentation', 1)
+        self.assertEqual(tile_id.to_names(selection.positive()), ['2-3-3'])
+        self.assertEqual(tile_id.to_names(selection.background()), ['2-2-3'])
+        self.assertEqual(selection.n_background, 8)
+
+if __name__ == '__main__':
+    unittest.main()
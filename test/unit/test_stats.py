@@ -0,0 +1,103 @@
+"""Tests for stats.py"""
+from contextlib import redirect_stdout
+import io
+import json
+import os
+from os import path as op
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from label_maker import rle
+from label_maker.label import make_labels
+from label_maker.label_store import LabelStoreWriter, LabelStore, open_labels
+from label_maker.stats import LabelStats, label_stats, STATS_FILE
+
+classes = [dict(name='Roads'), dict(name='Buildings')]
+
+class TestStats(unittest.TestCase):
+    """Tests for per-class label statistics"""
+    def setUp(self):
+        self.dest_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dest_folder)
+
+    def test_label_stats(self):
+        """Test accumulating statistics and printing the summary"""
+        stats = LabelStats('object-detection', classes)
+        stats.add_label(np.array([[0, 0, 1, 1, 2], [0, 0, 1, 1, 2], [0, 0, 1, 1, 1]]))
+        stats.add_label(np.array([[0, 0, 1, 1, 2]]))
+        stats.add_label(np.empty((0, 5), dtype=np.int64), 10)
+        self.assertEqual(stats.tile_counts.tolist(), [0, 1, 2])
+        self.assertEqual(stats.feature_counts.tolist(), [0, 1, 3])
+        self.assertEqual((stats.total_tiles, stats.positive_tiles, stats.max_features), (12, 2, 3))
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            stats.print_summary()
+        self.assertEqual(out.getvalue(), '---\nRoads: 1 features in 1 tiles\nBuildings: 3 features in 2 tiles\n'
+                                         'Total tiles: 12\n')
+        self.assertEqual(LabelStats.from_dict(json.loads(json.dumps(stats.to_dict()))).to_dict(), stats.to_dict())
+
+        stats = LabelStats('segmentation', classes)
+        mask = np.zeros((256, 256), dtype=np.uint8)
+        mask[:2, :3] = 2
+        stats.add_label(rle.encode(mask))
+        self.assertEqual(stats.feature_counts.tolist(), [256 * 256 - 6, 0, 6])
+
+    def test_from_store(self):
+        """Test that statistics computed from a store match those accumulated while labeling"""
+        labels = [('1-2-3', np.array([0, 1, 1])), ('1-3-3', np.array([0, 0, 1])), ('2-2-3', np.array([1, 0, 0]))]
+        expected = LabelStats('classification', classes)
+        store_folder = op.join(self.dest_folder, 'label_store')
+        with LabelStoreWriter(store_folder) as writer:
+            for tile, label in labels:
+                writer.write(tile, label)
+                expected.add_label(label)
+            writer.set_coverage(3, (1, 2, 2, 3), np.array([1, 0, 0]))
+        expected.add_label(np.array([1, 0, 0]))
+        self.assertEqual(LabelStats.from_store(LabelStore(store_folder), 'classification', classes).to_dict(),
+                         expected.to_dict())
+
+    def test_label_stats_file(self):
+        """Test that saved statistics are reused until the labels change"""
+        labels_file = op.join(self.dest_folder, 'labels.npz')
+        np.savez(labels_file, **{'1-2-3': np.array([0, 1, 0]), '1-3-3': np.array([1, 0, 0])})
+        stats = label_stats(self.dest_folder, 'classification', classes)
+        self.assertEqual(stats.tile_counts.tolist(), [1, 1, 0])
+        self.assertTrue(op.exists(op.join(self.dest_folder, STATS_FILE)))
+
+        # saved statistics are read as is
+        saved = stats.to_dict()
+        saved['total_tiles'] = 100
+        with open(op.join(self.dest_folder, STATS_FILE), 'w') as f:
+            json.dump(saved, f)
+        self.assertEqual(label_stats(self.dest_folder, 'classification', classes).total_tiles, 100)
+
+        # but not for other classes, or once the labels are newer
+        self.assertEqual(label_stats(self.dest_folder, 'classification', classes[:1]).total_tiles, 2)
+        np.savez(labels_file, **{'1-2-3': np.array([0, 1, 0])})
+        stats_mtime = op.getmtime(op.join(self.dest_folder, STATS_FILE))
+        os.utime(labels_file, (stats_mtime + 1, stats_mtime + 1))
+        self.assertEqual(label_stats(self.dest_folder, 'classification', classes).total_tiles, 1)
+
+    def test_sparse_labels(self):
+        """Test that in sparse mode, the saved statistics only count the tiles written"""
+        config = json.load(open('test/fixtures/integration/config.integration.json'))
+        config.update(dest_folder=self.dest_folder, classes=config['classes'][:1],
+                      background_ratio=2, sparse=True, workers=1)
+        shutil.copyfile('test/fixtures/integration/portugal-z17.mbtiles',
+                        op.join(self.dest_folder, 'portugal-z17.mbtiles'))
+        with redirect_stdout(io.StringIO()):
+            make_labels(**config)
+        with open(op.join(self.dest_folder, STATS_FILE)) as f:
+            saved = json.load(f)
+        expected = LabelStats.from_store(open_labels(self.dest_folder), 'classification', config['classes'])
+        self.assertEqual(saved, expected.to_dict())
+        self.assertEqual((saved['total_tiles'], saved['positive_tiles']), (3, 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""Tests for stream_filter.py"""
+import io
+import json
+import random
+import subprocess
+import sys
+import unittest
+
+from shapely.geometry import shape, box
+
+from label_maker.stream_filter import intersects, filter_lines, stream_filter, _envelope
+
+bounding_box = [-9.4575, 38.8467, -9.4510, 38.8513]
+
+def _features(n=500, seed=0):
+    """Return lines of random points, lines and polygons around the bounding box"""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(n):
+        x, y = rng.uniform(-9.47, -9.44), rng.uniform(38.84, 38.86)
+        w, h = rng.uniform(0, 0.004), rng.uniform(0, 0.004)
+        geometry = [dict(type='Point', coordinates=[x, y]),
+                    dict(type='LineString', coordinates=[[x, y], [x + w, y], [x + w, y + h]]),
+                    dict(type='Polygon', coordinates=[[[x, y], [x + w, y], [x + w, y + h], [x, y]]])][i % 3]
+        lines.append(json.dumps(dict(type='Feature', geometry=geometry, properties={'@id': i},
+                                     tippecanoe=dict(layer='osm', minzoom=12, maxzoom=12))) + '\n')
+    return lines
+
+def _expected(lines):
+    """Filter lines with shapely only, like the original stream filter"""
+    bbox = box(*bounding_box)
+    expected = []
+    for line in lines:
+        feature = json.loads(line)
+        feature.pop('tippecanoe')
+        if bbox.intersects(shape(feature['geometry'])):
+            expected.append(json.dumps(feature) + '\n')
+    return ''.join(expected)
+
+class TestStreamFilter(unittest.TestCase):
+    """Tests for filtering GeoJSON features by a bounding box"""
+    def test_intersects(self):
+        """Test features accepted or rejected by their envelope, and those crossing the bounding box edge"""
+        bbox = [0, 0, 10, 10]
+        self.assertTrue(intersects(dict(type='Point', coordinates=[5, 5]), bbox))
+        self.assertTrue(intersects(dict(type='Point', coordinates=[10, 5]), bbox))
+        self.assertFalse(intersects(dict(type='Point', coordinates=[11, 5]), bbox))
+        self.assertTrue(intersects(dict(type='LineString', coordinates=[[-5, 5], [15, 5]]), bbox))
+        # the envelope of this line overlaps the bounding box but the line doesn't
+        self.assertFalse(intersects(dict(type='LineString', coordinates=[[-5, 12], [12, 12], [12, -5]]), bbox))
+        self.assertFalse(intersects(dict(type='Polygon', coordinates=[]), bbox))
+        self.assertFalse(intersects(None, bbox))
+        collection = dict(type='GeometryCollection', geometries=[dict(type='Point', coordinates=[-5, 12]),
+                                                                 dict(type='Point', coordinates=[5, 5])])
+        self.assertTrue(intersects(collection, bbox))
+
+    def test_envelope(self):
+        """Test private function _envelope"""
+        self.assertEqual(_envelope([5, 10]), (5, 10, 5, 10))
+        self.assertEqual(_envelope([[5, 10], [1, 20], [3, -4]]), (1, -4, 5, 20))
+        self.assertEqual(_envelope([[[[0, 0], [10, 0], [10, 10], [0, 0]]], [[[-5, 3], [1, 3], [1, 4], [-5, 3]]]]),
+                         (-5, 0, 10, 10))
+        self.assertEqual(_envelope([[], [[1, 2], [3, 4]]]), (1, 2, 3, 4))
+        self.assertIsNone(_envelope([]))
+        self.assertIsNone(_envelope([[]]))
+
+    def test_filter_lines(self):
+        """Test that features are filtered like shapely, and the tippecanoe member is removed"""
+        lines = _features()
+        kept, count = filter_lines(lines + ['\n'], bounding_box)
+        self.assertEqual(count, len(lines))
+        self.assertEqual(kept, _expected(lines))
+        self.assertNotIn('tippecanoe', kept)
+        self.assertTrue(0 < kept.count('\n') < len(lines))
+
+    def test_filter_boxes(self):
+        """Test filtering by a list of bounding boxes keeps the features intersecting any of them"""
+        lines = _features()
+        west, south, east, north = bounding_box
+        middle = (west + east) / 2
+        halves = [[west, south, middle, north], [middle, south, east, north]]
+        self.assertEqual(filter_lines(lines, halves), (_expected(lines), len(lines)))
+        self.assertLess(len(filter_lines(lines, halves[:1])[0]), len(_expected(lines)))
+        out = io.StringIO()
+        self.assertEqual(stream_filter(lines, halves, out, 2, 16), len(lines))
+        self.assertEqual(out.getvalue(), _expected(lines))
+
+    def test_stream_filter(self):
+        """Test that the output is the same, in the same order, for any workers and chunk size"""
+        lines = _features()
+        expected = _expected(lines)
+        for workers, chunk_size in [(1, 1024), (1, 7), (2, 16), (3, 1)]:
+            out = io.StringIO()
+            self.assertEqual(stream_filter(lines, bounding_box, out, workers, chunk_size), len(lines))
+            self.assertEqual(out.getvalue(), expected)
+
+    def test_script(self):
+        """Test running the filter as a script, with the throughput reported on stderr"""
+        lines = _features(100)
+        result = subprocess.run([sys.executable, '-m', 'label_maker.stream_filter', json.dumps(bounding_box),
+                                 '--workers', '2'], input=''.join(lines), stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        self.assertEqual(result.stdout, _expected(lines))
+        self.assertRegex(result.stderr, r'Filtered 100 features in [\d.]+s \(\d+ features/sec\)')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+"""Tests for tile_features.py"""
+import json
+from os import path as op
+import shutil
+import tempfile
+import unittest
+
+from mercantile import feature, tiles
+
+from label_maker import tile_id
+from label_maker.tile_features import TileFeatureWriter, tile_bounds
+
+class TestTileFeatures(unittest.TestCase):
+    """Tests for streaming tile features"""
+    def setUp(self):
+        self.dest_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dest_folder)
+
+    def test_tile_bounds(self):
+        """Test that tile bounds match mercantile exactly"""
+        bbox_tiles = list(tiles(-9.5, 38.8, -9.3, 38.9, [0, 12, 17])) + [(0, 1, 1), (3, 7, 3), (0, 2**28 - 1, 28)]
+        ids = [tile_id.encode(*t) for t in bbox_tiles]
+        west, south, east, north = tile_bounds(ids)
+        for i, t in enumerate(bbox_tiles):
+            self.assertEqual(feature(t)['geometry']['coordinates'][0][:3],
+                             [[west[i], south[i]], [west[i], north[i]], [east[i], north[i]]])
+        self.assertEqual([len(b) for b in tile_bounds([])], [0, 0, 0, 0])
+
+    def test_tile_feature_writer(self):
+        """Test that streamed features form a FeatureCollection"""
+        geojson_file = op.join(self.dest_folder, 'classification.geojson')
+        bbox_tiles = list(tiles(-9.5, 38.8, -9.3, 38.9, [14]))
+        with TileFeatureWriter(geojson_file, batch_size=3) as writer:
+            for i, t in enumerate(bbox_tiles):
+                writer.write(tile_id.encode(*t), dict(label=[i, 1]))
+        self.assertEqual(writer.count, len(bbox_tiles))
+
+        with open(geojson_file) as f:
+            collection = json.load(f)
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        self.assertEqual(len(collection['features']), len(bbox_tiles))
+        for i, (t, feat) in enumerate(zip(bbox_tiles, collection['features'])):
+            self.assertEqual(feat, dict(type='Feature', geometry=feature(t)['geometry'], properties=dict(label=[i, 1])))
+
+        with TileFeatureWriter(geojson_file):
+            pass
+        with open(geojson_file) as f:
+            self.assertEqual(json.load(f), dict(type='FeatureCollection', features=[]))
+
+if __name__ == '__main__':
+    unittest.main()
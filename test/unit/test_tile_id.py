@@ -0,0 +1,52 @@
+"""Tests for tile_id.py"""
+import unittest
+
+import numpy as np
+from mercantile import tiles
+
+from label_maker import tile_id
+
+class TestTileId(unittest.TestCase):
+    """Tests for packed tile IDs"""
+    def test_encode_decode(self):
+        """Test that tile indices round trip through IDs, as scalars and arrays"""
+        self.assertEqual(tile_id.encode(0, 0, 0), 0)
+        self.assertEqual(tile_id.encode(1, 0, 1), (1 << 56) | 1)
+        self.assertEqual(tile_id.encode(0, 1, 1), (1 << 56) | 2)
+        self.assertEqual(tile_id.decode(tile_id.encode(62092, 50162, 17)), (62092, 50162, 17))
+        max_index = (1 << tile_id.MAX_ZOOM) - 1
+        self.assertEqual(tile_id.decode(tile_id.encode(max_index, max_index, tile_id.MAX_ZOOM)),
+                         (max_index, max_index, tile_id.MAX_ZOOM))
+        with self.assertRaises(ValueError):
+            tile_id.encode(0, 0, tile_id.MAX_ZOOM + 1)
+
+        xyz = np.array([(t.x, t.y, t.z) for t in tiles(-77.1, 38.8, -76.9, 39.0, [12, 13])])
+        ids = tile_id.encode(xyz[:, 0], xyz[:, 1], xyz[:, 2])
+        self.assertEqual(ids.dtype, np.int64)
+        self.assertEqual(len(np.unique(ids)), len(xyz))
+        self.assertTrue(np.array_equal(np.stack(tile_id.decode(ids), axis=1), xyz))
+        self.assertEqual(ids.tolist(), [tile_id.encode(*t) for t in xyz.tolist()])
+
+    def test_order(self):
+        """Test that IDs sort by zoom level, then along a Z-order curve"""
+        quadrants = [tile_id.encode(x, y, 1) for x, y in [(0, 0), (1, 0), (0, 1), (1, 1)]]
+        self.assertEqual(quadrants, sorted(quadrants))
+        self.assertLess(tile_id.encode(1, 1, 1), tile_id.encode(0, 0, 2))
+
+    def test_names(self):
+        """Test converting between IDs and x-y-z names"""
+        names = ['62092-50162-17', '0-0-0', '1-2-3']
+        ids = tile_id.from_names(names)
+        self.assertEqual(ids.tolist(), [tile_id.from_name(name) for name in names])
+        self.assertEqual(tile_id.to_names(ids), names)
+        self.assertEqual(tile_id.to_name(ids[0]), names[0])
+        self.assertEqual(tile_id.from_names([]).dtype, np.int64)
+        self.assertEqual(tile_id.as_id('1-2-3'), ids[2])
+        self.assertEqual(tile_id.as_id(ids[2]), ids[2])
+        self.assertEqual(tile_id.as_ids(names).tolist(), ids.tolist())
+        self.assertEqual(tile_id.as_ids(np.array(names)).tolist(), ids.tolist())
+        self.assertEqual(tile_id.as_ids(ids.tolist()).tolist(), ids.tolist())
+        self.assertEqual(tile_id.as_ids([]).dtype, np.int64)
+
+if __name__ == '__main__':
+    unittest.main()
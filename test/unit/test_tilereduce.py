@@ -0,0 +1,35 @@
+"""Tests for tilereduce.py"""
+import unittest
+
+from label_maker.tilereduce import tilereduce
+
+mbtiles_file = 'test/fixtures/integration/portugal-z17.mbtiles'
+bounding_box = [-9.4575, 38.8467, -9.4510, 38.8513]
+
+def _size_mapper(x, y, z, data, args):
+    """Return the tile index and its data size plus an offset"""
+    return ('{}-{}-{}'.format(x, y, z), len(data) + args['offset'])
+
+def _failing_mapper(x, y, z, data, args):
+    """Raise an exception for every tile"""
+    raise ValueError('failed {}-{}-{}'.format(x, y, z))
+
+class TestTileReduce(unittest.TestCase):
+    """Tests for the tile map/reduce engine"""
+    def test_tilereduce(self):
+        """Test that results are the same, in the same order, for any workers and chunk size"""
+        expected = list(tilereduce(mbtiles_file, 17, bounding_box, _size_mapper, dict(offset=1), workers=1))
+        self.assertEqual(len(expected), 9)
+        for workers, chunk_size in [(1, 1), (2, 1), (3, 4), (None, 64)]:
+            results = list(tilereduce(mbtiles_file, 17, bounding_box, _size_mapper, dict(offset=1),
+                                      workers=workers, chunk_size=chunk_size))
+            self.assertEqual(results, expected)
+
+    def test_tilereduce_error(self):
+        """Test that mapper exceptions are raised"""
+        for workers in [1, 2]:
+            with self.assertRaises(ValueError):
+                list(tilereduce(mbtiles_file, 17, bounding_box, _failing_mapper, dict(), workers=workers))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+"""Tests for vector_tile.py"""
+import timeit
+import unittest
+
+import mapbox_vector_tile
+from shapely.geometry import shape
+
+from label_maker.filter import ClassMatcher, MemoizedClassMatcher
+from label_maker.vector_tile import decode, geometry_bounds, _decode_value, _read_varint
+from test.unit import benchmark
+
+# test tile data has one building feature with bbox [100, 100, 300, 300] within the tile
+test_tile_data = b'\x1a5\n\x03osm\x12\x18\x12\x02\x00\x00\x18\x03"\x10\t\xc8\x01\xb8>\x1a\x00\x8f\x03\x90\x03\x00\x00\x90\x03\x0f\x1a\x08building"\x05\n\x03yes(\x80 x\x01'
+
+def _dense_tile(n=500):
+    """Encode a synthetic dense urban tile with mostly buildings and some roads"""
+    features = []
+    for i in range(n):
+        x, y = (i % 40) * 100, (i // 40) * 100
+        features.append(dict(geometry='POLYGON (({0} {1}, {2} {1}, {2} {3}, {0} {3}, {0} {1}))'.format(x, y, x + 80, y + 80),
+                             properties={'building': 'yes', '@id': i}))
+        if i % 10 == 0:
+            features.append(dict(geometry='LINESTRING ({0} {1}, {2} {1}, {2} {3})'.format(x, y, x + 400, y + 300),
+                                 properties={'highway': 'residential', '@id': n + i, 'lanes': 2.5, 'oneway': True}))
+    return mapbox_vector_tile.encode(dict(name='osm', features=features))
+
+class TestVectorTile(unittest.TestCase):
+    """Tests for lazy vector tile decoding"""
+
+    def _assert_decoded_equal(self, data):
+        expected = mapbox_vector_tile.decode(data)
+        tile = decode(data)
+        self.assertEqual(list(tile.keys()), list(expected.keys()))
+        for name, layer in expected.items():
+            self.assertEqual(tile[name]['extent'], layer['extent'])
+            self.assertEqual(tile[name]['version'], layer['version'])
+            self.assertEqual(len(tile[name]['features']), len(layer['features']))
+            for feat, expected_feat in zip(tile[name]['features'], layer['features']):
+                self.assertEqual(feat['properties'], expected_feat['properties'])
+                self.assertEqual(feat['id'], expected_feat['id'])
+                self.assertEqual(feat['type'], expected_feat['type'])
+                self.assertEqual(feat['geometry']['type'], expected_feat['geometry']['type'])
+                self.assertEqual(feat['geometry']['coordinates'], expected_feat['geometry']['coordinates'])
+
+    def test_decode(self):
+        """Test that decoded tiles match mapbox_vector_tile"""
+        self._assert_decoded_equal(test_tile_data)
+        self._assert_decoded_equal(_dense_tile(50))
+
+    def test_lazy_geometry(self):
+        """Test that geometries are only decoded when accessed"""
+        feat = decode(test_tile_data)['osm']['features'][0]
+        self.assertEqual(feat['properties'], dict(building='yes'))
+        self.assertFalse(feat['geometry'].decoded)
+        self.assertEqual(feat['geometry'].get('type'), 'Polygon')
+        self.assertFalse(feat['geometry'].decoded)
+        self.assertEqual(len(feat['geometry']['coordinates'][0]), 5)
+        self.assertTrue(feat['geometry'].decoded)
+        feat['geometry']['coordinates'] = [[[0, 0], [1, 0], [1, 1], [0, 0]]]
+        self.assertEqual(feat['geometry'].__geo_interface__['coordinates'], [[[0, 0], [1, 0], [1, 1], [0, 0]]])
+
+    def test_geometry_type(self):
+        """Test that geometry types derived from the commands match the decoded geometries"""
+        geometries = ['POINT (5 10)', 'MULTIPOINT (5 10, 1 20)', 'LINESTRING (5 10, 1 20, 3 40)',
+                      'MULTILINESTRING ((5 10, 1 20), (30 2, 4 4))', 'POLYGON ((0 0, 10 0, 10 10, 0 0))',
+                      'POLYGON ((0 0, 30 0, 30 30, 0 30, 0 0), (10 10, 10 20, 20 20, 10 10))',
+                      'MULTIPOLYGON (((0 0, 10 0, 10 10, 0 0)), ((20 20, 30 20, 30 30, 20 20)))']
+        data = mapbox_vector_tile.encode(dict(name='osm', features=[
+            dict(geometry=geometry, properties=dict(i=i)) for i, geometry in enumerate(geometries)]))
+        expected = [f['geometry']['type'] for f in mapbox_vector_tile.decode(data)['osm']['features']]
+        self.assertEqual(expected, ['Point', 'MultiPoint', 'LineString', 'MultiLineString', 'Polygon', 'Polygon',
+                                    'MultiPolygon'])
+        features = decode(data)['osm']['features']
+        self.assertEqual([f['geometry']['type'] for f in features], expected)
+        # only polygons with several rings are decoded
+        self.assertEqual([f['geometry'].decoded for f in features], [False] * 5 + [True] * 2)
+
+    def test_type_filter(self):
+        """Test that matching `$type` filters doesn't decode the geometry"""
+        classes = [dict(name='Buildings', filter=['all', ['==', '$type', 'Polygon'], ['has', 'building']]),
+                   dict(name='Roads', filter=['==', '$type', 'LineString'])]
+        data = _dense_tile(50)
+        for matcher in [ClassMatcher(classes), MemoizedClassMatcher(classes, 16)]:
+            features = decode(data)['osm']['features']
+            self.assertEqual([list(matcher.match(f)) for f in features],
+                             [list(matcher.match(f)) for f in mapbox_vector_tile.decode(data)['osm']['features']])
+            self.assertFalse(any(f['geometry'].decoded for f in features))
+            self.assertEqual([list(matcher.match(f)) for f in features].count([2]), 5)
+
+    def testgeometry_bounds(self):
+        """Test computing the bounds of GeoJSON-like geometries"""
+        geometries = [
+            dict(type='Point', coordinates=[5, 10]),
+            dict(type='MultiPoint', coordinates=[[5, 10], [1, 20]]),
+            dict(type='LineString', coordinates=[[5, 10], [1, 20], [3, -4]]),
+            dict(type='MultiLineString', coordinates=[[[5, 10], [1, 20]], [[30, 2], [4, 4]]]),
+            dict(type='Polygon', coordinates=[[[0, 0], [10, 0], [10, 10], [0, 0]], [[20, 20], [30, 20], [30, 30], [20, 20]]]),
+            dict(type='MultiPolygon', coordinates=[[[[0, 0], [10, 0], [10, 10], [0, 0]]], [[[-5, 3], [1, 3], [1, 4], [-5, 3]]]])
+        ]
+        for geometry in geometries:
+            self.assertEqual(tuple(geometry_bounds(geometry)), shape(geometry).bounds)
+        self.assertIsNone(geometry_bounds(dict(type='MultiPolygon', coordinates=[])))
+
+    def test_decode_value(self):
+        """Test private function _decode_value"""
+        self.assertEqual(_decode_value(b'\x0a\x03yes', 0, 5), 'yes')
+        self.assertEqual(_decode_value(b'\x20\x05', 0, 2), 5)
+        self.assertEqual(_decode_value(b'\x20' + b'\xff' * 9 + b'\x01', 0, 11), -1)
+        self.assertEqual(_decode_value(b'\x30\x03', 0, 2), -2)
+        self.assertEqual(_decode_value(b'\x38\x01', 0, 2), True)
+
+    def test_read_varint(self):
+        """Test private function _read_varint"""
+        self.assertEqual(_read_varint(b'\x05', 0), (5, 1))
+        self.assertEqual(_read_varint(b'\x00\xac\x02', 1), (300, 3))
+
+    def test_dense_tile(self):
+        """Test that classes match the same on a dense tile with full and lazy decoding"""
+        data = _dense_tile()
+        matcher = ClassMatcher([dict(name='Roads', filter=['has', 'highway'])])
+        self.assertEqual([matcher.match(f) for f in mapbox_vector_tile.decode(data)['osm']['features']],
+                         [matcher.match(f) for f in decode(data)['osm']['features']])
+
+    @benchmark
+    def test_benchmark(self):
+        """Compare matching classes on a dense tile with full and lazy decoding"""
+        data = _dense_tile()
+        matcher = ClassMatcher([dict(name='Roads', filter=['has', 'highway'])])
+
+        def full():
+            """decode every geometry, then match"""
+            return [matcher.match(f) for f in mapbox_vector_tile.decode(data)['osm']['features']]
+
+        def lazy():
+            """decode properties only, then match"""
+            return [matcher.match(f) for f in decode(data)['osm']['features']]
+
+        full_cost = min(timeit.repeat(full, number=3, repeat=3))
+        lazy_cost = min(timeit.repeat(lazy, number=3, repeat=3))
+        self.assertLess(lazy_cost, full_cost)
+
+if __name__ == '__main__':
+    unittest.main()